@@ -1,8 +1,7 @@
 import bpy
+import blf
 import gpu
 import time
-import threading
-from gpu_extras.batch import batch_for_shader
 
 bl_info = {
     "name": "Just Snap",
@@ -17,41 +16,67 @@ bl_info = {
 }
 
 from . import ui
+from . import just_snap
 from .just_snap import JustSnap
+from .just_snap.overlay import OverlayBatch
+from .just_snap.scheduler import SnapScheduler
 
 classes = (
     ui,
+    # depsgraph_update_post、load_post、undo_post，维护常驻的场景物体索引
+    just_snap,
 )
 
-shader = gpu.shader.from_builtin('3D_UNIFORM_COLOR')
-
 
 def draw(self, ctx):
-    
+    # 按重绘间隔调整查询的频率
+    self.scheduler.frame()
+    if len(self.overlay) == 0:
+        return
     gpu.state.blend_set("ALPHA")
     # gpu.state.depth_test_set("LESS")
     gpu.state.point_size_set(10)
-    # print(self.coords)
-    batch = batch_for_shader(shader, 'POINTS', {"pos": self.coords})
-    shader.bind()
-    shader.uniform_float("color", (0.8, 0, 0, 1.0))
-    batch.draw(shader)
+    # batch 只在吸附点改变时重建
+    self.overlay.draw((0.8, 0, 0, 1.0))
     gpu.state.point_size_set(5)
 
+def draw_hud(self, ctx):
+    '''显示吸附查询的耗时统计'''
+    profiler = self.jsnap.profiler
+    if not profiler.enabled:
+        return
+    font_id = 0
+    blf.size(font_id, 12, 72)
+    blf.color(font_id, 1.0, 1.0, 1.0, 1.0)
+    y = 60
+    lines = profiler.lines() + [self.scheduler.summary(), self.jsnap.prefetcher.summary()]
+    for line in reversed(lines):
+        blf.position(font_id, 20, y, 0)
+        blf.draw(font_id, line)
+        y += 16
+
 class JSNAP_OT_test(bpy.types.Operator):
     bl_idname = "jsnap.test"
     bl_label = ""
     bl_description=""
     bl_options = {'REGISTER', 'UNDO'}
 
-    def mousemove(self):
-        isSnaped, screen_pos, location, obj_name, closest = self.jsnap.get_snap_point(self.ctx, self.evt)
+    def mousemove(self, event):
+        # 由 scheduler 在定时器中调用，event 为鼠标事件的快照
+        # 总是在当前鼠标位置用已有的候选点查询，后台提取由 scheduler 另外提交
+        self.jsnap.update_mouse(event)
+        self.update_snap()
+
+    def update_snap(self):
+        isSnaped, screen_pos, location, obj_name, closest = self.jsnap.query_snap_point()
         if isSnaped:
             self.ctx.scene.cursor.location = location
             self.coords = [location]
         else:
             self.coords = closest
-        self.area.tag_redraw()
+        # 吸附点没有改变时不需要重绘 (显示耗时统计时仍然每次重绘)
+        if self.overlay.set_points(self.coords) or self.jsnap.profiler.enabled:
+            self.area.tag_redraw()
 
     def __init__(self):
         print("Start")
@@ -60,7 +85,10 @@ class JSNAP_OT_test(bpy.types.Operator):
         print("End")
 
     def execute(self, context):
+        self.scheduler.cancel()
+        context.window_manager.event_timer_remove(self.timer)
         bpy.types.SpaceView3D.draw_handler_remove(self.test_handler, 'WINDOW')
+        bpy.types.SpaceView3D.draw_handler_remove(self.hud_handler, 'WINDOW')
         self.area.tag_redraw()
         self.jsnap.exit()
         return {'FINISHED'} 
@@ -69,12 +97,18 @@ class JSNAP_OT_test(bpy.types.Operator):
         # self.execute(context)
         self.ctx = context
         self.evt = event
-        self.__kd_debounced = None
         self.area = context.area
         self.coords = []
+        self.overlay = OverlayBatch('3D_UNIFORM_COLOR')
         args = (self, context)
         self.test_handler = bpy.types.SpaceView3D.draw_handler_add(draw, args, 'WINDOW', 'POST_VIEW')
         self.jsnap = JustSnap(context)
+        # 合并鼠标事件，同一时间只有一个查询；后台提取未完成时只推迟提交，不推迟查询
+        self.scheduler = SnapScheduler(self.mousemove, submit=self.jsnap.submit_request,
+                busy=lambda: self.jsnap.pipeline.busy)
+        self.hud_handler = bpy.types.SpaceView3D.draw_handler_add(draw_hud, args, 'WINDOW', 'POST_PIXEL')
+        # 定时取回后台提取的结果
+        self.timer = context.window_manager.event_timer_add(0.02, window=context.window)
         # 进入running modal状态
         context.window_manager.modal_handler_add(self)
         return {'RUNNING_MODAL'}
@@ -89,15 +123,31 @@ class JSNAP_OT_test(bpy.types.Operator):
             self.jsnap.snap_type = "FACES"
         elif event_type == 'O' and event.value == 'PRESS':
             self.jsnap.snap_type = "ORIGINS"
+        elif event_type == 'A' and event.value == 'PRESS':
+            self.jsnap.snap_type = "ALL"
+        elif event_type == 'E' and event.value == 'PRESS':
+            self.jsnap.snap_type = "EDGE"
+        elif event_type == 'F' and event.value == 'PRESS':
+            self.jsnap.snap_type = "SURFACE"
+        elif event_type == 'P' and event.value == 'PRESS':
+            self.jsnap.profiler.enabled = not self.jsnap.profiler.enabled
+            self.area.tag_redraw()
+        elif event_type == 'R' and event.value == 'PRESS':
+            # 记录查询的输入，再按一次或退出时保存
+            if self.jsnap.trace is None:
+                self.jsnap.start_trace()
+            else:
+                print("trace:", self.jsnap.stop_trace())
         elif event_type == 'MOUSEMOVE':
-            # print("move")
-            # self.mousemove()
-            self.evt = event
-            if self.__kd_debounced is not None:
-                self.__kd_debounced.cancel()
-            self.__kd_debounced = threading.Timer(0.01, self.mousemove)
-            self.__kd_debounced.start()
-            
+            self.scheduler.push(event)
+        elif event_type == 'TIMER':
+            if self.jsnap.poll_results():
+                self.update_snap()
+            elif not self.scheduler.pending and not self.jsnap.pipeline.busy:
+                # 空闲时预先提取鼠标将要经过的物体
+                if self.jsnap.prefetch():
+                    self.update_snap()
+
         elif event_type in {'LEFTMOUSE', 'ESC'}:                                
             return self.execute(context)
         elif event_type in {'WHEELUPMOUSE', 'WHEELDOWNMOUSE'}:
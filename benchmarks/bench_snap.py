@@ -0,0 +1,388 @@
+'''吸附核心的性能测试
+
+纯 python (只测试不依赖 bpy 的部分):
+    python benchmarks/bench_snap.py --out report.json
+
+blender 后台 (同时测试 JustSnap):
+    blender --background --factory-startup --python benchmarks/bench_snap.py -- --out report.json
+
+与之前的结果比较，变慢超过 25% 的项目会列出，并以返回值 1 退出:
+    python benchmarks/bench_snap.py --compare baseline.json --tolerance 1.25
+'''
+import argparse
+import importlib
+import json
+import os
+import platform
+import sys
+import time
+import types
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+import synthetic
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+SIZES = {
+    "small": {"grid": 50, "sphere": 16, "scan": 60, "objects": 50},
+    "medium": {"grid": 200, "sphere": 64, "scan": 250, "objects": 400},
+    "large": {"grid": 450, "sphere": 160, "scan": 600, "objects": 2000},
+}
+
+SNAP_TYPES = ("POINTS", "MIDPOINTS", "FACES")
+WIDTH = 1920
+HEIGHT = 1080
+# extract_instances 中的实例数
+INSTANCES = 8
+# 深度缓冲与 ray_cast 的遮挡结果一致的比例低于此值时，以返回值 1 退出
+AGREEMENT_MIN = 0.95
+
+
+def import_just_snap():
+    '''导入 just_snap 包，blender 之外不执行包的 __init__ (依赖 bpy)'''
+    if bpy is None and "just_snap" not in sys.modules:
+        pkg = types.ModuleType("just_snap")
+        pkg.__path__ = [os.path.join(ROOT, "just_snap")]
+        sys.modules["just_snap"] = pkg
+    elif ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    return importlib.import_module("just_snap")
+
+def timeit(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    times = np.array(times) * 1000.0
+    return {
+        "repeat": repeat,
+        "min_ms": float(times.min()),
+        "median_ms": float(np.median(times)),
+        "mean_ms": float(times.mean()),
+        "max_ms": float(times.max()),
+    }
+
+def make_meshes(size):
+    s = SIZES[size]
+    return {
+        "grid": synthetic.grid(s["grid"]),
+        "sphere": synthetic.sphere(s["sphere"]),
+        "scan": synthetic.scan(s["scan"]),
+    }
+
+def make_view(View):
+    view_matrix, _, persp = synthetic.view((0.0, -2.5, 2.0))
+    return View(persp, view_matrix, WIDTH, HEIGHT, True)
+
+def bench_pure(size, repeat):
+    '''不依赖 bpy 的部分'''
+    import_just_snap()
+    from just_snap import projection, extract, geo_cache
+    from just_snap.visibility import DepthBuffer
+    from just_snap.candidates import CandidateTable
+
+    view = make_view(projection.View)
+    rs = []
+
+    def add(case, mesh_name, obj_data, stat, **extra):
+        item = {
+            "case": case,
+            "mesh": mesh_name,
+            "size": size,
+            "verts": len(obj_data["co"]),
+            "faces": len(obj_data["centers"]),
+        }
+        item.update(extra)
+        item.update(stat)
+        rs.append(item)
+
+    for mesh_name, mesh in make_meshes(size).items():
+        obj_data = synthetic.obj_data(mesh, mesh_name)
+
+        def clear():
+            obj_data.pop("proj", None)
+            obj_data.pop("clip", None)
+            obj_data.pop("depth", None)
+
+        add("project_kinds", mesh_name, obj_data, timeit(
+            lambda: extract.project_obj_data(obj_data, view), repeat, clear))
+
+        def rasterize():
+            s2d, depth, _ = extract.project_obj_data(obj_data, view)["VERTS"]
+            db = DepthBuffer(view.width, view.height, is_persp=True)
+            db.rasterize(s2d, depth, obj_data["tris"])
+        add("depth_buffer", mesh_name, obj_data, timeit(rasterize, repeat, clear))
+
+        for kind, fn in (
+                ("VERTS", extract.get_vert_data),
+                ("EDGES", extract.get_edge_data),
+                ("FACES", extract.get_face_data)):
+            for ignore_back in (True, False):
+                add("get_%s_data" % kind.lower(), mesh_name, obj_data, timeit(
+                    lambda: fn(obj_data, view, ignore_back, 20), repeat, clear),
+                    ignore_back=ignore_back)
+
+        def extract_all():
+            # 一次提取全部类型，切换吸附类型不需要重新提取
+            for _ in extract.iter_obj_data(obj_data, view, (WIDTH / 2, HEIGHT / 2), True, 20):
+                pass
+        def clear_all():
+            clear()
+            obj_data.pop("raster", None)
+        add("extract_all", mesh_name, obj_data, timeit(extract_all, repeat, clear_all))
+
+        def extract_separate():
+            # 与 extract_all 比较: 每种吸附类型单独提取 (切换吸附类型时重新提取)，
+            # 提取后释放深度缓冲，每次都要重新光栅化
+            for kind in extract.KIND_KEYS:
+                extract.get_kind_data(obj_data, kind, view, True, 20)
+                extract.release_depth(obj_data)
+            extract.get_segment_data(obj_data, view, True, 20)
+            extract.release_depth(obj_data)
+        add("extract_separate", mesh_name, obj_data, timeit(extract_separate, repeat, clear_all))
+
+        def extract_near():
+            # 只提取鼠标附近的格子，按格子逐步光栅化
+            mouse = (WIDTH / 2, HEIGHT / 2)
+            tiles = extract.tiles_near(mouse, 20, view)
+            for _ in extract.iter_obj_data(obj_data, view, mouse, True, 20, tiles=tiles):
+                pass
+        add("extract_near", mesh_name, obj_data, timeit(extract_near, repeat, clear_all))
+
+        # 同一网格的多个实例，共用局部空间的数组，只另存变换矩阵
+        instances = [geo_cache.make_instance(obj_data, "%s.%d" % (mesh_name, i),
+                synthetic.instance_matrix(i)) for i in range(INSTANCES)]
+        def extract_instances():
+            for inst in instances:
+                for _ in extract.iter_obj_data(inst, view, (WIDTH / 2, HEIGHT / 2), True, 20):
+                    pass
+        def clear_instances():
+            for inst in instances:
+                for key in ("proj", "clip", "depth", "raster"):
+                    inst.pop(key, None)
+        add("extract_instances", mesh_name, obj_data, timeit(
+            extract_instances, repeat, clear_instances), instances=INSTANCES)
+
+        data = extract.get_vert_data(obj_data, view, True, 20)
+        if data is not None:
+            def table():
+                t = CandidateTable()
+                rows = t.append(mesh_name, data["s2d"], data["depth"], data["w3d"], data["idx"])
+                t.resolve(rows)
+            add("candidate_table", mesh_name, obj_data, timeit(table, repeat))
+    return rs
+
+
+class FakeRV3D:
+    '''JustSnap 与 view3d_utils 用到的 RegionView3D 属性'''
+    def __init__(self, view_matrix, perspective_matrix, view_distance=None, is_perspective=True):
+        self.set_view(view_matrix, perspective_matrix, view_distance, is_perspective)
+
+    def set_view(self, view_matrix, perspective_matrix, view_distance=None, is_perspective=True):
+        from mathutils import Matrix
+        self.view_matrix = Matrix(np.asarray(view_matrix).tolist())
+        self.perspective_matrix = Matrix(np.asarray(perspective_matrix).tolist())
+        self.window_matrix = self.perspective_matrix @ self.view_matrix.inverted()
+        self.is_perspective = is_perspective
+        self.view_perspective = 'PERSP' if is_perspective else 'ORTHO'
+        if view_distance is None:
+            view_distance = np.linalg.norm(self.view_matrix.inverted().translation)
+        self.view_distance = float(view_distance)
+
+def fake_context(rv3d, width=WIDTH, height=HEIGHT):
+    '''blender --background 下没有 3D 视图，用假的 area/region 代替'''
+    region = types.SimpleNamespace(type='WINDOW', width=width, height=height)
+    shading = types.SimpleNamespace(type='SOLID', show_xray=False, show_xray_wireframe=False)
+    space_data = types.SimpleNamespace(region_3d=rv3d, local_view=None, shading=shading)
+    area = types.SimpleNamespace(type='VIEW_3D', regions=[region])
+    return types.SimpleNamespace(
+        area=area,
+        space_data=space_data,
+        scene=bpy.context.scene,
+        view_layer=bpy.context.view_layer,
+        evaluated_depsgraph_get=bpy.context.evaluated_depsgraph_get,
+    )
+
+def new_object(name, mesh, location=(0.0, 0.0, 0.0)):
+    me = bpy.data.meshes.new(name)
+    me.vertices.add(len(mesh["co"]))
+    me.vertices.foreach_set("co", mesh["co"].astype(np.float32).ravel())
+    me.loops.add(len(mesh["loop_verts"]))
+    me.loops.foreach_set("vertex_index", mesh["loop_verts"].astype(np.int32))
+    me.polygons.add(len(mesh["loop_start"]))
+    me.polygons.foreach_set("loop_start", mesh["loop_start"].astype(np.int32))
+    me.polygons.foreach_set("loop_total", mesh["loop_total"].astype(np.int32))
+    me.update(calc_edges=True)
+    obj = bpy.data.objects.new(name, me)
+    obj.location = location
+    bpy.context.scene.collection.objects.link(obj)
+    return obj
+
+def clear_scene():
+    for obj in list(bpy.data.objects):
+        bpy.data.objects.remove(obj)
+    for me in list(bpy.data.meshes):
+        bpy.data.meshes.remove(me)
+
+def bench_blender(size, repeat):
+    '''JustSnap 在 blender 后台的耗时'''
+    just_snap = import_just_snap()
+    from just_snap import geo_cache, extract, projection
+    JustSnap = just_snap.JustSnap
+
+    view_matrix, _, persp = synthetic.view((0.0, -2.5, 2.0))
+    # 鼠标放在原点的投影上
+    p = persp @ np.array((0.0, 0.0, 0.0, 1.0))
+    event = types.SimpleNamespace(
+        mouse_region_x=int(WIDTH / 2 * (1 + p[0] / p[3])),
+        mouse_region_y=int(HEIGHT / 2 * (1 + p[1] / p[3])))
+    rs = []
+
+    scenes = dict(make_meshes(size))
+    scenes["objects"] = None
+    for scene_name, mesh in scenes.items():
+        clear_scene()
+        if mesh is None:
+            for i, (m, location) in enumerate(synthetic.many_objects(SIZES[size]["objects"])):
+                new_object("%s_%d" % (scene_name, i), m, location)
+        else:
+            new_object(scene_name, mesh)
+        bpy.context.view_layer.update()
+        ctx = fake_context(FakeRV3D(view_matrix, persp))
+
+        def add(case, stat, **extra):
+            item = {"case": case, "mesh": scene_name, "size": size}
+            item.update(extra)
+            item.update(stat)
+            rs.append(item)
+
+        for snap_type in SNAP_TYPES:
+            state = {}
+
+            def cold():
+                geo_cache.cache.clear()
+                state["jsnap"] = JustSnap(ctx)
+                state["jsnap"].snap_type = snap_type
+
+            def update_kd_tree():
+                jsnap = state["jsnap"]
+                request = jsnap.prepare_request(event)
+                jsnap.apply_result(request, jsnap.compute_request(request))
+
+            add("update_kd_tree", timeit(update_kd_tree, repeat, cold), snap_type=snap_type)
+            state["jsnap"].exit()
+
+            add("get_snap_point_cold", timeit(
+                lambda: state["jsnap"].get_snap_point(ctx, event), repeat, cold),
+                snap_type=snap_type)
+            state["jsnap"].exit()
+
+            cold()
+            state["jsnap"].get_snap_point(ctx, event)
+            add("get_snap_point_warm", timeit(
+                lambda: state["jsnap"].get_snap_point(ctx, event), repeat),
+                snap_type=snap_type)
+            state["jsnap"].exit()
+
+        if mesh is not None:
+            # 深度缓冲与 ray_cast 两种遮挡判断的一致程度
+            jsnap = JustSnap(ctx)
+            jsnap.get_snap_point(ctx, event)
+            obj_data = jsnap._JustSnap__objs_data["data"].get(scene_name)
+            jsnap.exit()
+            if obj_data is not None:
+                view = projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+                for kind in extract.KIND_KEYS:
+                    rs.append({
+                        "case": "visibility_agreement",
+                        "mesh": scene_name,
+                        "size": size,
+                        "kind": kind,
+                        "agreement": extract.visibility_agreement(obj_data, kind, view, 20),
+                    })
+    clear_scene()
+    return rs
+
+def compare(report, baseline, tolerance):
+    '''返回变慢超过 tolerance 倍的项目'''
+    def key(item):
+        return tuple(sorted((k, str(v)) for k, v in item.items()
+                if not k.endswith("_ms") and k not in ("repeat", "agreement")))
+    old = {key(item): item for item in baseline["results"] if "median_ms" in item}
+    rs = []
+    for item in report["results"]:
+        base = old.get(key(item))
+        if base is None or "median_ms" not in item:
+            continue
+        if item["median_ms"] > base["median_ms"] * tolerance:
+            rs.append((item, base))
+    return rs
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="just_snap benchmark")
+    parser.add_argument("--sizes", default="small,medium",
+            help="逗号分隔: " + ",".join(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default=None, help="输出 json 报告")
+    parser.add_argument("--compare", default=None, help="作为基准的 json 报告")
+    parser.add_argument("--tolerance", type=float, default=1.25)
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "mode": "blender" if bpy is not None else "python",
+            "blender": bpy.app.version_string if bpy is not None else None,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": [],
+    }
+    for size in args.sizes.split(","):
+        report["results"].extend(bench_pure(size, args.repeat))
+        if bpy is not None:
+            report["results"].extend(bench_blender(size, args.repeat))
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+    code = 0
+    for item in report["results"]:
+        if item.get("agreement", 1.0) < AGREEMENT_MIN:
+            print("disagree: %s %s %s %.3f" % (
+                item["mesh"], item["size"], item["kind"], item["agreement"]), file=sys.stderr)
+            code = 1
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        slower = compare(report, baseline, args.tolerance)
+        for item, base in slower:
+            print("slower: %s %s %s %.2fms -> %.2fms" % (
+                item["case"], item["mesh"], item["size"],
+                base["median_ms"], item["median_ms"]), file=sys.stderr)
+        if slower:
+            return 1
+    return code
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    code = main(argv)
+    if bpy is None or bpy.app.background:
+        sys.exit(code)
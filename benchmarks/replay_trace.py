@@ -0,0 +1,186 @@
+'''在 blender 后台重放记录的吸附查询 (JustSnap.start_trace，测试操作中按 r 开始/停止)
+
+重放并输出每个事件的耗时与结果:
+    blender --background scene.blend --python benchmarks/replay_trace.py -- trace.npz --out replay.json
+
+与另一版本代码的重放结果比较，结果不同的事件会列出，并以返回值 1 退出:
+    blender --background scene.blend --python benchmarks/replay_trace.py -- trace.npz --compare old.json
+
+只比较两个已有的报告 (不需要 blender):
+    python benchmarks/replay_trace.py --report new.json --compare old.json
+
+默认每个事件都处理完全部分块 (--budget inf)，结果与机器的快慢无关
+'''
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+import types
+
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from bench_snap import bpy, import_just_snap, FakeRV3D, fake_context
+
+# 吸附点的世界座标相差超过此值视为不同
+TOLERANCE = 1e-4
+
+
+def replay(events, budget):
+    '''依次执行记录的查询，返回每个事件的结果'''
+    import_just_snap()
+    from just_snap import JustSnap
+
+    first = events[0]
+    rv3d = FakeRV3D(first.view_matrix, first.perspective_matrix,
+            first.view_distance, first.is_persp)
+    ctx = fake_context(rv3d, first.width, first.height)
+    region = ctx.area.regions[0]
+    shading = ctx.space_data.shading
+    shading.show_xray = first.xray
+    jsnap = JustSnap(ctx)
+    jsnap.frame_budget = budget
+    rs = []
+    try:
+        for i, e in enumerate(events):
+            # JustSnap 引用的是同一个 rv3d 与 region，原地修改
+            rv3d.set_view(e.view_matrix, e.perspective_matrix, e.view_distance, e.is_persp)
+            region.width = e.width
+            region.height = e.height
+            shading.show_xray = e.xray
+            jsnap.snap_type = e.snap_type
+            event = types.SimpleNamespace(mouse_region_x=e.mouse[0], mouse_region_y=e.mouse[1])
+            start = time.perf_counter()
+            snapped, _, co, obj_name, closest = jsnap.get_snap_point(ctx, event)
+            ms = (time.perf_counter() - start) * 1000.0
+            rs.append({
+                "index": i,
+                "time": e.time,
+                "snap_type": e.snap_type,
+                "ms": ms,
+                "snapped": bool(snapped),
+                "kind": jsnap.snap_kind,
+                "object": str(obj_name),
+                "co": [float(v) for v in co] if co is not None else None,
+                "closest": len(closest),
+            })
+    finally:
+        jsnap.exit()
+    return rs
+
+def summary(results):
+    '''耗时的分位数，全部事件与按吸附类型'''
+    def stat(items):
+        ms = np.array([item["ms"] for item in items])
+        return {
+            "n": len(ms),
+            "p50_ms": float(np.percentile(ms, 50)),
+            "p95_ms": float(np.percentile(ms, 95)),
+            "p99_ms": float(np.percentile(ms, 99)),
+            "max_ms": float(ms.max()),
+            "snapped": sum(item["snapped"] for item in items),
+        }
+    if not results:
+        return {}
+    rs = {"all": stat(results)}
+    for snap_type in sorted({item["snap_type"] for item in results}):
+        rs[snap_type] = stat([item for item in results if item["snap_type"] == snap_type])
+    return rs
+
+def compare(report, baseline, tolerance=TOLERANCE):
+    '''结果不同的事件 [(index, 当前结果, 基准结果), ...]'''
+    old = {item["index"]: item for item in baseline["events"]}
+    rs = []
+    for item in report["events"]:
+        base = old.pop(item["index"], None)
+        if base is None or __differs(item, base, tolerance):
+            rs.append((item["index"], item, base))
+    for index, base in sorted(old.items()):
+        rs.append((index, None, base))
+    return rs
+
+def __differs(a, b, tolerance):
+    for key in ("snap_type", "snapped", "kind", "object", "closest"):
+        if a[key] != b[key]:
+            return True
+    if (a["co"] is None) != (b["co"] is None):
+        return True
+    return a["co"] is not None and math.dist(a["co"], b["co"]) > tolerance
+
+def __brief(item):
+    if item is None:
+        return "-"
+    if item["snapped"]:
+        return "%s %s %s" % (item["kind"], item["object"],
+                "(%.4f, %.4f, %.4f)" % tuple(item["co"]))
+    return "not snapped, %d closest" % item["closest"]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="just_snap trace replay")
+    parser.add_argument("trace", nargs="?", help="JustSnap 保存的 .npz")
+    parser.add_argument("--budget", type=float, default=float("inf"),
+            help="每个事件处理分块的时间预算 (秒)，默认处理完全部")
+    parser.add_argument("--out", default=None, help="输出 json 报告")
+    parser.add_argument("--report", default=None, help="不重放，读取已有的报告")
+    parser.add_argument("--compare", default=None, help="作为基准的 json 报告")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    if args.report:
+        with open(args.report, encoding="utf-8") as f:
+            report = json.load(f)
+    else:
+        if args.trace is None or bpy is None:
+            parser.error("重放需要 trace 文件，并在 blender 中运行")
+        import_just_snap()
+        from just_snap import trace
+        meta, events = trace.load(args.trace)
+        results = replay(events, args.budget) if events else []
+        report = {
+            "meta": {
+                "trace": os.path.abspath(args.trace),
+                "recorded": meta,
+                "blend": bpy.data.filepath,
+                "blender": bpy.app.version_string,
+                "python": platform.python_version(),
+                "numpy": np.__version__,
+                "budget": args.budget,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "summary": summary(results),
+            "events": results,
+        }
+        if meta.get("blend") and os.path.basename(meta["blend"]) != os.path.basename(bpy.data.filepath):
+            print("warning: trace was recorded in %s" % meta["blend"], file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+    elif not args.report:
+        print(text)
+    for name, stat in report["summary"].items():
+        print("%-10s n %5d  p50 %7.2f  p95 %7.2f  p99 %7.2f  max %7.2f ms" % (
+            name, stat["n"], stat["p50_ms"], stat["p95_ms"], stat["p99_ms"], stat["max_ms"]),
+            file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        diffs = compare(report, baseline, args.tolerance)
+        for index, item, base in diffs:
+            print("differs: #%d %s -> %s" % (index, __brief(base), __brief(item)), file=sys.stderr)
+        if diffs:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[1:]
+    code = main(argv)
+    if bpy is None or bpy.app.background:
+        sys.exit(code)
@@ -0,0 +1,165 @@
+import numpy as np
+
+# 生成测试用网格与视图，只依赖 numpy
+#
+# 网格: {
+#    "co":         顶点 (N, 3)
+#    "loop_start": 面的第一个 loop (F,)
+#    "loop_total": 面的 loop 数 (F,)
+#    "loop_verts": loop 的顶点下标 (L,)
+# }
+
+
+def grid(n, size=2.0, noise=0.0, seed=0):
+    '''n * n 个四边面的平面'''
+    t = np.linspace(-size / 2, size / 2, n + 1)
+    x, y = np.meshgrid(t, t)
+    z = np.zeros_like(x)
+    if noise:
+        z = np.random.default_rng(seed).normal(0.0, noise, x.shape)
+    co = np.column_stack((x.ravel(), y.ravel(), z.ravel()))
+    i, j = np.meshgrid(np.arange(n), np.arange(n))
+    v0 = (j * (n + 1) + i).ravel()
+    quads = np.column_stack((v0, v0 + 1, v0 + n + 2, v0 + n + 1))
+    return _from_polys(co, quads)
+
+def scan(n, size=2.0, seed=0):
+    '''类似扫描数据的三角网格: 带噪声的高度场，全部为三角面'''
+    mesh = grid(n, size, noise=size / n, seed=seed)
+    quads = mesh["loop_verts"].reshape(-1, 4)
+    tris = np.concatenate((quads[:, [0, 1, 2]], quads[:, [0, 2, 3]]))
+    return _from_polys(mesh["co"], tris)
+
+def sphere(n, radius=1.0):
+    '''细分立方体投影到球面，每面 n * n 个四边面'''
+    face = grid(n, 2.0)
+    base = face["co"]
+    quads = face["loop_verts"].reshape(-1, 4)
+    co = []
+    polys = []
+    axes = (
+        (0, 1, 2, 1), (0, 1, 2, -1),
+        (1, 2, 0, 1), (1, 2, 0, -1),
+        (2, 0, 1, 1), (2, 0, 1, -1),
+    )
+    for k, (a, b, c, sign) in enumerate(axes):
+        p = np.empty_like(base)
+        p[:, a] = base[:, 0]
+        p[:, b] = base[:, 1] * sign
+        p[:, c] = sign
+        co.append(p)
+        polys.append(quads + k * len(base))
+    co = np.concatenate(co)
+    co /= np.linalg.norm(co, axis=1)[:, None]
+    # 合并接缝处重复的顶点
+    co, inverse = np.unique(np.round(co * radius, 9), axis=0, return_inverse=True)
+    polys = inverse.ravel()[np.concatenate(polys)]
+    return _from_polys(co, polys)
+
+def many_objects(count, n=4, spacing=3.0):
+    '''count 个小网格，返回 [(网格, 位置), ...]'''
+    side = int(np.ceil(np.sqrt(count)))
+    mesh = sphere(n, 0.5)
+    rs = []
+    for i in range(count):
+        location = ((i % side - side / 2) * spacing, (i // side - side / 2) * spacing, 0.0)
+        rs.append((mesh, location))
+    return rs
+
+def _from_polys(co, polys):
+    polys = np.asarray(polys, dtype=np.int64)
+    k = polys.shape[1]
+    return {
+        "co": np.asarray(co, dtype=np.float64),
+        "loop_start": np.arange(len(polys)) * k,
+        "loop_total": np.full(len(polys), k),
+        "loop_verts": polys.ravel(),
+    }
+
+def mesh_edges(mesh):
+    '''由面得到不重复的边 (E, 2)'''
+    loop_verts = mesh["loop_verts"]
+    start = mesh["loop_start"]
+    total = mesh["loop_total"]
+    nxt = np.arange(len(loop_verts)) + 1
+    last = start + total - 1
+    nxt[last] = start
+    pairs = np.sort(np.column_stack((loop_verts, loop_verts[nxt])), axis=1)
+    return np.unique(pairs, axis=0)
+
+def mesh_tris(mesh):
+    '''扇形三角化，返回 (三角面 (T, 3), 所属的面 (T,))'''
+    start = mesh["loop_start"]
+    total = mesh["loop_total"]
+    loop_verts = mesh["loop_verts"]
+    counts = total - 2
+    poly = np.repeat(np.arange(len(start)), counts)
+    i = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + 1
+    first = start[poly]
+    return np.column_stack((
+        loop_verts[first], loop_verts[first + i], loop_verts[first + i + 1])), poly
+
+def obj_data(mesh, name="bench", location=(0.0, 0.0, 0.0)):
+    '''不经过 blender，直接生成 JustSnap 使用的物体数据'''
+    co = mesh["co"] + np.asarray(location, dtype=np.float64)
+    edges = mesh_edges(mesh)
+    tris, tri_poly = mesh_tris(mesh)
+    centers = np.add.reduceat(co[mesh["loop_verts"]], mesh["loop_start"]) \
+        / mesh["loop_total"][:, None]
+    return {
+        "name": name,
+        "size": float(np.linalg.norm(co.max(axis=0) - co.min(axis=0))),
+        "co": co,
+        "edges": edges,
+        "mids": (co[edges[:, 0]] + co[edges[:, 1]]) / 2,
+        "centers": centers,
+        "loop_start": mesh["loop_start"],
+        "loop_total": mesh["loop_total"],
+        "loop_verts": mesh["loop_verts"],
+        "tris": tris,
+        "tri_poly": tri_poly,
+    }
+
+def instance_matrix(i):
+    '''第 i 个实例的 matrix_world: 绕 z 轴旋转、缩放并沿 x 轴排列'''
+    a = i * 0.3
+    c, s = np.cos(a), np.sin(a)
+    scale = 0.5 + 0.1 * i
+    m = np.eye(4)
+    m[:3, :3] = np.array(((c, -s, 0.0), (s, c, 0.0), (0.0, 0.0, 1.0))) * scale
+    m[:3, 3] = ((i - 4) * 0.6, 0.0, 0.0)
+    return m
+
+def look_at(eye, target, up=(0.0, 0.0, 1.0)):
+    '''view_matrix'''
+    eye = np.asarray(eye, dtype=np.float64)
+    f = np.asarray(target, dtype=np.float64) - eye
+    f /= np.linalg.norm(f)
+    s = np.cross(f, up)
+    if np.linalg.norm(s) < 1e-9:
+        s = np.cross(f, (0.0, 1.0, 0.0))
+    s /= np.linalg.norm(s)
+    u = np.cross(s, f)
+    m = np.eye(4)
+    m[0, :3] = s
+    m[1, :3] = u
+    m[2, :3] = -f
+    m[:3, 3] = -m[:3, :3] @ eye
+    return m
+
+def perspective(fov, aspect, near=0.01, far=1000.0):
+    '''window_matrix'''
+    f = 1.0 / np.tan(fov / 2)
+    m = np.zeros((4, 4))
+    m[0, 0] = f / aspect
+    m[1, 1] = f
+    m[2, 2] = (far + near) / (near - far)
+    m[2, 3] = 2 * far * near / (near - far)
+    m[3, 2] = -1.0
+    return m
+
+def view(eye, target=(0.0, 0.0, 0.0), width=1920, height=1080, fov=np.radians(50)):
+    '''返回 (view_matrix, window_matrix, perspective_matrix)'''
+    view_matrix = look_at(eye, target)
+    window_matrix = perspective(fov, width / height)
+    return view_matrix, window_matrix, window_matrix @ view_matrix
@@ -1,38 +1,145 @@
+import os
+import time
+import tempfile
 import bpy
-import bmesh
+import numpy as np
 from math import floor
-from mathutils import Vector, kdtree, bvhtree
-from . import just_utils
+from mathutils import Matrix, Vector
+from . import just_utils, geo_cache, projection, extract
+from . import lod as snap_lod
+from . import mesh_update
+from .pipeline import SnapPipeline, SnapRequest
+from .snap_index import SnapIndex
+from .segment_grid import SegmentGrid
+from . import scene_index
+from bpy.app.handlers import persistent
+from .candidates import CandidateTable
+from .profiler import SnapProfiler
+from .overlay import OverlayBatch
+from .trace import TraceRecorder
+from .prefetch import Prefetcher, MAX_TARGETS, MAX_LOADS, MAX_LOAD_VERTS
+from .rect_grid import RectGrid
 
-import gpu
-from gpu_extras.batch import batch_for_shader
+# 视线方向变化在 1 度以内时，保留已计算的遮挡结果
+REPROJECT_COS = np.cos(np.radians(1.0))
 
-shader = gpu.shader.from_builtin('2D_UNIFORM_COLOR')
+# 吸附的搜索半径 (像素)
+SEARCH_RADIUS = 200
+# 离鼠标的距离 (像素，不含 snap_bias) 小于此值的点才能吸附
+SNAP_RADIUS = 20
 
-def draw(self, ctx):
+# 索引中的座标与候选点表相差超过此值 (像素) 时，视为编辑模式下移动前的旧位置
+STALE_PIXELS = 0.01
+# 编辑模式下增量加入的子树超过此数量时合并为一棵
+EDIT_MERGE = 8
+
+# 吸附类型对应的元素
+SNAP_KINDS = {
+    "POINTS": "VERTS",
+    "MIDPOINTS": "EDGES",
+    "FACES": "FACES",
+}
+# 元素对应的吸附类型
+KIND_SNAP_TYPES = {kind: snap_type for snap_type, kind in SNAP_KINDS.items()}
+# 同时吸附的全部类型
+ALL_SNAP_TYPES = ("ORIGINS",) + tuple(SNAP_KINDS)
+# "ALL" 模式下各类型的像素偏置，候选点按 离鼠标的距离 + 偏置 排序
+# 距离相近时优先吸附顶点与原点，其次边中点，最后面中心
+SNAP_BIAS = {
+    "ORIGINS": 0,
+    "POINTS": 0,
+    "MIDPOINTS": 4,
+    "FACES": 8,
+}
 
-    if self.xxxx is None:
+def draw(self, ctx):
+    '''调试用: 显示当前吸附类型的全部候选点'''
+    table = self.xxxx
+    if table is None:
+        return
+    # 候选点表没有改变时使用缓存的 batch
+    self.overlay.set_points(table.s2d, key=(id(table), table.version))
+    if len(self.overlay) == 0:
         return
-    coords = list(self.xxxx.keys())
 
-    
+    import gpu
     gpu.state.blend_set("ALPHA")
     # gpu.state.depth_test_set("LESS")
     gpu.state.point_size_set(10)
-    # print(self.coords)
-    batch = batch_for_shader(shader, 'POINTS', {"pos": coords})
-    shader.bind()
-    shader.uniform_float("color", (0.0, 1.0, 0.0, 1.0))
-    batch.draw(shader)
+    self.overlay.draw((0.0, 1.0, 0.0, 1.0))
     gpu.state.point_size_set(5)
 
+# 物体的几何改变的次数 {物体名称: 次数}，由 depsgraph_update_post 记录，
+# 编辑模式下次数没有变化的物体不需要读取网格
+geometry_revisions = {}
+
+@persistent
+def on_depsgraph_update(scene, depsgraph):
+    '''记录改变了的物体，下次启动 JustSnap 时只重新读取这些物体'''
+    for update in depsgraph.updates:
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Object) and update.is_updated_geometry:
+            geometry_revisions[id_data.name] = geometry_revisions.get(id_data.name, 0) + 1
+    index = scene_index.indexes.get(scene.name)
+    if index is None:
+        # 还没有在该场景中使用过
+        return
+    names = []
+    collections = False
+    counts = None
+    for update in depsgraph.updates:
+        id_data = update.id.original
+        if isinstance(id_data, bpy.types.Object):
+            names.append(id_data.name)
+        elif isinstance(id_data, bpy.types.Collection):
+            collections = True
+        elif isinstance(id_data, bpy.types.Scene) and counts is None:
+            # 物体增删、排除集合时物体数改变
+            counts = (len(scene.objects), len(depsgraph.view_layer.objects))
+    index.mark_updates(names, collections, counts)
+
+@persistent
+def on_load_post(*args):
+    '''打开文件后原有的索引都已无效'''
+    scene_index.clear()
+    geometry_revisions.clear()
+
+@persistent
+def on_undo_post(*args):
+    '''撤销、重做后下次启动 JustSnap 时重新读取全部物体'''
+    scene_index.invalidate()
+
+# (handlers 中的列表名称, 函数)
+HANDLERS = (
+    ("depsgraph_update_post", on_depsgraph_update),
+    ("load_post", on_load_post),
+    ("undo_post", on_undo_post),
+    ("redo_post", on_undo_post),
+)
+
+def register():
+    for name, fn in HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if fn not in handlers:
+            handlers.append(fn)
+    scene_index.live = True
+
+def unregister():
+    for name, fn in HANDLERS:
+        handlers = getattr(bpy.app.handlers, name)
+        if fn in handlers:
+            handlers.remove(fn)
+    scene_index.live = False
+    scene_index.clear()
+
 class JustSnap:
-    # 局部视图下:
-    # 由于API bug问题，无法获取局部视图内的物体，ray_cast会碰撞到局部视图之外的物体，
-    # 当判断为局部视图时，会隐藏外部物体，并储存物体名到 
-    # bpy.context.scene["just_snap_hide_obj"]
-    # 以便在脚本崩溃时恢复物体显示
-    # 退出时一定要调用exit方法，否则被隐藏的物体不会被显示
+    # 鼠标下的物体由两层加速结构拾取:
+    #   上层 SceneBVH: 场景中物体的世界空间包围盒，由常驻的 scene_index 维护，
+    #                  拾取时只考虑可见的网格物体
+    #   下层: 各物体自身的 BVHTree，在网格的局部空间，同一网格的物体与实例共用
+    # 物体名称: 场景中的物体为名称，集合实例等为 (实例化物体名称, persistent_id)
+    # 局部视图下不需要隐藏其他物体
+    # 退出时一定要调用exit方法
     def __init__(self, context):
         if context.area is None or context.area.type != 'VIEW_3D': 
             self.report({'WARNING'}, "View3D not found, cannot run operator")
@@ -49,53 +156,125 @@ class JustSnap:
         self.__region = region
         self.__space_data = context.space_data
         self.__rv3d = context.space_data.region_3d
-        self.__local_view = context.space_data.local_view
-
-        # 获取可见对象，
-        # 局部模式，在插件中正常，但在编辑器中却获得全部物体，大概是context的原因？
-        # 不知道可不可靠
-        self.__visible_objs_name = [obj.name for obj in context.scene.objects if obj.visible_get()]
-
-        print(self.__visible_objs_name)
-        context.scene["just_snap_hide_obj"] = self.__visible_objs_name
-        self.__not_in_local = None
-        if self.__local_view:
-            # ray_cast 会碰撞到所有显示物体，包括局部视图外及场景外(以某个物体的实例显示的情况)
-            # 所以隐藏掉，不清楚是不是bug
-            all_not_local_objs = [obj for obj in context.scene.objects if obj.name not in self.__visible_objs_name]
-            # print(all_objs)
-            self.__not_in_local = [obj for obj in all_not_local_objs if not obj.hide_get()]
-            for obj in self.__not_in_local:
-                obj.hide_set(True)
-
-        self.__snap_type_list = ["ORIGINS", "POINTS", "MIDPOINTS", "FACES"]
+
+        # 只读取上次启动后改变了的物体
+        self.__scene_index = scene_index.get(context.scene.name)
+        just_utils.sync_scene_index(
+                self.__scene_index, context.scene, context.evaluated_depsgraph_get())
+        visible = self.__scene_index.visible
+        if context.space_data.local_view is not None:
+            visible = just_utils.local_view_visible(
+                    self.__scene_index.names, context.scene, context.space_data)
+        names = self.__scene_index.names
+        self.__visible_objs_name = [names[i] for i in np.flatnonzero(visible)]
+        # 可以拾取的物体，与 SceneBVH 的物体下标对应
+        self.__pick_mask = visible & self.__scene_index.is_mesh
+        self.__scene_bvh = self.__scene_index.bvh()
+
+        # "ALL":     同时吸附全部类型，按 snap_bias 排序
+        # "EDGE":    边上离鼠标最近的点
+        # "SURFACE": 鼠标下的面上的点
+        self.__snap_type_list = ["ORIGINS", "POINTS", "MIDPOINTS", "FACES", "ALL", "EDGE", "SURFACE"]
         self.__snap_type = "ORIGINS"
+        self.snap_bias = dict(SNAP_BIAS)
+        self.mouse_position = None
+        # 最近一次查询的结果类型，见 query_snap_point
+        self.snap_kind = None
+        self.closest_kinds = []
         
+        # data: {物体名称: obj_data}，实例共用网格数据，见 geo_cache.make_instance
         self.__objs_data = {
-            "box": {},
             "data":{}
         } 
-        for obj_name in self.__visible_objs_name:
-            obj = bpy.data.objects[obj_name]
-            matrix = obj.matrix_world
-            self.__objs_data["box"][obj.name] = [matrix @ Vector(loc) for loc in obj.bound_box]
+        # 本次启动中已计算的网格指纹 {网格的键: 指纹}，同一网格只计算一次
+        self.__fingerprints = {}
 
+        # 耗时统计，默认关闭
+        self.profiler = SnapProfiler()
+        self.profile_path = os.path.join(tempfile.gettempdir(), "just_snap_profile.json")
+        # 记录每次查询的输入，用于重放 (benchmarks/replay_trace.py)，默认关闭
+        self.trace = None
+        self.trace_path = os.path.join(tempfile.gettempdir(), "just_snap_trace.npz")
+        self.pipeline = SnapPipeline(JustSnap.compute_request)
+        # 只提取鼠标附近 (SEARCH_RADIUS 内) 的屏幕格子，视图改变前已提取的格子不再提取
+        self.tile_mode = True
+        self.__near_tiles = None
+        # 每次处理分块结果的时间预算 (秒)，超出的部分留到下一次
+        self.frame_budget = 0.008
+        # 同步提取时未完成的分块任务 [(request, 迭代器), ...]
+        self.__tasks = []
+        # 按鼠标的移动方向预先提取将要经过的物体，见 prefetch
+        self.prefetcher = Prefetcher()
+        # 每次预先提取的时间预算 (秒)
+        self.prefetch_budget = 0.004
+        # 可拾取物体在屏幕上的包围矩形 (视图的 key, rects)
+        self.__screen_rects = None
+        # 已取回但未处理的后台结果
+        self.__backlog = []
+        # 检查编辑模式网格是否改变的间隔 (秒)
+        self.edit_interval = 0.2
+        self.__edit_checked = 0.0
+        self.__edit_serial = 0
         self.__reset_data()
 
         self.xxxx = None
+        # 调试用候选点的绘制批次，shader 在第一次绘制时创建
+        self.overlay = OverlayBatch('2D_UNIFORM_COLOR', dim=2)
         # args = (self, context)
         # self.test_handler = bpy.types.SpaceView3D.draw_handler_add(draw, args, 'WINDOW', 'POST_PIXEL')
     
     def exit(self):
         # bpy.types.SpaceView3D.draw_handler_remove(self.test_handler, 'WINDOW')
         
-        if self.__not_in_local is not None:
-            for obj in self.__not_in_local:
-                obj.hide_set(False)
-        
-        for data in self.__objs_data["data"].values():
-            data["bvh"] = None
-            data["bm"].free()
+        self.pipeline.shutdown()
+        if self.profiler.enabled:
+            self.profiler.dump(self.profile_path)
+        self.stop_trace()
+        # 还没有用到的预先提取计为浪费
+        self.prefetcher.cancel()
+        # 几何数据保留在 geo_cache 中，供下次使用
+        self.__objs_data["data"] = {}
+
+    def start_trace(self):
+        '''开始记录查询的输入'''
+        self.trace = TraceRecorder()
+
+    def stop_trace(self):
+        '''停止记录并保存到 trace_path，返回保存的路径，没有记录时返回 None'''
+        trace = self.trace
+        self.trace = None
+        if trace is None or len(trace) == 0:
+            return None
+        trace.save(self.trace_path, {
+            "blend": bpy.data.filepath,
+            "scene": self.__ctx.scene.name,
+            "blender": bpy.app.version_string,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        })
+        return self.trace_path
+
+    def __record_trace(self):
+        rv3d = self.__rv3d
+        self.trace.record(
+            self.__region.width,
+            self.__region.height,
+            rv3d.view_matrix,
+            rv3d.perspective_matrix,
+            rv3d.view_distance,
+            rv3d.is_perspective,
+            self.mouse_position,
+            self.__snap_type,
+            self.__shading_xray(),
+        )
+
+    @property
+    def cache_stats(self):
+        stats = geo_cache.cache.stats()
+        objs_data = self.__objs_data["data"].values()
+        # 已读取的物体 (含实例) 与它们共用的网格数
+        stats["instances"] = len(objs_data)
+        stats["meshes"] = len({id(obj_data.get("mesh", obj_data)) for obj_data in objs_data})
+        return stats
 
     @property
     def snap_type(self):
@@ -116,175 +295,679 @@ class JustSnap:
     #     if snap_type in self.__snap_type_list:
     #         self.__snap_type = snap_type
 
-    def __get_objs_under_mouse(self):
-        x, y = self.mouse_position
-        objs = []
-        for obj_name, obj_area in self.__screen_bound_data.items():  
-            min_v = obj_area[0]
-            max_v = obj_area[1]
-            if x > min_v[0] and x < max_v[0] and \
-                    y > min_v[1] and y < max_v[1]:
-                objs.append(obj_name)
-        return objs
+    def __pick(self, first=False):
+        '''沿鼠标射线拾取物体'''
+        # return [{
+        #   "name":     物体名称
+        #   "location": 交点
+        #   "index":    面下标
+        #   "distance": 与射线起点的距离
+        # }, ...] 按距离排序
+        # first: 只需要最近的交点，之后的包围盒比已有交点远时停止
+        origin = self.mouse_position_world
+        direction = self.mouse_vector.normalized()
+        hits = []
+        nearest = float("inf")
+        for i, t in self.__scene_bvh.ray_candidates(origin, direction, mask=self.__pick_mask):
+            if first and t > nearest:
+                break
+            obj_name = self.__scene_bvh.names[i]
+            if obj_name not in self.__objs_data["data"]:
+                self.__add_obj_data(obj_name)
+            obj_data = self.__objs_data["data"][obj_name]
+            if obj_data["bvh"] is None:
+                # 编辑后重建
+                with self.profiler.stage("bvh"):
+                    self.__build_bvh(obj_data)
+            location, index, distance = just_utils.ray_cast_obj_data(obj_data, origin, direction)
+            if location is None:
+                continue
+            nearest = min(nearest, distance)
+            hits.append({
+                "name": obj_name,
+                "location": location,
+                "index": index,
+                "distance": distance,
+            })
+        hits.sort(key=lambda hit: hit["distance"])
+        if first:
+            return hits[:1]
+        return hits
     
     def __update_mouse(self, event):
-        self.mouse_position = (event.mouse_region_x, event.mouse_region_y)
+        position = (event.mouse_region_x, event.mouse_region_y)
+        # 查询与提交使用同一个事件时只记录一次
+        if position != self.mouse_position:
+            self.prefetcher.add_sample(position)
+        self.mouse_position = position
         self.mouse_position_world = just_utils.screen_to_world(
                 self.__region, self.__rv3d, self.mouse_position)
         self.mouse_vector = just_utils.get_screen_normal(
                 self.__region, self.__rv3d, self.mouse_position)
     
     def __update_origins_kd_tree(self):
-        kd_data = self.__kd_verts_data["ORIGINS"]["data"]
-        for obj_name in self.__visible_objs_name:
-            obj = bpy.data.objects[obj_name]
-            k, v, n = self.__get_s2d_w3d_oname(obj_name, obj.location, kd_data)
-            kd_data[k] = (v, n)
-        self.__kd_tree_from_cache("ORIGINS")
-    
-
-    def __get_s2d_w3d_oname(self, o_name, w_vert, kd_data):
-        '''返回屏幕座标、世界座标、物体名称'''
-        s_vert = just_utils.world_to_screen(self.__region, self.__rv3d, w_vert)
-        if s_vert in kd_data:
-            # 保留更前面的
-            old_v = kd_data[s_vert][0]
-            new_v = just_utils.screen_to_world(self.__region, self.__rv3d, s_vert)
-            if (w_vert - new_v).length > (old_v - new_v).length:
-                o_name = kd_data[s_vert][1]
-                w_vert = old_v        
-
-        return s_vert, w_vert, o_name
-
-    def __kd_tree_from_cache(self, snap_type):
-        data = self.__kd_verts_data[snap_type]
-        kd_data = data["data"]
-        len_data = len(kd_data)
-        if len_data == 0:
+        snap_data = self.__kd_verts_data["ORIGINS"]
+        self.__index.clear(("ORIGINS",))
+        names = self.__visible_objs_name
+        if len(names) == 0:
             return
-        data["kd"] = kdtree.KDTree(len_data)
-
-        insert = data["kd"].insert
-        i = 0
-        for k in kd_data.keys():
-            insert((*k, 0), i)
-            i += 1
+        objects = bpy.data.objects
+        instances = self.__scene_index.instances
+        # 实例的原点为实例的 matrix_world 的位置
+        w3d = np.array([instances[name][1][:3, 3] if name in instances else objects[name].location
+                for name in names], dtype=np.float64).reshape(-1, 3)
+        view = projection.view_from_rv3d(self.__region, self.__rv3d)
+        s2d, depth, mask = projection.project_points(w3d, view)
+        table = snap_data["data"]
+        obj_ids = np.array([table.name_id(name) for name in names], dtype=np.int32)
+        rows = table.append(obj_ids[mask], s2d[mask], depth[mask], w3d[mask], 0)
+        self.__index.insert(("ORIGINS",), s2d[mask].tolist(), rows, "ORIGINS")
 
-        data["kd"].balance()
-    
     def __update_view(self):
         # view_distance 与 view_matrix 没有改变则不需要更新数据
         if self.__view_distance == self.__rv3d.view_distance \
                 and self.__view_matrix == self.__rv3d.view_matrix:
             return        
-        self.__reset_data()
+        self.__reset_view()
+        # 旧视图下的深度缓冲不会再用到
+        for obj_data in self.__objs_data["data"].values():
+            extract.release_depth(obj_data)
+        with self.profiler.stage("reproject"):
+            self.__reproject()
+        # 旧视图下提交的请求已过期，预先提取的任务也一起取消
+        self.pipeline.invalidate()
+        self.__tasks = []
+        self.__backlog = []
+        self.prefetcher.cancel()
+
+    def __reproject(self):
+        '''视图改变时，保留已提取的候选点，只重新投影到新的屏幕'''
+        view = projection.view_from_rv3d(self.__region, self.__rv3d)
+        direction = projection.view_direction(view)
+        for obj_name in list(self.__extracted.keys()):
+            record = self.__extracted[obj_name]
+            if record["dir"] is not None and \
+                    np.dot(record["dir"], direction) < REPROJECT_COS:
+                # 视线方向变化过大，遮挡结果失效，下次经过时重新计算
+                del self.__extracted[obj_name]
+                for snap_type in SNAP_KINDS:
+                    self.__kd_verts_data[snap_type]["objs"].pop(obj_name, None)
+                continue
+            # 可能有新进入视图的元素，下次经过时补充
+            record["fresh"] = False
+        for snap_type, data in self.__kd_verts_data.items():
+            if snap_type == "ORIGINS":
+                # 物体原点很少，直接重建
+                data["data"].clear()
+                self.__index.clear((snap_type,))
+                continue
+            table = data["data"]
+            objs = data["objs"]
+            entries = list(objs.items())
+
+            self.__index.clear((snap_type,))
+            if snap_type == "MIDPOINTS":
+                self.__segments.clear()
+            if len(entries) == 0:
+                table.clear()
+                continue
+            rows = np.concatenate([entry["rows"] for _, entry in entries])
+            owner = np.repeat(np.arange(len(entries)),
+                    [len(entry["rows"]) for _, entry in entries])
+            s2d, depth, mask = projection.project_points(
+                    table.w3d[rows], view, self.__margin)
+            table.compact(rows[mask])
+            table.set_screen(s2d[mask], depth[mask])
+            bounds = np.searchsorted(owner[mask], np.arange(len(entries) + 1))
+            for i, (obj_name, entry) in enumerate(entries):
+                rows = np.arange(bounds[i], bounds[i + 1])
+                entry["rows"] = rows
+                # 分块加入的子树合并为一棵
+                key = (snap_type, obj_name)
+                entry["keys"] = [key]
+                self.__index.insert(key, table.s2d[rows].tolist(), rows, snap_type)
+                if snap_type == "MIDPOINTS" and obj_name in self.__objs_data["data"]:
+                    self.__insert_segments(key, obj_name, entry["segs"], view)
 
     def __add_obj_data(self, obj_name):
-        obj = bpy.data.objects[obj_name]
-        size = obj.dimensions.length 
-        bm = bmesh.new()
-        bm.from_mesh(obj.data)
-        bm.verts.ensure_lookup_table()
-        bm.edges.ensure_lookup_table()
-        bm.faces.ensure_lookup_table()
-        matrix = obj.matrix_world
-        bmesh.ops.transform(bm, matrix=matrix, verts=bm.verts)
-        self.__objs_data["data"][obj_name] = {
-            "name": obj_name,
-            "size": size,
-            "location": obj.location,
-            "matrix_w": matrix,
-            "matrix_l": obj.matrix_local,
-            "bm": bm,
-            "bvh": bvhtree.BVHTree.FromBMesh(bm)
-        }
+        instance = self.__scene_index.instances.get(obj_name)
+        if instance is not None:
+            # 集合实例等: 使用被实例化的物体的网格数据
+            obj = bpy.data.objects[instance[0]]
+            matrix = instance[1]
+        else:
+            obj = bpy.data.objects[obj_name]
+            matrix = obj.matrix_world
+            if obj.mode == 'EDIT':
+                # 编辑模式的网格随时会改变，不放入 geo_cache
+                with self.profiler.stage("add_obj_data"):
+                    self.__objs_data["data"][obj_name] = self.__build_edit_obj_data(obj)
+                return
+        obj_data = geo_cache.make_instance(self.__get_mesh_data(obj), obj_name, matrix)
+        self.__set_matrix(obj_data)
+        self.__objs_data["data"][obj_name] = obj_data
+
+    def __has_mesh_data(self, obj_name):
+        '''物体的网格数据是否已在几何缓存中，太大而不应在预先提取时读取的返回 None'''
+        instance = self.__scene_index.instances.get(obj_name)
+        obj = bpy.data.objects[instance[0] if instance is not None else obj_name]
+        if obj.mode != 'EDIT':
+            key = just_utils.mesh_key(obj)
+            # 指纹在第一次读取时记录，有指纹才能直接从几何缓存取出
+            if key in self.__fingerprints and key in geo_cache.cache:
+                return True
+        # 读取的是应用修改器后的网格，细分等修改器可能使顶点数增加很多倍，
+        # 按应用修改器后的网格判断；曲线等没有顶点数可以参考
+        obj_eval = obj.evaluated_get(self.__ctx.evaluated_depsgraph_get())
+        verts = getattr(obj_eval.data, "vertices", None)
+        if verts is None or len(verts) > MAX_LOAD_VERTS:
+            return None
+        return False
+
+    def __get_mesh_data(self, obj):
+        '''物体的网格数据 (局部空间)，同一网格只读取一次'''
+        key = just_utils.mesh_key(obj)
+        depsgraph = self.__ctx.evaluated_depsgraph_get()
+        fingerprint = self.__fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = self.__fingerprints[key] = just_utils.mesh_fingerprint(obj, depsgraph)
+        mesh_data = geo_cache.cache.get(key, fingerprint)
+        if mesh_data is None:
+            with self.profiler.stage("add_obj_data"):
+                mesh_data = self.__build_mesh_data(obj, depsgraph)
+            geo_cache.cache.put(key, fingerprint, mesh_data)
+        return mesh_data
+
+    def __build_mesh_data(self, obj, depsgraph):
+        # 使用应用修改器后的网格，与 scene.ray_cast 及视图中显示的一致
+        # 缓存会跨操作保留，并被多个物体共用，不能引用物体自身的属性
+        mesh_data = just_utils.evaluated_mesh_arrays(obj, depsgraph)
+        mesh_data["bvh"] = just_utils.bvh_from_arrays(mesh_data)
+        return mesh_data
+
+    def __set_matrix(self, obj_data):
+        '''ray_cast 使用的局部空间与世界空间的变换'''
+        obj_data["matrix_w"] = Matrix(obj_data["matrix"].tolist())
+        obj_data["bvh_local"] = obj_data["matrix_w"].inverted_safe()
+
+    def __build_edit_obj_data(self, obj):
+        # 编辑模式: 读取编辑网格，之后由 update_edit_mesh 增量更新
+        revision = geometry_revisions.get(obj.name, 0)
+        obj_data = just_utils.edit_mesh_arrays(obj)
+        matrix = np.array(obj.matrix_world, dtype=np.float64)
+        obj_data.update({
+            "name": obj.name,
+            "matrix": matrix,
+            "scale": projection.matrix_scale(matrix),
+            "edit": just_utils.edit_mesh_counts(obj),
+            "revision": revision,
+            "bvh": None,
+        })
+        self.__set_matrix(obj_data)
+        self.__build_bvh(obj_data)
+        return obj_data
+
+    def __build_bvh(self, obj_data):
+        if "edit" in obj_data:
+            obj_data["bvh"] = just_utils.edit_mesh_bvh(bpy.data.objects[obj_data["name"]])
+        else:
+            obj_data["bvh"] = just_utils.bvh_from_arrays(obj_data)
+
+    def update_edit_mesh(self, force=True):
+        '''读取编辑模式的网格，只更新移动过的元素，返回是否有改变'''
+        # 修改网格的工具在修改后调用；prepare_request 也会按 edit_interval 检查
+        # force: 为 False 时只读取 depsgraph 报告了几何改变的物体
+        self.__edit_checked = time.perf_counter()
+        changed = False
+        for obj_name, obj_data in list(self.__objs_data["data"].items()):
+            if "edit" not in obj_data:
+                continue
+            obj = bpy.data.objects.get(obj_name)
+            if obj is None or obj.mode != 'EDIT':
+                # 已退出编辑模式，下次经过时重新读取
+                self.__forget_obj(obj_name)
+                changed = True
+                continue
+            revision = geometry_revisions.get(obj_name, 0)
+            if not force and scene_index.live and revision == obj_data["revision"]:
+                # depsgraph 没有报告几何改变
+                continue
+            obj_data["revision"] = revision
+            if just_utils.edit_mesh_counts(obj) != obj_data["edit"]:
+                # 拓扑改变，下次经过时重新读取
+                self.__forget_obj(obj_name)
+                changed = True
+                continue
+            with self.profiler.stage("edit_diff"):
+                elements = mesh_update.update_co(obj_data, just_utils.edit_mesh_co(obj))
+            if elements is None:
+                continue
+            with self.profiler.stage("edit_update"):
+                self.__apply_edit(obj_name, obj_data, elements)
+            changed = True
+        return changed
+
+    def __forget_obj(self, obj_name):
+        '''删除物体的几何数据与候选点'''
+        self.__extracted.pop(obj_name, None)
+        for snap_type in SNAP_KINDS:
+            entry = self.__kd_verts_data[snap_type]["objs"].pop(obj_name, None)
+            if entry is None:
+                continue
+            for key in entry["keys"]:
+                self.__index.remove(key)
+                self.__segments.remove(key)
+        self.__objs_data["data"].pop(obj_name, None)
+
+    def __apply_edit(self, obj_name, obj_data, elements):
+        '''更新移动过的元素的候选点，只为它们加入新的子树'''
+        # 移动过的元素重新判断是否在视图内、是否被遮挡:
+        #   移出视图或移到其他面后面的从候选点中去除，从遮挡中移出的加入
+        # 旧子树中的这些点在查询时按 STALE_PIXELS 过滤，
+        # 增量子树超过 EDIT_MERGE 棵时整个物体合并为一棵
+        view = projection.view_from_rv3d(self.__region, self.__rv3d)
+        ignore_back = not self.__xray_mode
+        self.__edit_serial += 1
+        for snap_type, kind in SNAP_KINDS.items():
+            entry = self.__kd_verts_data[snap_type]["objs"].get(obj_name)
+            if entry is None:
+                continue
+            table = self.__kd_verts_data[snap_type]["data"]
+            moved = elements[kind]
+            rows = entry["rows"]
+            rows = rows[np.isin(table.idx[rows], moved)]
+            # 已提取过的元素: 在候选点中，或已计算过遮挡 (之前被遮挡)
+            known = self.__known_idx(entry, moved, table.idx[rows])
+            # 线段与边中点分别提取，边中点不在候选点中的边也可能有线段
+            segs = None
+            if "segs" in entry:
+                segs = self.__known_idx(entry["segs_vis"], moved,
+                        entry["segs"][np.isin(entry["segs"], moved)])
+            if len(known) == 0 and (segs is None or len(segs) == 0):
+                continue
+            visible = extract.retest_idx(
+                    obj_data, kind, known, view, ignore_back, self.__margin, entry)
+            hidden = rows[~np.isin(table.idx[rows], visible)]
+            if len(hidden):
+                # 旧子树中的这些点按 STALE_PIXELS 过滤
+                table.update(hidden, np.full((len(hidden), 2), np.nan),
+                        table.depth[hidden], table.w3d[hidden])
+                entry["rows"] = entry["rows"][~np.isin(entry["rows"], hidden)]
+            rows = rows[np.isin(rows, hidden, invert=True)]
+            added = visible[~np.isin(visible, table.idx[rows])]
+            if len(rows):
+                idx = table.idx[rows]
+                w3d = extract.world_points(obj_data, obj_data[extract.KIND_KEYS[kind]][idx])
+                s2d, depth, _ = projection.project_points(w3d, view)
+                table.update(rows, s2d, depth, w3d)
+            if len(added):
+                w3d = extract.world_points(obj_data, obj_data[extract.KIND_KEYS[kind]][added])
+                s2d, depth, _ = projection.project_points(w3d, view)
+                new_rows = table.append(obj_name, s2d, depth, w3d, added)
+                entry["rows"] = np.concatenate((entry["rows"], new_rows))
+                rows = np.concatenate((rows, new_rows))
+            if segs is not None and len(segs):
+                visible_segs = extract.retest_idx(obj_data, extract.SEGMENTS, segs, view,
+                        ignore_back, self.__margin, entry["segs_vis"])
+                entry["segs"] = np.concatenate(
+                        (entry["segs"][~np.isin(entry["segs"], segs)], visible_segs))
+            if len(entry["keys"]) > EDIT_MERGE:
+                self.__merge_entry(snap_type, obj_name, entry, view)
+                continue
+            key = (snap_type, obj_name, "edit", self.__edit_serial)
+            if len(rows):
+                self.__index.insert(key, table.s2d[rows].tolist(), rows, snap_type)
+            if segs is not None and len(segs):
+                for old in entry["keys"]:
+                    self.__segments.discard(old, segs)
+                ends = extract.edge_ends(obj_data, visible_segs, view)
+                self.__segments.insert(key, ends[:, 0], ends[:, 1], visible_segs)
+            entry["keys"].append(key)
+        extract.release_depth(obj_data)
+        # 物体包围盒可能改变，只更新上层节点
+        self.__scene_index.set_bounds(obj_name, *projection.transform_bounds(
+                obj_data["co"].min(axis=0), obj_data["co"].max(axis=0), obj_data["matrix"]))
+        self.__scene_index.bvh()
+
+    @staticmethod
+    def __known_idx(vis, moved, current):
+        '''移动过的元素中已提取过的: current 中的，以及 vis 中已计算过遮挡的'''
+        tested = vis["tested"]
+        if tested is None or len(tested) == 0:
+            return np.unique(current)
+        return np.union1d(current, moved[tested[moved]])
+
+    def __merge_entry(self, snap_type, obj_name, entry, view):
+        '''物体的全部子树合并为一棵'''
+        for key in entry["keys"]:
+            self.__index.remove(key)
+            self.__segments.remove(key)
+        table = self.__kd_verts_data[snap_type]["data"]
+        rows = entry["rows"]
+        key = (snap_type, obj_name)
+        entry["keys"] = [key]
+        self.__index.insert(key, table.s2d[rows].tolist(), rows, snap_type)
+        if snap_type == "MIDPOINTS":
+            self.__insert_segments(key, obj_name, entry["segs"], view)
+
+    def __insert_segments(self, key, obj_name, edges, view):
+        '''按当前视图重新投影边，加入线段索引'''
+        ends = extract.edge_ends(self.__objs_data["data"][obj_name], edges, view)
+        self.__segments.insert(key, ends[:, 0], ends[:, 1], edges)
 
     def __update_kd_tree(self):
+        '''返回鼠标下需要提取候选点的物体的拾取结果，见 __pick'''
         self.__update_view()
 
-        if self.__snap_type == "ORIGINS":
-            if self.__kd_verts_data["ORIGINS"]["kd"] is None:
+        if self.__snap_type in ("ORIGINS", "ALL"):
+            if self.__index.size(("ORIGINS",)) == 0:
                 self.__update_origins_kd_tree()
+            if self.__snap_type == "ORIGINS":
+                return []
+        if self.__snap_type == "SURFACE":
+            # 只需要鼠标下的交点，在查询时计算
+            return []
+
+        if self.tile_mode:
+            view = projection.view_from_rv3d(self.__region, self.__rv3d)
+            self.__near_tiles = set(
+                    extract.tiles_near(self.mouse_position, SEARCH_RADIUS, view).tolist())
+        # 透视模式下鼠标下的所有物体，否则只有最近的物体
+        with self.profiler.stage("ray_cast"):
+            hits = self.__pick(first=not self.__xray_mode)
+        for hit in hits:
+            self.prefetcher.used(hit["name"])
+        return [hit for hit in hits if self.__need_extract(hit["name"])]
+
+    def __need_extract(self, obj_name):
+        record = self.__extracted.get(obj_name)
+        if record is None or not record["fresh"]:
+            return True
+        if self.tile_mode:
+            # 鼠标附近有未提取的格子
+            return record["tiles"] is not None and not self.__near_tiles <= record["tiles"]
+        return record["tiles"] is not None
+
+    def __make_job(self, hit, view, near_tiles=None):
+        '''为需要提取的物体生成任务，之后不会重复提交'''
+        # 一次提取全部吸附类型的元素，切换吸附类型时不需要重新提取
+        # near_tiles: 要提取的屏幕格子，默认为鼠标附近的格子
+        if near_tiles is None:
+            near_tiles = self.__near_tiles
+        obj_name = hit["name"]
+        obj_data = self.__objs_data["data"][obj_name]
+        ignore_back = not self.__xray_mode
+        record = self.__extracted.get(obj_name)
+        if record is None:
+            record = {
+                "fresh": False,
+                "tiles": None,
+                "part": 0,
+                "lod": 0,
+                "dir": None,
+            }
+            self.__extracted[obj_name] = record
+        entries = {}
+        for snap_type, kind in SNAP_KINDS.items():
+            snap_data = self.__kd_verts_data[snap_type]
+            entry = snap_data["objs"].get(obj_name)
+            if entry is None:
+                entry = {
+                    "rows": np.empty(0, dtype=np.int64),
+                    "keys": [],
+                    "tested": None,
+                    "visible": None,
+                }
+                snap_data["objs"][obj_name] = entry
+            if snap_type == "MIDPOINTS":
+                entry.setdefault("segs", np.empty(0, dtype=np.int64))
+                entry.setdefault("segs_vis", {"tested": None, "visible": None})
+            if not record["fresh"] or not self.tile_mode:
+                # 重新提取，替换之前的结果
+                # 在这里而不是取回结果时清除，同一物体的多次提取可能不按顺序完成
+                for key in entry["keys"]:
+                    self.__index.remove(key)
+                    self.__segments.remove(key)
+                entry["keys"] = []
+                entry["rows"] = np.empty(0, dtype=np.int64)
+                if "segs" in entry:
+                    entry["segs"] = np.empty(0, dtype=np.int64)
+            entries[kind] = entry
+        if not record["fresh"] or not self.tile_mode:
+            record["part"] = 0
+            record["tiles"] = set() if self.tile_mode else None
+            # 按鼠标下的点在屏幕上的网格密度选择细节级别，之后的各次提取使用同一级别
+            record["lod"] = snap_lod.choose_level(
+                    obj_data, projection.pixels_per_unit(view, hit["location"]))
+        tiles = None
+        if self.tile_mode:
+            tiles = np.array(sorted(near_tiles - record["tiles"]), dtype=np.int64)
+            record["tiles"].update(tiles.tolist())
+        part = record["part"]
+        record["part"] += 1
+        record["fresh"] = True
+        vis = None
+        if ignore_back:
+            if record["dir"] is None:
+                # 以第一次计算遮挡时的方向为准，避免误差累积
+                record["dir"] = projection.view_direction(view)
+            vis = dict(entries)
+            vis[extract.SEGMENTS] = entries["EDGES"]["segs_vis"]
+        kinds = tuple(SNAP_KINDS.values())
+        return (obj_name, obj_data, kinds, ignore_back, self.__margin, vis, tiles, part, record["lod"])
+
+    @staticmethod
+    def iter_request(request):
+        '''逐块提取候选点，离鼠标近的先返回'''
+        # yield (obj_name, {kind: data}, (part, chunk))
+        #   part:  物体的第几次提取
+        #   chunk: 本次提取的第几块
+        for obj_name, obj_data, kinds, ignore_back, margin, vis, tiles, part, lod in request.jobs:
+            chunks = extract.iter_obj_data(obj_data, request.view, request.mouse,
+                    ignore_back, margin, vis, request.prof, tiles, lod, kinds)
+            for chunk, data in enumerate(chunks):
+                yield obj_name, data, (part, chunk)
+
+    @staticmethod
+    def compute_request(request, emit=None):
+        '''提取候选点，只使用请求中的数据，可以在工作线程中执行'''
+        # return [(obj_name, {kind: data}, (part, chunk)), ...]
+        # emit: 每块完成后立即发布，返回 False 时停止
+        rs = []
+        for item in JustSnap.iter_request(request):
+            if emit is None:
+                rs.append(item)
+            elif not emit([item]):
+                break
+        return rs
+
+    def apply_result(self, request, result):
+        '''把提取结果加入候选点表与索引，只能在主线程调用'''
+        # 各类元素分别加入对应吸附类型的表
+        for obj_name, chunk_data, (part, chunk) in result:
+            if chunk_data is None:
+                continue
+            for kind, data in chunk_data.items():
+                if kind == extract.SEGMENTS:
+                    self.__apply_segments(obj_name, data, part, chunk)
+                    continue
+                snap_type = KIND_SNAP_TYPES[kind]
+                snap_data = self.__kd_verts_data[snap_type]
+                entry = snap_data["objs"].get(obj_name)
+                if entry is None or data is None:
+                    continue
+                rows = snap_data["data"].append(
+                        obj_name, data["s2d"], data["depth"], data["w3d"], data["idx"])
+                entry["rows"] = np.concatenate((entry["rows"], rows))
+                # 每块单独建子树
+                key = (snap_type, obj_name, part, chunk)
+                with self.profiler.stage("kd_insert"):
+                    self.__index.insert(key, data["s2d"].tolist(), rows, snap_type)
+                entry["keys"].append(key)
+                self.profiler.count("rebuilds")
+
+    def __apply_segments(self, obj_name, data, part, chunk):
+        '''边线段加入线段索引，与同一块的边中点共用子树的 key，编号为边下标'''
+        entry = self.__kd_verts_data["MIDPOINTS"]["objs"].get(obj_name)
+        if entry is None or data is None:
             return
-        
-        depsgraph = self.__ctx.evaluated_depsgraph_get()
-        hit_objs = []
-        snap_data = self.__kd_verts_data[self.__snap_type]
-        
-        if self.__xray_mode:
-            hits = self.__get_objs_under_mouse()
-            for obj_name in hits:
-                if obj_name in self.__visible_objs_name \
-                        and obj_name not in snap_data["objs"]:
-                    if obj_name not in self.__objs_data["data"]:
-                        self.__add_obj_data(obj_name)
-                    
-                    bvh = self.__objs_data["data"][obj_name]["bvh"]
-                    # location, normal, index, distance
-                    hit_location, _, face_index, _ = bvh.ray_cast(self.mouse_position_world, self.mouse_vector)
-                    if hit_location is None:
-                        continue
-                    bm = self.__objs_data["data"][obj_name]["bm"]
-                    if just_utils.ignore_high_density_mesh(
-                            bm.faces[face_index].verts, self.__region, self.__rv3d):
-                        continue
-                    hit_objs.append({
-                        "name": obj_name,
-                        "location": hit_location,
-                        "index": face_index
-                    })
-            if len(hit_objs) == 0:
-                return
-        else:
-            (direct_hit, hit_location, _, face_index, hit_object, _) = self.__ctx.scene.ray_cast(
-                    depsgraph, origin=self.mouse_position_world,
-                    direction=self.mouse_vector)
-            # print(direct_hit, hit_object)
-            if direct_hit is False:
-                return
-            obj_name = hit_object.name
-            if obj_name not in self.__visible_objs_name \
-                    or obj_name in snap_data["objs"]:
-                return
+        key = ("MIDPOINTS", obj_name, part, chunk)
+        ends = data["ends2d"]
+        with self.profiler.stage("kd_insert"):
+            self.__segments.insert(key, ends[:, 0], ends[:, 1], data["idx"])
+        entry["segs"] = np.concatenate((entry["segs"], data["idx"]))
+        if key not in entry["keys"]:
+            entry["keys"].append(key)
+
+    def step(self, budget=None):
+        '''在时间预算内继续同步提取未完成的分块，返回是否有新的候选点'''
+        if budget is None:
+            budget = self.frame_budget
+        deadline = time.perf_counter() + budget
+        changed = False
+        while self.__tasks:
+            request, chunks = self.__tasks[0]
+            for item in chunks:
+                self.apply_result(request, [item])
+                changed = True
+                if time.perf_counter() > deadline:
+                    return changed
+            self.__tasks.pop(0)
+        return changed
+
+    def prefetch(self, budget=None):
+        '''空闲时预先提取鼠标将要经过的物体，返回是否有新的候选点'''
+        # 在时间预算内逐块提取，剩下的在之后的调用中继续；视图改变时全部取消
+        if budget is None:
+            budget = self.prefetch_budget
+        self.__update_view()
+        if not self.__tasks:
+            with self.profiler.stage("prefetch"):
+                self.__start_prefetch()
+        return self.step(budget)
+
+    def __start_prefetch(self):
+        if self.__snap_type in ("ORIGINS", "SURFACE"):
+            return
+        segment = self.prefetcher.predict()
+        if segment is None:
+            return
+        view = projection.view_from_rv3d(self.__region, self.__rv3d)
+        key = projection.view_key(view)
+        if self.__screen_rects is None or self.__screen_rects[0] != key:
+            # 物体在屏幕上的包围矩形，按网格索引；完全在相机后面的物体没有矩形，不加入
+            index = self.__scene_index
+            rects, front = projection.project_boxes(
+                    projection.box_corners(index.lo, index.hi), view)
+            grid = RectGrid(view.width, view.height)
+            idx = np.flatnonzero(front)
+            grid.build(idx.tolist(), rects[idx])
+            self.__screen_rects = (key, len(rects), grid, idx)
+        _, count, grid, idx = self.__screen_rects
+        mask = self.__pick_mask
+        if len(mask) != count:
+            # 编辑模式下物体增删后 scene_index 已改变
+            return
+        p0, p1 = segment
+        # 只检查与路径的包围矩形相交的物体
+        near = grid.query_rect(*np.minimum(p0, p1), *np.maximum(p0, p1))
+        order, t = self.prefetcher.targets(segment, grid.rects[near], mask[idx[near]])
+        idxs = idx[near[order]].tolist()
+        t = t[order]
+        jobs = []
+        names = []
+        loads = 0
+        for i, enter in zip(idxs, t.tolist()):
+            obj_name = self.__scene_bvh.names[i]
+            if obj_name in self.__extracted or self.prefetcher.is_pending(obj_name):
+                continue
             if obj_name not in self.__objs_data["data"]:
+                # 读取网格在主线程进行，不在时间预算内，
+                # 没有几何缓存的物体每次最多读取 MAX_LOADS 个，且只读取小网格
+                cached = self.__has_mesh_data(obj_name)
+                if cached is None:
+                    continue
+                if not cached:
+                    if loads >= MAX_LOADS:
+                        continue
+                    loads += 1
                 self.__add_obj_data(obj_name)
-            bm = self.__objs_data["data"][obj_name]["bm"]
-            if just_utils.ignore_high_density_mesh(
-                    bm.faces[face_index].verts, self.__region, self.__rv3d):
-                return
-            
-            hit_objs.append({
-                "name": obj_name,
-                "location": hit_location,
-                "index": face_index
-            })
-        # print("重建 kdtree2")            
-        for _, item in enumerate(hit_objs):
-            obj_name = item["name"]
-            # if obj_name not in snap_data["objs"]:
-            # print("重建 kdtree2")
-            snap_data["objs"].append(obj_name)
-            data = {}
-            obj_data = self.__objs_data["data"][obj_name]
-            ignore_back = not self.__xray_mode
-            if self.__snap_type == "POINTS":
-                data = just_utils.get_vert_data(
-                    obj_data, self.__region, self.__rv3d, 
-                    self.__v3d_0_0, self.__v3d_w_h, ignore_back )
-            elif self.__snap_type == "MIDPOINTS":
-                data = just_utils.get_edge_data(
-                    obj_data, self.__region, self.__rv3d, 
-                    self.__v3d_0_0, self.__v3d_w_h, ignore_back )
-            elif self.__snap_type == "FACES":
-                data = just_utils.get_face_data(
-                    obj_data, self.__region, self.__rv3d, 
-                    self.__v3d_0_0, self.__v3d_w_h, ignore_back )
-            if len(data) == 0:
-                continue
-            snap_data["data"].update(data)
-        self.__kd_tree_from_cache(self.__snap_type)
+            # 从鼠标进入物体的位置附近开始提取
+            mouse = p0 + (p1 - p0) * enter
+            tiles = None
+            if self.tile_mode:
+                tiles = set(extract.tiles_near(mouse, SEARCH_RADIUS, view).tolist())
+            center = (self.__scene_index.lo[i] + self.__scene_index.hi[i]) / 2
+            jobs.append(self.__make_job({"name": obj_name, "location": center}, view, tiles))
+            names.append(obj_name)
+            if len(jobs) >= MAX_TARGETS:
+                break
+        if not jobs:
+            return
+        self.prefetcher.started(names)
+        self.profiler.count("prefetch", len(jobs))
+        request = SnapRequest(
+            self.pipeline.next_generation(),
+            tuple(p0 + (p1 - p0) * t[0]),
+            view,
+            self.__snap_type,
+            self.__xray_mode,
+            tuple(jobs),
+            self.profiler,
+        )
+        self.__tasks.append((request, self.iter_request(request)))
+
+    def prepare_request(self, event):
+        '''截取鼠标位置与视图，生成提取请求，只能在主线程调用'''
+        self.__update_mouse(event)
+        if time.perf_counter() - self.__edit_checked >= self.edit_interval:
+            self.update_edit_mesh(force=False)
+        hits = self.__update_kd_tree()
+        view = projection.view_from_rv3d(self.__region, self.__rv3d)
+        jobs = tuple(self.__make_job(hit, view) for hit in hits)
+        if jobs:
+            self.profiler.count("objects", len(jobs))
+        return SnapRequest(
+            self.pipeline.next_generation(),
+            self.mouse_position,
+            view,
+            self.__snap_type,
+            self.__xray_mode,
+            jobs,
+            self.profiler,
+        )
+
+    def update_mouse(self, event):
+        '''只更新鼠标位置与视图，之后由 query_snap_point 在已有的候选点中查询'''
+        self.__update_view()
+        self.__update_mouse(event)
+        # 每次交互的查询记录一次，后台提取的提交不记录
+        if self.trace is not None:
+            self.__record_trace()
+
+    def submit_request(self, event):
+        '''在后台提取候选点，结果由 poll_results 取回'''
+        request = self.prepare_request(event)
+        if request.jobs:
+            self.pipeline.submit(request)
+
+    def poll_results(self, budget=None):
+        '''取回后台提取的结果，有新的候选点时返回 True'''
+        # 在时间预算内处理，剩下的留到下一次
+        if budget is None:
+            budget = self.frame_budget
+        deadline = time.perf_counter() + budget
+        self.__backlog.extend(self.pipeline.poll())
+        n = 0
+        while n < len(self.__backlog):
+            request, result = self.__backlog[n]
+            self.apply_result(request, result)
+            n += 1
+            if time.perf_counter() > deadline:
+                break
+        del self.__backlog[:n]
+        return n > 0
 
-    
     def __reset_data(self):
         '''视角改变时重置数据'''
         # 重置数据
@@ -296,48 +979,58 @@ class JustSnap:
         #     d["kd"] = None
 
 
-        # data: {
-        #     屏幕      世界     名称   下标
-        #     (0,0): ( (0,0,0), "name", 0 )  
+        # data: 候选点表 CandidateTable
+        # objs: 已加入的物体 {
+        #     "name": {
+        #         "rows":    在候选点表中的行号
+        #         "keys":    在索引中的子树，分块提取时每块一棵
+        #         "tested":  已计算遮挡的元素 (bool 数组)
+        #         "visible": 未被遮挡的元素 (bool 数组)
+        #         "segs":     线段索引中的边下标，只有 MIDPOINTS 有，见 extract.SEGMENTS
+        #         "segs_vis": 线段的遮挡结果 {"tested": ..., "visible": ...}
+        #     }
         # }
         self.__kd_verts_data = {
             "ORIGINS": {
-                "data": {},
-                "kd": None,
-                "objs": []
+                "data": CandidateTable(),
+                "objs": {}
             },
             "POINTS": {
-                "data": {},
-                "kd": None,
-                "objs": []
+                "data": CandidateTable(),
+                "objs": {}
             },
             "MIDPOINTS": {
-                "data": {},
-                "kd": None,
-                "objs": []
+                "data": CandidateTable(),
+                "objs": {}
             },
             "FACES": {
-                "data": {},
-                "kd": None,
-                "objs": []
+                "data": CandidateTable(),
+                "objs": {}
             },
         }
+        # 全部类型共用的屏幕座标索引，子树以吸附类型为标签，返回候选点表的行号
+        self.__index = SnapIndex()
+        # 边的屏幕空间线段索引，key 与边中点的子树相同，返回边下标 (见 extract.SEGMENTS)
+        self.__segments = SegmentGrid(self.__region.width, self.__region.height)
+        # 已提取的物体，各吸附类型一起提取，共用同一记录 {
+        #     "name": {
+        #         "tiles":   已提取的屏幕格子 (set)，提取整个视图时为 None
+        #         "part":    下一次提取的序号
+        #         "lod":     提取时使用的细节级别
+        #         "fresh":   是否已按当前视图提取，视图改变后为 False
+        #         "dir":     计算遮挡时的视线方向，不计算遮挡时为 None
+        #     }
+        # }
+        self.__extracted = {}
+        self.__reset_view()
 
+    def __reset_view(self):
+        '''更新视图相关的数据'''
         self.__view_distance = self.__rv3d.view_distance
         self.__view_matrix = self.__rv3d.view_matrix.copy()
 
-        self.__v3d_0_0 = just_utils.screen_to_world(self.__region, self.__rv3d, (20,20))
-        self.__v3d_w_h = just_utils.screen_to_world(self.__region, self.__rv3d, 
-            (self.__region.width - 20, self.__region.height-20))
-        
-        # bpy.data.objects["x0"].location = self.__v3d_0_0
-        # bpy.data.objects["x1"].location = self.__v3d_w_h
-
-        # {
-        #     名称      最小值      最大值      
-        #     "name": ((x0, y0), (x1, y1)) 
-        # }
-        self.__screen_bound_data = {}
+        # 屏幕边缘 20 像素内的点不吸附
+        self.__margin = 20
 
         self.update_xray_mode()
                 
@@ -348,44 +1041,132 @@ class JustSnap:
         #   True,           是否吸附成功
         #   (x, y),         吸附到的屏幕座标 Or None
         #   (x, y, z),      吸附到的世界座标 Or None
-        #   obj_name,       吸附物体名称 Or ""
-        #   [(x, y, z) ...] 周围可吸附的最近的点，最多6个
+        #   obj_name,       吸附物体名称 Or ""，集合实例等为 (实例化物体名称, persistent_id)
+        #   [(x, y, z) ...] 周围可吸附的最近的点，最多6个，吸附成功时也返回
         # )
-        self.__update_mouse(event)
-        self.__update_kd_tree()
-        data = self.__kd_verts_data[self.__snap_type]
-
-        self.xxxx = data["data"]
-        # print(data)
-        if data["kd"]:
-            search_distance = 200 
-            points_found = data["kd"].find_range(((self.mouse_position[0], self.mouse_position[1], 0)), search_distance)
-            len_found = len(points_found)
-            if len_found == 0:
-                return False, None, None, "", []
-            elif len_found == 1:
-                found = points_found
-            else:
-                found = sorted(points_found, key=lambda point: point[2])[:6]
-
-            kd_data = data["data"]
-            
-
-            closest = None
-            if found[0][2] < 20:
-                closest = found[0][0]
-                k = (floor(closest[0]), floor(closest[1]))
-                
-                return True, k, kd_data[k][0], kd_data[k][1], []
-            else:
-                closest_6 = []
-                for fd in found:
-                    k = (floor(fd[0][0]), floor(fd[0][1]))
-                    closest_6.append(kd_data[k][0])
-                return False, None, None, "", closest_6
-        return False, None, None, "", []
+        # 吸附到的点的类型见 snap_kind，周围的点的类型见 closest_kinds
+        # 大物体分块提取，只在 frame_budget 内处理离鼠标近的部分，
+        # 剩下的在之后的调用或 step() 中继续
+        with self.profiler.stage("total"):
+            request = self.prepare_request(event)
+            if self.trace is not None:
+                self.__record_trace()
+            if request.jobs:
+                self.__tasks.append((request, self.iter_request(request)))
+            self.step()
+            return self.query_snap_point()
+
+    def query_snap_point(self):
+        '''在已有的候选点中查找离鼠标最近的吸附点，返回值同 get_snap_point'''
+        # 同时设置
+        #   snap_kind:     吸附到的点的类型，未吸附时为 None
+        #   closest_kinds: 周围的点的类型，与返回的周围的点对应
+        # "ALL" 模式下各类型在同一个索引中一次查询，
+        # 先按距离筛选出 SNAP_RADIUS 内的点，再在其中按 距离 + snap_bias 选择吸附点；
+        # 周围的点不论是否吸附都会返回
+        if self.__snap_type == "EDGE":
+            return self.__query_edge()
+        if self.__snap_type == "SURFACE":
+            return self.__query_surface()
+        if self.__snap_type == "ALL":
+            snap_types = ALL_SNAP_TYPES
+            self.xxxx = None
+        else:
+            snap_types = (self.__snap_type,)
+            self.xxxx = self.__kd_verts_data[self.__snap_type]["data"]
+        self.snap_kind = None
+        self.closest_kinds = []
+        if self.__index.size(snap_types) == 0:
+            return False, None, None, "", []
+        with self.profiler.stage("kd_query"):
+            points_found = self.__index.find_range_tagged(
+                    self.mouse_position, SEARCH_RADIUS, snap_types)
+        self.profiler.count("found", len(points_found))
+        if len(points_found) == 0:
+            return False, None, None, "", []
+
+        found = {}
+        for co, row, dist, snap_type in points_found:
+            found.setdefault(snap_type, []).append((dist, row, co[0], co[1]))
+        # (排序值, 距离, 类型, 行号)
+        ranked = []
+        for snap_type, items in found.items():
+            items.sort()
+            table = self.__kd_verts_data[snap_type]["data"]
+            rows = np.array([item[1] for item in items], dtype=np.int64)
+            kd_s2d = np.array([item[2:] for item in items], dtype=np.float64)
+            # 编辑模式下移动过的点，旧子树中的位置已过期
+            live = np.abs(table.s2d[rows] - kd_s2d).max(axis=1) < STALE_PIXELS
+            rows = table.resolve(rows[live])[:6]
+            dists = np.hypot(*(table.s2d[rows] - self.mouse_position).T)
+            bias = self.snap_bias.get(snap_type, 0) if len(snap_types) > 1 else 0
+            for row, dist in zip(rows.tolist(), dists.tolist()):
+                ranked.append((dist + bias, dist, snap_type, row))
+        if len(ranked) == 0:
+            return False, None, None, "", []
+        ranked.sort(key=lambda item: item[:2])
+        # bias 只决定先后，不会让 SNAP_RADIUS 内的点因为排在后面而不能吸附
+        snappable = [item for item in ranked if item[1] < SNAP_RADIUS]
+        closest_6 = []
+        for _, _, snap_type, row in ranked[:6]:
+            closest_6.append(Vector(self.__kd_verts_data[snap_type]["data"].w3d[row]))
+            self.closest_kinds.append(snap_type)
+        if len(snappable) == 0:
+            return False, None, None, "", closest_6
+
+        _, _, snap_type, row = snappable[0]
+        table = self.__kd_verts_data[snap_type]["data"]
+        s2d = table.s2d[row]
+        k = (floor(s2d[0]), floor(s2d[1]))
+        self.snap_kind = snap_type
+        return True, k, Vector(table.w3d[row]), table.names[table.obj[row]], closest_6
+
+    def __query_edge(self):
+        '''边上离鼠标最近的点'''
+        self.xxxx = None
+        self.snap_kind = None
+        self.closest_kinds = []
+        with self.profiler.stage("kd_query"):
+            found = self.__segments.nearest(self.mouse_position, SEARCH_RADIUS, 6)
+        self.profiler.count("found", len(found))
+        if len(found) == 0:
+            return False, None, None, "", []
+        view = projection.view_from_rv3d(self.__region, self.__rv3d)
+        points = []
+        for dist, key, edge, t in found:
+            # key 同边中点的子树，第二项为物体名称
+            obj_name = key[1]
+            obj_data = self.__objs_data["data"][obj_name]
+            a, b = extract.world_points(obj_data, obj_data["co"][obj_data["edges"][edge]])
+            points.append((dist, obj_name, projection.point_on_segment(a, b, t, view)))
+        self.closest_kinds = ["EDGE"] * len(points)
+        closest = [Vector(co) for _, _, co in points]
+        dist, obj_name, co = points[0]
+        if dist < SNAP_RADIUS:
+            s2d, _, _ = projection.project_points(co, view)
+            k = (floor(s2d[0, 0]), floor(s2d[0, 1]))
+            self.snap_kind = "EDGE"
+            return True, k, Vector(co), obj_name, closest
+        return False, None, None, "", closest
+
+    def __query_surface(self):
+        '''鼠标下的面上的点'''
+        self.xxxx = None
+        self.snap_kind = None
+        self.closest_kinds = []
+        with self.profiler.stage("ray_cast"):
+            hits = self.__pick(first=True)
+        if len(hits) == 0:
+            return False, None, None, "", []
+        hit = hits[0]
+        self.snap_kind = "SURFACE"
+        k = (floor(self.mouse_position[0]), floor(self.mouse_position[1]))
+        return True, k, Vector(hit["location"]), hit["name"], []
 
     def update_xray_mode(self):
+        self.__xray_mode = self.__shading_xray()
+
+    def __shading_xray(self):
         xray = False
         shading = self.__space_data.shading
         shading_type = shading.type
@@ -393,23 +1174,4 @@ class JustSnap:
             xray = shading.show_xray_wireframe
         elif shading_type == 'SOLID':
             xray = shading.show_xray
-        self.__xray_mode = xray
-
-        if xray:
-            for obj_name, bound in self.__objs_data["box"].items():
-
-                M = just_utils.matrix_screen_to_matrix_world(self.__rv3d, self.__v3d_0_0)
-                isInView, v = just_utils.is_in_view(bound, M, self.__v3d_w_h)
-                if isInView:
-                    M = M.inverted()
-                    minV = M @ Vector((v[0], v[1], 0))
-                    maxV = M @ Vector((v[2], v[3], 0))
-                    minV = just_utils.world_to_screen(self.__region, self.__rv3d, minV)
-                    maxV = just_utils.world_to_screen(self.__region, self.__rv3d, maxV)
-                    # print(obj_name, minV, maxV)
-                    self.__screen_bound_data[obj_name] = (minV, maxV)
-
-
-
- 
-                
+        return xray
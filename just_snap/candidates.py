@@ -0,0 +1,132 @@
+import numpy as np
+
+# 候选点表，以数组储存
+# 不依赖 bpy，可以在 blender 之外运行
+#
+#   s2d:   屏幕座标 (N, 2) float
+#   depth: 视图深度 (N,)
+#   w3d:   世界座标 (N, 3)
+#   obj:   物体编号 (N,)，对应 names
+#   idx:   元素下标 (N,)，顶点/边/面 的 index
+#
+# version 在内容改变时递增，用于判断缓存 (例如绘制批次) 是否有效
+
+
+class CandidateTable:
+    def __init__(self, capacity=1024):
+        self.names = []
+        self.__name_ids = {}
+        self.__size = 0
+        self.version = 0
+        self.__alloc(capacity)
+
+    def __alloc(self, capacity):
+        self.__s2d = np.empty((capacity, 2), dtype=np.float64)
+        self.__depth = np.empty(capacity, dtype=np.float64)
+        self.__w3d = np.empty((capacity, 3), dtype=np.float64)
+        self.__obj = np.empty(capacity, dtype=np.int32)
+        self.__idx = np.empty(capacity, dtype=np.int64)
+
+    def __grow(self, size):
+        capacity = len(self.__depth)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        old = (self.__s2d, self.__depth, self.__w3d, self.__obj, self.__idx)
+        self.__alloc(capacity)
+        n = self.__size
+        for new, src in zip(
+                (self.__s2d, self.__depth, self.__w3d, self.__obj, self.__idx), old):
+            new[:n] = src[:n]
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def s2d(self):
+        return self.__s2d[:self.__size]
+
+    @property
+    def depth(self):
+        return self.__depth[:self.__size]
+
+    @property
+    def w3d(self):
+        return self.__w3d[:self.__size]
+
+    @property
+    def obj(self):
+        return self.__obj[:self.__size]
+
+    @property
+    def idx(self):
+        return self.__idx[:self.__size]
+
+    def name_id(self, name):
+        i = self.__name_ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.names.append(name)
+            self.__name_ids[name] = i
+        return i
+
+    def append(self, obj, s2d, depth, w3d, idx):
+        '''加入一批候选点，返回它们的行号'''
+        # obj: 物体名称 (集合实例等为元组，见 JustSnap)，或每个点的物体编号数组
+        n = len(depth)
+        start = self.__size
+        end = start + n
+        self.__grow(end)
+        if not isinstance(obj, np.ndarray):
+            obj = self.name_id(obj)
+        self.__s2d[start:end] = s2d
+        self.__depth[start:end] = depth
+        self.__w3d[start:end] = w3d
+        self.__obj[start:end] = obj
+        self.__idx[start:end] = idx
+        self.__size = end
+        self.version += 1
+        return np.arange(start, end)
+
+    def clear(self):
+        self.__size = 0
+        self.version += 1
+
+    def compact(self, rows):
+        '''只保留 rows，按 rows 的顺序重新编号为 0..n-1'''
+        rows = np.asarray(rows, dtype=np.int64)
+        n = len(rows)
+        for col in (self.__s2d, self.__depth, self.__w3d, self.__obj, self.__idx):
+            col[:n] = col[rows]
+        self.__size = n
+        self.version += 1
+
+    def set_screen(self, s2d, depth):
+        '''视图改变后，更新全部行的屏幕座标与深度'''
+        n = self.__size
+        self.__s2d[:n] = s2d
+        self.__depth[:n] = depth
+        self.version += 1
+
+    def update(self, rows, s2d, depth, w3d):
+        '''更新部分行的座标，例如编辑模式下移动过的元素'''
+        self.__s2d[rows] = s2d
+        self.__depth[rows] = depth
+        self.__w3d[rows] = w3d
+        self.version += 1
+
+    def resolve(self, rows):
+        '''同一屏幕像素上只保留最靠前的候选点，保持 rows 原有顺序'''
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) < 2:
+            return rows
+        pixel = np.floor(self.__s2d[rows]).astype(np.int64)
+        # 按像素分组，组内按深度排序，取每组第一个
+        order = np.lexsort((self.__depth[rows], pixel[:, 1], pixel[:, 0]))
+        p = pixel[order]
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = (p[1:] != p[:-1]).any(axis=1)
+        keep = np.zeros(len(rows), dtype=bool)
+        keep[order[first]] = True
+        return rows[keep]
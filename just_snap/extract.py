@@ -0,0 +1,604 @@
+import threading
+import numpy as np
+from . import projection
+from .visibility import DepthBuffer
+from . import lod as snap_lod
+from .profiler import NULL_PROFILER
+
+# 从物体几何数据中提取吸附候选点
+# 只使用 numpy 数组与视图快照 (projection.View)，不访问 bpy，
+# 可以在后台线程或 blender 之外运行
+
+# 遮挡判断方式
+#   "DEPTH": 软件深度缓冲，一次判断全部
+#   "RAY":   逐个 BVH ray_cast，作为参照 (需要 mathutils，只能在 blender 中使用)
+VISIBILITY_MODE = "DEPTH"
+
+# 元素数不少于此值的物体分块提取，从鼠标所在的屏幕格子向外一圈圈进行
+PROGRESSIVE_MIN = 100000
+# 分块提取的屏幕格子边长 (像素)
+TILE_SIZE = 128
+# 每块最多的元素数
+CHUNK_SIZE = 20000
+
+# 吸附类型对应的世界座标数据
+KIND_KEYS = {
+    "VERTS": "co",
+    "EDGES": "mids",
+    "FACES": "centers",
+}
+
+# 吸附到边上的点 (EDGE) 所用的边线段，与 EDGES 一起提取，按边下标:
+#   不按 LOD 减少，减少后边上的点就无法吸附
+#   线段截到屏幕内后不为空即在视图内，不看边中点
+#   截取后的两端与中点中任意一点未被遮挡即可见
+SEGMENTS = "SEGMENTS"
+
+
+# obj_data["matrix"]: 物体的 matrix_world (4, 4)，有此项时座标为局部空间 (实例共用的网格数据)，
+# 没有时座标已在世界空间
+
+
+def local_view(obj_data, view):
+    '''投影 obj_data 中的座标所用的视图'''
+    matrix = obj_data.get("matrix")
+    if matrix is None:
+        return view
+    return projection.object_view(view, matrix)
+
+def world_points(obj_data, co):
+    '''obj_data 中的座标变换到世界空间，只变换需要的点'''
+    matrix = obj_data.get("matrix")
+    if matrix is None:
+        return co
+    return projection.transform_points(co, matrix)
+
+def project_obj_data(obj_data, view):
+    '''投影物体的顶点、边中点、面中心，同一视图下只计算一次'''
+    key = projection.view_key(view)
+    cache = obj_data.get("proj")
+    if cache is not None and cache[0] == key:
+        return cache[1]
+    rs = projection.project_kinds(
+            {kind: obj_data[k] for kind, k in KIND_KEYS.items()}, local_view(obj_data, view))
+    obj_data["proj"] = (key, rs)
+    return rs
+
+def element_count(obj_data, kind):
+    '''物体中该类元素的个数'''
+    if kind == SEGMENTS:
+        return len(obj_data["edges"])
+    return len(obj_data[KIND_KEYS[kind]])
+
+def get_idx_in_screen(obj_data, kind, view, margin=0):
+    '''获取物体在视图内的 顶点/边/面 索引'''
+    if kind == SEGMENTS:
+        return clip_edges(obj_data, view, margin)[0]
+    s2d, _, mask = project_obj_data(obj_data, view)[kind]
+    if margin:
+        x = s2d[:, 0]
+        y = s2d[:, 1]
+        mask = mask & (x >= margin) & (x <= view.width - margin) \
+            & (y >= margin) & (y <= view.height - margin)
+    return np.flatnonzero(mask)
+
+def clip_edges(obj_data, view, margin=0):
+    '''边截到屏幕 (去掉 margin) 内的部分，同一视图下只计算一次'''
+    # return (
+    #   idxs,   屏幕内部分不为空的边下标 (N,)
+    #   params, 屏幕内部分在屏幕上的参数范围 (N, 2)，0 为边的第一个端点，1 为第二个
+    # )
+    # 有端点在相机后面的边不计入，与 edge_ends 相同
+    key = projection.view_key(view)
+    cache = obj_data.get("clip")
+    if cache is None or cache[0] != key:
+        cache = obj_data["clip"] = (key, {})
+    rs = cache[1].get(margin)
+    if rs is not None:
+        return rs
+    s2d, depth, _ = project_obj_data(obj_data, view)["VERTS"]
+    edges = obj_data["edges"]
+    a = s2d[edges[:, 0]]
+    b = s2d[edges[:, 1]]
+    if view.is_persp:
+        ok = (depth[edges[:, 0]] > 0) & (depth[edges[:, 1]] > 0)
+    else:
+        ok = np.ones(len(edges), dtype=bool)
+    # Liang-Barsky: 分轴求 margin <= a + t * (b - a) <= size - margin 的区间，取交集
+    t0 = np.zeros(len(edges))
+    t1 = np.ones(len(edges))
+    for k, size in ((0, view.width), (1, view.height)):
+        d = b[:, k] - a[:, k]
+        lo = margin - a[:, k]
+        hi = size - margin - a[:, k]
+        flat = d == 0
+        ok &= ~flat | ((lo <= 0) & (hi >= 0))
+        inv = 1.0 / np.where(flat, 1.0, d)
+        ta = lo * inv
+        tb = hi * inv
+        t0 = np.where(flat, t0, np.maximum(t0, np.minimum(ta, tb)))
+        t1 = np.where(flat, t1, np.minimum(t1, np.maximum(ta, tb)))
+    ok &= t0 <= t1
+    idxs = np.flatnonzero(ok)
+    rs = cache[1][margin] = (idxs, np.column_stack((t0[idxs], t1[idxs])))
+    return rs
+
+def segment_samples(obj_data, idxs, view):
+    '''边在屏幕内部分的两端与中点，返回 (屏幕座标 (N, 3, 2), 深度 (N, 3))'''
+    # idxs 须在 clip_edges 的结果中；视图内全部的边只计算一次，与 clip_edges 一起缓存
+    clip = obj_data.get("clip")
+    if clip is None or clip[0] != projection.view_key(view) or "samples" not in clip[1]:
+        clip_idx, params = clip_edges(obj_data, view)
+        pos = np.full(len(obj_data["edges"]), -1, dtype=np.int64)
+        pos[clip_idx] = np.arange(len(clip_idx))
+        u = np.column_stack((params[:, 0], params.mean(axis=1), params[:, 1]))
+        s2d, depth, _ = project_obj_data(obj_data, view)["VERTS"]
+        ends = obj_data["edges"][clip_idx]
+        a = s2d[ends[:, 0]][:, None, :]
+        b = s2d[ends[:, 1]][:, None, :]
+        da = depth[ends[:, 0]][:, None]
+        db = depth[ends[:, 1]][:, None]
+        if view.is_persp:
+            # 1/深度 在屏幕空间线性
+            d = 1.0 / ((1.0 - u) / da + u / db)
+        else:
+            d = da + (db - da) * u
+        obj_data["clip"][1]["samples"] = (pos, a + (b - a) * u[:, :, None], d)
+    pos, s2d, depth = obj_data["clip"][1]["samples"]
+    i = pos[idxs]
+    return s2d[i], depth[i]
+
+def screen_rect(s2d, depth, view):
+    '''相机前面的顶点在屏幕上的包围矩形 (x0, y0, x1, y1)，截到屏幕内'''
+    # 能被光栅化的三角面都在此矩形内，深度缓冲只需覆盖这部分
+    if view.is_persp:
+        s2d = s2d[depth > 0]
+    if len(s2d) == 0:
+        return (0.0, 0.0, 0.0, 0.0)
+    x = np.clip(s2d[:, 0], 0, view.width)
+    y = np.clip(s2d[:, 1], 0, view.height)
+    return (float(x.min()), float(y.min()), float(x.max()), float(y.max()))
+
+def get_depth_buffer(obj_data, view):
+    '''物体自身三角面的深度缓冲，同一视图下只光栅化一次'''
+    # 缓冲只覆盖物体在屏幕上的包围矩形，提取完成后由 release_depth 释放
+    key = projection.view_key(view)
+    cache = obj_data.get("depth")
+    if cache is not None and cache[0] == key:
+        return cache[1]
+    s2d, depth, _ = project_obj_data(obj_data, view)["VERTS"]
+    db = DepthBuffer(view.width, view.height, is_persp=view.is_persp,
+            rect=screen_rect(s2d, depth, view))
+    db.rasterize(s2d, depth, obj_data["tris"])
+    obj_data["depth"] = (key, db)
+    return db
+
+def release_depth(obj_data):
+    '''释放物体的深度缓冲'''
+    # 遮挡结果保留在 vis 中，同一视图下不会再用到深度缓冲
+    obj_data.pop("depth", None)
+    obj_data.pop("raster", None)
+
+def get_visible_idx_from_depth(obj_data, kind, idxs, view, db=None):
+    '''返回未被遮挡的 顶点/边/面 索引'''
+    '''忽略物体间的遮挡，仅计算自身'''
+    # db: 已光栅化的深度缓冲，默认使用整个物体的深度缓冲
+    if db is None:
+        db = get_depth_buffer(obj_data, view)
+    # size 为局部空间的尺寸，深度在世界空间
+    bias = obj_data["size"] * obj_data.get("scale", 1.0) * 0.001
+    if kind == SEGMENTS:
+        s2d, depth = segment_samples(obj_data, idxs, view)
+        visible = db.test(s2d.reshape(-1, 2), depth.ravel(), bias=bias)
+        return idxs[visible.reshape(-1, 3).any(axis=1)]
+    s2d, depth, _ = project_obj_data(obj_data, view)[kind]
+    visible = db.test(s2d[idxs], depth[idxs], bias=bias)
+    return idxs[visible]
+
+def get_visible_idx_from_ray(obj_data, kind, idxs, view):
+    from mathutils import Vector
+    from . import just_utils
+    # 屏幕中心的视线方向
+    screen_normal = Vector(projection.view_direction(view))
+    if kind == SEGMENTS:
+        # 参照只判断边中点
+        kind = "EDGES"
+    rs = just_utils.get_visible_idx_from_direction(obj_data, kind, screen_normal, idxs)
+    return np.array(rs, dtype=np.int64)
+
+def get_visible_idx(obj_data, kind, idxs, view, mode=None, db=None):
+    if mode is None:
+        mode = VISIBILITY_MODE
+    if mode == "RAY":
+        return get_visible_idx_from_ray(obj_data, kind, idxs, view)
+    return get_visible_idx_from_depth(obj_data, kind, idxs, view, db)
+
+def visibility_agreement(obj_data, kind, view, margin=0):
+    '''深度缓冲与 ray_cast 结果一致的比例'''
+    idxs = get_idx_in_screen(obj_data, kind, view, margin)
+    if len(idxs) == 0:
+        return 1.0
+    depth = np.zeros(len(obj_data[KIND_KEYS[kind]]), dtype=bool)
+    ray = depth.copy()
+    depth[get_visible_idx(obj_data, kind, idxs, view, "DEPTH")] = True
+    ray[get_visible_idx(obj_data, kind, idxs, view, "RAY")] = True
+    return float((depth[idxs] == ray[idxs]).mean())
+
+def get_kind_data(obj_data, kind, view, ignore_back=True, margin=0, vis=None, prof=None):
+    '''获取物体在可视区域内的 顶点/边中点/面中心 的候选数据'''
+    # return {
+    #    "s2d":    屏幕座标 (N, 2)
+    #    "depth":  视图深度 (N,)
+    #    "w3d":    世界座标 (N, 3)
+    #    "idx":    元素下标 (N,)
+    # }
+    # 没有候选点时返回 None
+    # vis:  保留遮挡结果的字典 {"tested": ..., "visible": ...}，视图改变后可复用
+    # prof: SnapProfiler，记录各阶段耗时
+    if prof is None:
+        prof = NULL_PROFILER
+    with prof.stage("projection"):
+        s2d, depth, _ = project_obj_data(obj_data, view)[kind]
+    with prof.stage("cull"):
+        idxs = get_idx_in_screen(obj_data, kind, view, margin)
+    if len(idxs) == 0:
+        return None
+    if ignore_back:
+        # 去除被遮挡的 点/边/面
+        with prof.stage("occlusion"):
+            idxs = __get_visible_idx(obj_data, kind, idxs, view, vis)
+        if len(idxs) == 0:
+            return None
+    prof.count("candidates", len(idxs))
+    return __kind_result(obj_data, kind, view, idxs)
+
+def get_segment_data(obj_data, view, ignore_back=True, margin=0, vis=None, prof=None):
+    '''获取物体在可视区域内的边线段，用于吸附到边上的点'''
+    # return {
+    #    "idx":    边下标 (N,)
+    #    "ends2d": 边两端的屏幕座标 (N, 2, 2)，见 edge_ends
+    # }
+    # 没有线段时返回 None，参数同 get_kind_data
+    if prof is None:
+        prof = NULL_PROFILER
+    with prof.stage("cull"):
+        idxs = get_idx_in_screen(obj_data, SEGMENTS, view, margin)
+    if len(idxs) == 0:
+        return None
+    if ignore_back:
+        with prof.stage("occlusion"):
+            idxs = __get_visible_idx(obj_data, SEGMENTS, idxs, view, vis)
+        if len(idxs) == 0:
+            return None
+    return __segment_result(obj_data, view, idxs)
+
+def retest_idx(obj_data, kind, idxs, view, ignore_back=True, margin=0, vis=None):
+    '''重新判断元素是否在视图内、是否被遮挡，返回其中可见的下标'''
+    # 用于编辑模式下移动过的元素，vis 中这些元素之前的遮挡结果作废
+    # kind 可以是 SEGMENTS，其余参数同 get_kind_data
+    idxs = np.asarray(idxs, dtype=np.int64)
+    if vis is not None and vis["tested"] is not None \
+            and len(vis["tested"]) == element_count(obj_data, kind):
+        vis["tested"][idxs] = False
+        vis["visible"][idxs] = False
+    idxs = idxs[np.isin(idxs, get_idx_in_screen(obj_data, kind, view, margin))]
+    if ignore_back and len(idxs):
+        idxs = __get_visible_idx(obj_data, kind, idxs, view, vis)
+    return idxs
+
+def __segment_result(obj_data, view, idxs):
+    return {
+        "idx": idxs,
+        "ends2d": edge_ends(obj_data, idxs, view),
+    }
+
+def __kind_result(obj_data, kind, view, idxs):
+    s2d, depth, _ = project_obj_data(obj_data, view)[kind]
+    return {
+        "s2d": s2d[idxs],
+        "depth": depth[idxs],
+        "w3d": world_points(obj_data, obj_data[KIND_KEYS[kind]][idxs]),
+        "idx": idxs,
+    }
+
+def edge_ends(obj_data, idxs, view):
+    '''边两端的屏幕座标 (N, 2, 2)，有端点在相机后面的边为 nan'''
+    ends = obj_data["edges"][idxs]
+    cache = obj_data.get("proj")
+    if cache is not None and cache[0] == projection.view_key(view):
+        s2d, depth, _ = cache[1]["VERTS"]
+        s2d = s2d[ends]
+        depth = depth[ends]
+    else:
+        s2d, depth, _ = projection.project_points(
+                obj_data["co"][ends.ravel()], local_view(obj_data, view))
+        s2d = s2d.reshape(-1, 2, 2)
+        depth = depth.reshape(-1, 2)
+    if view.is_persp:
+        behind = (depth[:, 0] <= 0) | (depth[:, 1] <= 0)
+        if behind.any():
+            s2d = s2d.copy()
+            s2d[behind] = np.nan
+    return s2d
+
+def __get_visible_idx(obj_data, kind, idxs, view, vis, db=None):
+    # db: 可以是函数，需要计算遮挡时才调用，返回深度缓冲
+    if vis is None:
+        if callable(db):
+            db = db()
+        return get_visible_idx(obj_data, kind, idxs, view, db=db)
+    # vis 中保留了之前的遮挡结果，只计算未计算过的元素
+    size = element_count(obj_data, kind)
+    if vis["tested"] is None or len(vis["tested"]) != size:
+        vis["tested"] = np.zeros(size, dtype=bool)
+        vis["visible"] = np.zeros(size, dtype=bool)
+    untested = idxs[~vis["tested"][idxs]]
+    if len(untested):
+        if callable(db):
+            db = db()
+        vis["visible"][get_visible_idx(obj_data, kind, untested, view, db=db)] = True
+        vis["tested"][untested] = True
+    return idxs[vis["visible"][idxs]]
+
+def tile_grid(view):
+    '''屏幕格子的列数与行数'''
+    return (
+        max(1, int(np.ceil(view.width / TILE_SIZE))),
+        max(1, int(np.ceil(view.height / TILE_SIZE))),
+    )
+
+def tile_ids(s2d, view):
+    '''屏幕座标所在的格子编号 ty * cols + tx，屏幕外的点截到边缘的格子'''
+    cols, rows = tile_grid(view)
+    tx = np.clip(np.floor(s2d[:, 0] / TILE_SIZE), 0, cols - 1).astype(np.int64)
+    ty = np.clip(np.floor(s2d[:, 1] / TILE_SIZE), 0, rows - 1).astype(np.int64)
+    return ty * cols + tx
+
+def tiles_near(mouse, radius, view):
+    '''与以鼠标为圆心、radius 为半径的圆相交的格子编号'''
+    cols, rows = tile_grid(view)
+    x, y = mouse
+    tx = np.arange(max(0, int((x - radius) // TILE_SIZE)),
+            min(cols - 1, int((x + radius) // TILE_SIZE)) + 1)
+    ty = np.arange(max(0, int((y - radius) // TILE_SIZE)),
+            min(rows - 1, int((y + radius) // TILE_SIZE)) + 1)
+    tx, ty = np.meshgrid(tx, ty)
+    # 格子内离鼠标最近的点
+    dx = np.clip(x, tx * TILE_SIZE, (tx + 1) * TILE_SIZE) - x
+    dy = np.clip(y, ty * TILE_SIZE, (ty + 1) * TILE_SIZE) - y
+    near = dx * dx + dy * dy <= radius * radius
+    return (ty * cols + tx)[near]
+
+def iter_obj_data(obj_data, view, mouse, ignore_back=True, margin=0,
+        vis=None, prof=None, tiles=None, lod=0, kinds=projection.KINDS):
+    '''一次提取各类元素的候选数据，分块进行，离鼠标近的先返回'''
+    # 每次 yield {kind: 数据}，数据同 get_kind_data，该类元素在块内没有候选点时为 None
+    # 块内全部没有候选点时 yield None
+    # vis:   {kind: 保留遮挡结果的字典}，见 get_kind_data
+    # tiles: 只提取这些屏幕格子内的元素，None 为整个视图
+    # lod:   细节级别，只提取该级别保留的元素，见 lod.py
+    # 各类元素共用一次投影 (project_obj_data) 与同一个深度缓冲，
+    # 提取后切换吸附类型不需要重新计算
+    # kinds 有 EDGES 时同时提取 SEGMENTS (get_segment_data)，按线段截取后的中点分格
+    # 元素总数少于 PROGRESSIVE_MIN 的只有一块
+    # 屏幕按 TILE_SIZE 分格，以鼠标所在的格子为中心，按圈 (切比雪夫距离) 由内向外，
+    # 每圈再切分为总数约 CHUNK_SIZE 的块
+    # 指定 tiles 时遮挡只光栅化覆盖到这些格子的三角面，否则一次光栅化整个物体
+    if prof is None:
+        prof = NULL_PROFILER
+    if vis is None:
+        vis = {}
+    total = sum(len(obj_data[KIND_KEYS[kind]]) for kind in kinds)
+    if tiles is None and not lod and total < PROGRESSIVE_MIN:
+        rs = {kind: get_kind_data(obj_data, kind, view, ignore_back, margin, vis.get(kind), prof)
+                for kind in kinds}
+        if "EDGES" in kinds:
+            rs[SEGMENTS] = get_segment_data(obj_data, view, ignore_back, margin, vis.get(SEGMENTS), prof)
+        yield rs
+        release_depth(obj_data)
+        return
+    if "EDGES" in kinds:
+        kinds = (*kinds, SEGMENTS)
+
+    with prof.stage("projection"):
+        proj = project_obj_data(obj_data, view)
+    cols, rows = tile_grid(view)
+    mx = int(mouse[0] // TILE_SIZE)
+    my = int(mouse[1] // TILE_SIZE)
+    # 各类元素按圈排序后的 (下标, 圈, 格子)
+    parts = {}
+    # 各类元素在视图内的全部下标，用于判断是否已全部提取
+    visible = {}
+    with prof.stage("cull"):
+        for kind in kinds:
+            idxs = get_idx_in_screen(obj_data, kind, view, margin)
+            if kind == SEGMENTS:
+                visible[kind] = idxs
+                tile = tile_ids(segment_samples(obj_data, idxs, view)[0][:, 1], view)
+            else:
+                level = snap_lod.get_level(obj_data, KIND_KEYS[kind], lod)
+                if level is not None:
+                    idxs = idxs[level[1][idxs]]
+                visible[kind] = idxs
+                tile = tile_ids(proj[kind][0][idxs], view)
+            if tiles is not None:
+                keep = np.isin(tile, tiles)
+                idxs = idxs[keep]
+                tile = tile[keep]
+            parts[kind] = (idxs, tile)
+    total = sum(len(idxs) for idxs, _ in parts.values())
+    if total == 0:
+        yield None
+        return
+
+    # 各格子所在的圈，按格子查表，元素较少时不分圈；圈数很少，int16 的 stable 排序为基数排序
+    tile_ring = np.zeros(cols * rows, dtype=np.int16)
+    if total >= PROGRESSIVE_MIN:
+        tx, ty = np.meshgrid(np.arange(cols) - mx, np.arange(rows) - my)
+        tile_ring = np.maximum(np.abs(tx), np.abs(ty)).astype(np.int16).ravel()
+    for kind, (idxs, tile) in parts.items():
+        ring = tile_ring[tile]
+        order = np.argsort(ring, kind="stable")
+        parts[kind] = (idxs[order], ring[order], tile[order])
+
+    # 只提取部分格子时按格子逐步光栅化；提取整个视图时全部三角面都要光栅化，
+    # 一次完成比逐块光栅化快
+    raster = get_tile_raster(obj_data, view) if ignore_back and tiles is not None else None
+    rings = np.unique(np.concatenate([ring for _, ring, _ in parts.values()]))
+    for r in rings:
+        spans = {}
+        for kind, (_, ring, _) in parts.items():
+            spans[kind] = np.searchsorted(ring, (r, r + 1))
+        count = sum(int(end - start) for start, end in spans.values())
+        n = max(1, -(-count // CHUNK_SIZE))
+        for i in range(n):
+            # 各类元素按比例切分，每块总数约 CHUNK_SIZE
+            chunks = {}
+            for kind, (start, end) in spans.items():
+                lo = start + (end - start) * i // n
+                hi = start + (end - start) * (i + 1) // n
+                chunks[kind] = (lo, hi)
+            yield __extract_chunk(obj_data, view, parts, chunks, ignore_back, vis, raster, prof)
+    if __extracted_all(visible, tiles, vis):
+        release_depth(obj_data)
+
+def __extracted_all(visible, tiles, vis):
+    '''视图内的元素是否都已判断过遮挡'''
+    if tiles is None:
+        return True
+    for kind, idxs in visible.items():
+        kind_vis = vis.get(kind)
+        if kind_vis is None or kind_vis["tested"] is None:
+            return False
+        if not kind_vis["tested"][idxs].all():
+            return False
+    return True
+
+def __extract_chunk(obj_data, view, parts, chunks, ignore_back, vis, raster, prof):
+    db = []
+
+    def cover():
+        # 各类元素共用一次光栅化
+        if db:
+            return db[0]
+        if raster is None:
+            db.append(get_depth_buffer(obj_data, view))
+            return db[0]
+        cols, rows = tile_grid(view)
+        tiles = np.zeros(cols * rows, dtype=bool)
+        for kind, (lo, hi) in chunks.items():
+            tiles[parts[kind][2][lo:hi]] = True
+        if SEGMENTS in chunks:
+            # 线段的两端与中点可能在不同的格子
+            lo, hi = chunks[SEGMENTS]
+            s2d = segment_samples(obj_data, parts[SEGMENTS][0][lo:hi], view)[0]
+            tiles[tile_ids(s2d.reshape(-1, 2), view)] = True
+        db.append(raster.cover(np.flatnonzero(tiles)))
+        return db[0]
+
+    rs = {}
+    for kind, (lo, hi) in chunks.items():
+        chunk = parts[kind][0][lo:hi]
+        if ignore_back and len(chunk):
+            with prof.stage("occlusion"):
+                chunk = __get_visible_idx(obj_data, kind, chunk, view, vis.get(kind), cover)
+        if len(chunk) == 0:
+            rs[kind] = None
+            continue
+        if kind == SEGMENTS:
+            rs[kind] = __segment_result(obj_data, view, chunk)
+            continue
+        prof.count("candidates", len(chunk))
+        rs[kind] = __kind_result(obj_data, kind, view, chunk)
+    return rs
+
+def get_tile_raster(obj_data, view):
+    '''按格子逐步光栅化的深度缓冲，同一视图下共用'''
+    key = projection.view_key(view)
+    cache = obj_data.get("raster")
+    if cache is not None and cache[0] == key:
+        return cache[1]
+    raster = _TileRaster(obj_data, view)
+    obj_data["raster"] = (key, raster)
+    return raster
+
+
+class _TileRaster:
+    '''按屏幕格子逐步光栅化物体的深度缓冲'''
+    # 格子内的点只会被包围盒与该格子相交的三角面遮挡，
+    # 所以只光栅化覆盖到所需格子且尚未光栅化的三角面
+    def __init__(self, obj_data, view):
+        self.obj_data = obj_data
+        self.view = view
+        self.key = projection.view_key(view)
+        self.lock = threading.Lock()
+        cache = obj_data.get("depth")
+        # 已有完整的深度缓冲
+        self.db = cache[1] if cache is not None and cache[0] == self.key else None
+        self.done = self.db is not None
+        self.covered = None
+
+    def cover(self, tiles):
+        '''光栅化覆盖到 tiles 的三角面，返回深度缓冲'''
+        with self.lock:
+            if self.done:
+                return self.db
+            if self.covered is None:
+                self.__prepare()
+            tiles = np.asarray(tiles)
+            tiles = tiles[~self.covered.flat[tiles]]
+            if len(tiles) == 0:
+                return self.db
+            # 取这些格子的外接矩形，矩形内的格子都会被完整光栅化
+            cols = self.covered.shape[1]
+            tx = tiles % cols
+            ty = tiles // cols
+            tx0, tx1, ty0, ty1 = tx.min(), tx.max(), ty.min(), ty.max()
+            lo_x, hi_x, lo_y, hi_y = self.bounds
+            items = np.flatnonzero(~self.drawn & (hi_x >= tx0) & (lo_x <= tx1)
+                    & (hi_y >= ty0) & (lo_y <= ty1))
+            self.drawn[items] = True
+            self.covered[ty0:ty1 + 1, tx0:tx1 + 1] = True
+            self.db.rasterize(self.s2d, self.depth, self.tris[items])
+            if self.covered.all():
+                # 全部格子都已光栅化，作为整个物体的深度缓冲
+                self.obj_data["depth"] = (self.key, self.db)
+                self.done = True
+            return self.db
+
+    def __prepare(self):
+        view = self.view
+        self.s2d, self.depth, _ = project_obj_data(self.obj_data, view)["VERTS"]
+        rect = screen_rect(self.s2d, self.depth, view)
+        self.db = DepthBuffer(view.width, view.height, is_persp=view.is_persp, rect=rect)
+        cols, rows = tile_grid(view)
+        # covered.flat[tile] 与格子编号对应，包围矩形外的格子没有三角面，视为已光栅化
+        self.covered = np.ones((rows, cols), dtype=bool)
+        tx0, ty0 = int(rect[0] // TILE_SIZE), int(rect[1] // TILE_SIZE)
+        tx1, ty1 = int(rect[2] // TILE_SIZE), int(rect[3] // TILE_SIZE)
+        self.covered[ty0:ty1 + 1, tx0:tx1 + 1] = False
+        tris = self.obj_data["tris"]
+        # 相机后面的顶点投影无意义，这样的三角面不会被光栅化
+        front = self.depth > 0 if view.is_persp else np.ones(len(self.depth), dtype=bool)
+        tris = tris[front[tris[:, 0]] & front[tris[:, 1]] & front[tris[:, 2]]]
+        self.tris = tris
+        self.drawn = np.zeros(len(tris), dtype=bool)
+
+        # 三角面包围盒覆盖的格子范围，按分量计算，避免在小维度上 reduce
+        t = np.floor(self.s2d / TILE_SIZE).astype(np.int32)
+        bounds = []
+        for k in (0, 1):
+            a, b, c = t[tris[:, 0], k], t[tris[:, 1], k], t[tris[:, 2], k]
+            bounds.append(np.minimum(np.minimum(a, b), c))
+            bounds.append(np.maximum(np.maximum(a, b), c))
+        self.bounds = bounds
+
+
+def get_vert_data(obj_data, view, ignore_back=True, margin=0, vis=None, prof=None):
+    return get_kind_data(obj_data, "VERTS", view, ignore_back, margin, vis, prof)
+
+def get_edge_data(obj_data, view, ignore_back=True, margin=0, vis=None, prof=None):
+    return get_kind_data(obj_data, "EDGES", view, ignore_back, margin, vis, prof)
+
+def get_face_data(obj_data, view, ignore_back=True, margin=0, vis=None, prof=None):
+    return get_kind_data(obj_data, "FACES", view, ignore_back, margin, vis, prof)
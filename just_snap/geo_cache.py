@@ -0,0 +1,111 @@
+from collections import OrderedDict
+import numpy as np
+from . import projection
+
+# 跨操作保留的网格几何缓存
+#   键:   网格数据，没有修改器的物体 (例如关联复制) 共用同一网格，见 just_utils.mesh_key
+#   值:   局部空间的数组与 BVHTree，每个网格只有一份
+#   校验: 应用修改器后的网格数据的指纹，不一致视为未命中
+#   超出内存预算时按最近最少使用 (LRU) 淘汰
+# 物体与集合实例等只是网格数据的实例 (make_instance)，只另存变换矩阵，
+# 内存与建立的耗时只与不同网格的数量有关，与实例数无关
+
+# 实例共用的网格数据
+MESH_KEYS = ("co", "edges", "mids", "centers", "loop_start", "loop_total", "loop_verts",
+        "tris", "tri_poly", "size", "bvh")
+
+# 默认内存预算 256MB
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+# BVHTree 无法直接取得内存占用，按三角面个数估算
+BVH_TRI_BYTES = 64
+
+
+def estimate_nbytes(obj_data):
+    '''估算缓存项的内存占用'''
+    size = 0
+    for value in obj_data.values():
+        if isinstance(value, np.ndarray):
+            size += value.nbytes
+    if obj_data.get("bvh") is not None:
+        size += len(obj_data.get("tris", ())) * BVH_TRI_BYTES
+    return size
+
+def make_instance(mesh_data, name, matrix):
+    '''网格数据的一个实例，数组与 BVHTree 都引用 mesh_data，不复制'''
+    # matrix: 实例的 matrix_world (4, 4)，只在投影与取得候选点的世界座标时使用
+    matrix = np.array(matrix, dtype=np.float64).reshape(4, 4)
+    obj_data = {key: mesh_data[key] for key in MESH_KEYS if key in mesh_data}
+    obj_data.update({
+        "name": name,
+        "mesh": mesh_data,
+        "matrix": matrix,
+        "scale": projection.matrix_scale(matrix),
+    })
+    return obj_data
+
+
+class GeoCache:
+    def __init__(self, budget=DEFAULT_BUDGET):
+        self.budget = budget
+        # key: (fingerprint, mesh_data, nbytes)
+        self.__items = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __contains__(self, key):
+        return key in self.__items
+
+    def get(self, key, fingerprint):
+        item = self.__items.get(key)
+        if item is None or item[0] != fingerprint:
+            self.misses += 1
+            return None
+        self.__items.move_to_end(key)
+        self.hits += 1
+        return item[1]
+
+    def put(self, key, fingerprint, mesh_data):
+        self.discard(key)
+        nbytes = estimate_nbytes(mesh_data)
+        self.__items[key] = (fingerprint, mesh_data, nbytes)
+        self.nbytes += nbytes
+        self.__evict()
+
+    def discard(self, key):
+        item = self.__items.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[2]
+
+    def set_budget(self, budget):
+        self.budget = budget
+        self.__evict()
+
+    def clear(self):
+        self.__items.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {
+            "items": len(self.__items),
+            "nbytes": self.nbytes,
+            "budget": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __evict(self):
+        # 至少保留最新的一项，即使它本身超出预算
+        while self.nbytes > self.budget and len(self.__items) > 1:
+            _, item = self.__items.popitem(last=False)
+            self.nbytes -= item[2]
+            self.evictions += 1
+
+
+cache = GeoCache()
@@ -1,5 +1,9 @@
 import bpy
+import bmesh
+import zlib
+import numpy as np
 from bpy_extras import view3d_utils
+from mathutils import Vector, bvhtree
 from math import floor
 
 
@@ -31,271 +35,288 @@ def get_screen_normal(region, rv3d, coord):
     return view3d_utils.region_2d_to_vector_3d(
             region, rv3d, coord)
 
-def matrix_screen_to_matrix_world(rv3d, v3d_0_0):
-    rvm = rv3d.view_matrix.copy()
-    v3d_0_0 = rvm @ v3d_0_0
-    return (
-        rvm.Translation(-v3d_0_0)
-        @ rvm
-    )
+def world_bound_boxes(objs):
+    '''物体包围盒 8 个角的世界座标 (N, 8, 3)'''
+    return __transform_boxes([obj.bound_box for obj in objs], [obj.matrix_world for obj in objs])
 
-def is_in_view(bound_box, matrix, v3d_w_h):
-    '''物体边界是否在视图内'''
-    # 网格不一定在视图内
-    axis_x = []
-    axis_y = []
-    for loc in bound_box:
-        p = matrix @ loc
-        axis_x.append(p[0])
-        axis_y.append(p[1])
-    x0 = min(axis_x)   
-    y0 = min(axis_y)
-    x1 = max(axis_x)   
-    y1 = max(axis_y)
-    w = v3d_w_h[0]
-    h = v3d_w_h[1]
-    isInView = True
-    if x0 > w or y0 > h or x1 < 0 or y1 < 0:
-        isInView = False
-    return isInView, (x0, y0, x1, y1)
+def __transform_boxes(bound_boxes, matrices):
+    bound = np.array(bound_boxes, dtype=np.float64).reshape(-1, 8, 3)
+    M = np.array(matrices, dtype=np.float64).reshape(-1, 4, 4)
+    return np.einsum("nij,nkj->nki", M[:, :3, :3], bound) + M[:, None, :3, 3]
 
-def get_vert_idx_in_screen(bm, v3d_0_0, v3d_w_h, rv3d):
-    M = matrix_screen_to_matrix_world(rv3d, v3d_0_0)
-    idxs = []
-    v3d_w_h = M @ v3d_w_h
-    w = v3d_w_h[0]
-    h = v3d_w_h[1]
-    for vert in bm.verts:
-        p = M @ vert.co
-        isInView = True
-        if p[0] < 0 or p[0] > w or p[1] < 0 or p[1] > h:
-            isInView = False
-        if isInView:
-            idxs.append(vert.index)
-    return idxs
+def sync_scene_index(index, scene, depsgraph=None):
+    '''把场景的改变同步到 scene_index.SceneIndex，只读取改变了的物体'''
+    # depsgraph: 用于读取集合实例等物体实例，None 时不读取
+    rescan, dirty = index.take_dirty()
+    objects = scene.objects
+    instancers = set()
+    if rescan:
+        # 物体可能增删，隐藏、集合的显示等也不一定有物体的更新，需要检查全部物体的可见性
+        # 只读取名称与可见性，包围盒只读取新增的物体
+        names = [obj.name for obj in objects]
+        dirty.update(index.retain(names))
+        visible = np.fromiter((obj.visible_get() for obj in objects), dtype=bool, count=len(names))
+        index.set_visible(names, visible)
+        # 被实例化的集合的内容可能改变
+        instancers.update(index.instancers())
+    # 实例随实例化物体读取
+    dirty = [name for name in dirty if name not in index.instances]
+    if not dirty and not instancers:
+        return
+    objs = []
+    missing = []
+    for name in dirty:
+        obj = objects.get(name)
+        if obj is None:
+            missing.append(name)
+        else:
+            objs.append(obj)
+    index.remove(missing)
+    if objs:
+        boxes = world_bound_boxes(objs)
+        index.update(
+            [obj.name for obj in objs],
+            np.array([obj.visible_get() for obj in objs], dtype=bool),
+            np.array([obj.type == 'MESH' for obj in objs], dtype=bool),
+            boxes.min(axis=1),
+            boxes.max(axis=1),
+        )
+    for obj in objs:
+        if obj.is_instancer:
+            instancers.add(obj.name)
+        else:
+            index.drop_instances(obj.name)
+    instancers = [name for name in instancers if name in objects]
+    if instancers and depsgraph is not None:
+        for name, (keys, obj_names, matrices, bound) in read_instances(depsgraph, instancers).items():
+            boxes = __transform_boxes(bound, matrices)
+            index.set_instances(name, keys, obj_names, matrices, objects[name].visible_get(),
+                    boxes.min(axis=1), boxes.max(axis=1))
 
-def get_edge_idx_in_screen(bm, v3d_0_0, v3d_w_h, rv3d):
-    vertices = bm.verts
-    M = matrix_screen_to_matrix_world(rv3d, v3d_0_0)
-    idxs = []
-    v3d_w_h = M @ v3d_w_h
-    w = v3d_w_h[0]
-    h = v3d_w_h[1]
-    for edge in bm.edges:
-        v0, v1 = edge.verts
-        center = (v0.co + v1.co) / 2
-        p = M @ center
-        isInView = True
-        if p[0] < 0 or p[0] > w or p[1] < 0 or p[1] > h:
-            isInView = False
-        if isInView:
-            idxs.append(edge.index)
-    return idxs
+def read_instances(depsgraph, instancers):
+    '''读取实例化物体 (集合实例、粒子等) 的网格实例'''
+    # return {实例化物体名称: (
+    #   [(实例化物体名称, persistent_id), ...]  实例名称
+    #   [物体名称, ...]                         被实例化的物体
+    #   [matrix_world, ...]                     (4, 4)
+    #   [bound_box, ...]                        局部空间的包围盒 (8, 3)
+    # )}
+    # object_instances 中的对象只在迭代时有效，需要立即复制
+    rs = {name: ([], [], [], []) for name in instancers}
+    for inst in depsgraph.object_instances:
+        if not inst.is_instance or inst.object.type != 'MESH':
+            continue
+        parent = inst.parent.original.name
+        item = rs.get(parent)
+        if item is None:
+            continue
+        item[0].append((parent, tuple(inst.persistent_id)))
+        item[1].append(inst.object.original.name)
+        item[2].append(np.array(inst.matrix_world, dtype=np.float64))
+        item[3].append(np.array(inst.object.bound_box, dtype=np.float64))
+    return rs
 
-def get_face_idx_in_screen(bm, v3d_0_0, v3d_w_h, rv3d):
-    '''获取物体在视图内的面索引'''
-    # 将窗口matrix转为世界matrix，移动 v3d_0_0 到原点
-    # 顶点Y座标小于0或大于屏幕宽度在世界中的长度(v3d_w_h)则在屏幕外侧
+def local_view_visible(names, scene, space_data):
+    '''局部视图中物体的可见性，与视图有关，不保存在索引中'''
+    # 实例与实例化物体相同，已删除的物体 (None) 不可见
+    objects = scene.objects
 
-    M = matrix_screen_to_matrix_world(rv3d, v3d_0_0)
-    idxs = []
-    v3d_w_h = M @ v3d_w_h
-    w = v3d_w_h[0]
-    h = v3d_w_h[1]
-    
-    for face in bm.faces:
-        p = M @ face.calc_center_median()
-        isInView = True
-        if p[0] < 0 or p[0] > w or p[1] < 0 or p[1] > h:
-            isInView = False
-        if isInView:
-            idxs.append(face.index)
-    return idxs
+    def visible(name):
+        if isinstance(name, tuple):
+            name = name[0]
+        obj = objects.get(name) if name is not None else None
+        return obj is not None and obj.visible_get(viewport=space_data)
 
-def __get_visible_data(obj_data, direction):
-    bvh = obj_data["bvh"]
-    size = obj_data["size"]
-    distance = size * 2
-    matrix_l = obj_data["matrix_l"]
-    direction = direction.normalized() @ matrix_l
-    direction *= -1
-    return bvh, distance, direction, size
+    return np.fromiter((visible(name) for name in names), dtype=bool, count=len(names))
 
-def get_visible_vert_idx_from_direction(obj_data, direction, vertices=None):
-    '''返回物体上从方向向量看去的未被遮挡的顶点索引'''
-    '''忽略物体间的遮挡，仅计算自身的顶点'''
-    # direction, 方向向量，指向物体
-    if vertices is None:
-        vertices = obj_data["bm"].verts
+def mesh_key(obj):
+    '''几何缓存 (geo_cache) 的键'''
+    # 没有修改器时应用修改器后的网格与网格数据相同，关联复制的物体共用同一份
+    # 有修改器时按物体，集合实例等共用被实例化的物体的一份
+    if len(obj.modifiers) == 0:
+        return ("MESH", obj.data.name)
+    return ("OBJECT", obj.name)
 
-    bvh, distance, direction, _ = __get_visible_data(obj_data, direction)
-    offset = direction * 0.001
-    idxs = []
-    for vert in vertices:
-        start_point = vert.co + offset
-        # location, normal, index, distance
-        _, _, index, _ = bvh.ray_cast(start_point, direction, distance)
-        if index is None:
-            idxs.append(vert.index)
-    return idxs
+def mesh_arrays(mesh):
+    '''用 foreach_get 一次取出网格数据 (局部空间)'''
+    # return {
+    #    "co":         顶点  (N, 3)
+    #    "edges":      边的顶点下标 (E, 2)
+    #    "mids":       边中点 (E, 3)
+    #    "centers":    面中心 (F, 3)
+    #    "loop_start": 面的第一个 loop (F,)
+    #    "loop_total": 面的 loop 数 (F,)
+    #    "loop_verts": loop 的顶点下标 (L,)
+    #    "tris":       三角面的顶点下标 (T, 3)
+    #    "tri_poly":   三角面所属的面 (T,)
+    #    "size":       包围盒对角线的长度
+    # }
+    n_verts = len(mesh.vertices)
+    co = np.empty(n_verts * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    co = co.reshape(-1, 3).astype(np.float64)
 
-def get_visible_edge_idx_from_direction(obj_data, direction, edges=None):
-    '''返回物体上从方向向量看去的未被遮挡的边索引'''
-    '''忽略物体间的遮挡，仅计算自身的边'''
-    # direction, 方向向量，指向物体
-    
-    if edges is None:
-        edges = obj_data["bm"].edges
+    edges = np.empty(len(mesh.edges) * 2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edges)
+    edges = edges.reshape(-1, 2)
 
-    bvh, distance, direction, _ = __get_visible_data(obj_data, direction)
-    offset = direction * 0.001
-    idxs = []
-    for edge in edges:
-        v0, v1 = edge.verts
-        start_point = (v0.co +v1.co) / 2 + offset
-        # location, normal, index, distance
-        _, _, index, _ = bvh.ray_cast(start_point, direction, distance)
-        if index is None:
-            idxs.append(edge.index)
-    return idxs
+    n_faces = len(mesh.polygons)
+    loop_start = np.empty(n_faces, dtype=np.int32)
+    loop_total = np.empty(n_faces, dtype=np.int32)
+    mesh.polygons.foreach_get("loop_start", loop_start)
+    mesh.polygons.foreach_get("loop_total", loop_total)
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
 
-def get_visible_face_idx_from_direction(obj_data, direction, polygons=None):
-    '''返回物体上从方向向量看去的未被遮挡的面索引'''
-    '''忽略物体间的遮挡，仅计算自身的面'''
-    # direction, 方向向量，指向物体
-    if polygons is None:
-        polygons = obj_data["bm"].faces
+    mesh.calc_loop_triangles()
+    n_tris = len(mesh.loop_triangles)
+    tris = np.empty(n_tris * 3, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("vertices", tris)
+    tri_poly = np.empty(n_tris, dtype=np.int32)
+    mesh.loop_triangles.foreach_get("polygon_index", tri_poly)
+    return __arrays(co, edges, loop_start, loop_total, loop_verts, tris.reshape(-1, 3), tri_poly)
 
-    bvh, distance, direction, size = __get_visible_data(obj_data, direction)
-    direction *= -1
-    offset = direction * size * 1.5
-    idxs = []
-    for face in polygons:
-        end_point = face.calc_center_median()
-        start_point = end_point - offset
-        # location, normal, index, distance
-        _, _, index, _ = bvh.ray_cast(start_point, direction, distance)
-        if index == face.index:
-            idxs.append(face.index)
-    return idxs
+def __arrays(co, edges, loop_start, loop_total, loop_verts, tris, tri_poly):
+    mids = (co[edges[:, 0]] + co[edges[:, 1]]) / 2
+    if len(loop_start):
+        # 与 calc_center_median 相同: 面顶点的平均值
+        centers = np.add.reduceat(co[loop_verts], loop_start) / loop_total[:, None]
+    else:
+        centers = np.empty((0, 3), dtype=np.float64)
+    size = float(np.linalg.norm(co.max(axis=0) - co.min(axis=0))) if len(co) else 0.0
+    return {
+        "co": co,
+        "edges": edges,
+        "mids": mids,
+        "centers": centers,
+        "loop_start": loop_start,
+        "loop_total": loop_total,
+        "loop_verts": loop_verts,
+        "tris": tris,
+        "tri_poly": tri_poly,
+        "size": size,
+    }
 
-def __get_data_before(obj_data, region, rv3d, 
-        v3d_0_0=None, v3d_w_h=None):
-    
-    obj_name = obj_data["name"]
-    obj = bpy.data.objects[obj_name]
+def edit_mesh_arrays(obj):
+    '''编辑模式的网格数据 (局部空间)，返回值同 mesh_arrays'''
+    # 编辑模式下 obj.data 不是最新的，先用 update_from_editmode 写回 bmesh 的改变，
+    # 再用 foreach_get 读取，不在 python 中逐个遍历 bmesh 的元素
+    # 与编辑模式的吸附一致，使用的是未应用修改器的网格
+    obj.update_from_editmode()
+    return mesh_arrays(obj.data)
 
-    bm = obj_data["bm"]
-    
-    screen_normal = get_screen_normal(region, rv3d, 
-            (region.width // 2, region.height // 2))
-    
-    if v3d_0_0 is None:
-        v3d_0_0 = screen_to_world(region, rv3d, (0,0))
-    if v3d_w_h is None:
-        v3d_w_h = screen_to_world(region, rv3d, (region.width,region.height))
-    
-    d = (obj_data["location"] - v3d_0_0).length * screen_normal
-    v3d_0_0 = d + v3d_0_0
-    v3d_w_h = d + v3d_w_h
-    
-    return bm, v3d_0_0, v3d_w_h, screen_normal
+def edit_mesh_co(obj):
+    '''编辑模式的顶点的局部座标 (N, 3)'''
+    obj.update_from_editmode()
+    mesh = obj.data
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    return co.reshape(-1, 3).astype(np.float64)
 
-def get_vert_data(obj_data, region, rv3d, 
-            v3d_0_0=None, v3d_w_h=None, ignore_back=True):
-    bm, v3d_0_0, v3d_w_h, screen_normal = __get_data_before(
-            obj_data, region, rv3d, v3d_0_0, v3d_w_h)
+def edit_mesh_counts(obj):
+    '''编辑模式的 bmesh 的 顶点/边/面 数，用于判断拓扑是否改变'''
+    bm = bmesh.from_edit_mesh(obj.data)
+    return (len(bm.verts), len(bm.edges), len(bm.faces))
 
-    idxs = get_vert_idx_in_screen(bm, v3d_0_0, v3d_w_h, rv3d)
-    if len(idxs) == 0:
-        return {}
-    if ignore_back:
-        # 去除被遮挡的点
-        idxs = get_visible_vert_idx_from_direction(obj_data, screen_normal, 
-                [bm.verts[i] for i in idxs])
-        if len(idxs) == 0:
-            return {}
-    rs = {}
-    for idx in idxs:
-        center = bm.verts[idx].co
-        v_2d = world_to_screen(region, rv3d, center)
-        rs[v_2d] = (center, obj_data["name"], idx)
-    
-    return rs
+def evaluated_mesh_arrays(obj, depsgraph):
+    '''取得应用修改器后的网格数据 (局部空间)，与视图中显示的一致'''
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.to_mesh()
+    try:
+        return mesh_arrays(mesh)
+    finally:
+        obj_eval.to_mesh_clear()
 
-def get_edge_data(obj_data, region, rv3d, 
-            v3d_0_0=None, v3d_w_h=None, ignore_back=True):
-    bm, v3d_0_0, v3d_w_h, screen_normal = __get_data_before(
-            obj_data, region, rv3d, v3d_0_0, v3d_w_h)
-    
-    idxs = get_edge_idx_in_screen(bm, v3d_0_0, v3d_w_h, rv3d)
-    if len(idxs) == 0:
-        return {}
-    if ignore_back:
-        # 去除被遮挡的边
-        idxs = get_visible_edge_idx_from_direction(obj_data, screen_normal, 
-                [bm.edges[i] for i in idxs])
-        if len(idxs) == 0:
-            return {}
-    rs = {}
-    for idx in idxs:
-        v0, v1 = bm.edges[idx].verts
-        center = (v0.co + v1.co) / 2
-        v_2d = world_to_screen(region, rv3d, center)
-        rs[v_2d] = (center, obj_data["name"], idx)
-    
-    return rs
+def bvh_from_arrays(obj_data):
+    '''由三角面建立 BVHTree (与座标同一空间)，ray_cast 返回的是三角面下标，用 tri_poly 转换为面下标'''
+    return bvhtree.BVHTree.FromPolygons(
+            obj_data["co"].tolist(), obj_data["tris"].tolist(), all_triangles=True)
 
-def get_face_data(obj_data, region, rv3d, 
-            v3d_0_0=None, v3d_w_h=None, ignore_back=True):
-    '''获取物体在可视区域内的面中点的对照数据'''
-    # return {
-    #    屏幕        世界      名称    下标
-    #    (x, y) : ( (x, y, z), "name", 0 )
-    # }
-    bm, v3d_0_0, v3d_w_h, screen_normal = __get_data_before(
-            obj_data, region, rv3d, v3d_0_0, v3d_w_h)
-    
-    # 获取物体在视图内的面索引
-    idxs = get_face_idx_in_screen(bm, v3d_0_0, v3d_w_h, rv3d)
-    if len(idxs) == 0:
-        return {}
+def edit_mesh_bvh(obj):
+    '''由编辑模式的 bmesh 建立 BVHTree (物体局部空间)，ray_cast 返回的是面下标'''
+    # FromBMesh 不需要先把座标转为 list，编辑后重建比 FromPolygons 快得多
+    return bvhtree.BVHTree.FromBMesh(bmesh.from_edit_mesh(obj.data))
 
-    if ignore_back:
-        # 去除被遮挡的面
-        idxs = get_visible_face_idx_from_direction(obj_data, screen_normal, 
-                [bm.faces[i] for i in idxs])
-        if len(idxs) == 0:
-            return {}
-    
-    rs = {}
-    for idx in idxs:
-        face = bm.faces[idx]
-        center = face.calc_center_median()
-        v_2d = world_to_screen(region, rv3d, center)
-        rs[v_2d] = (center, obj_data["name"], idx)
-    
-    return rs
+def ray_cast_obj_data(obj_data, origin, direction):
+    '''在物体的 BVHTree 上求射线的交点，返回 (世界座标, 面下标, 距离)，没有交点时都为 None'''
+    # obj_data["bvh_local"]: 世界到局部空间的矩阵，BVHTree 在局部空间 (实例共用) 时才有
+    # 编辑模式的 BVHTree 由 bmesh 建立，返回的是面下标
+    bvh = obj_data["bvh"]
+    local = obj_data.get("bvh_local")
+    if local is None:
+        # location, normal, index, distance
+        location, _, index, distance = bvh.ray_cast(origin, direction)
+        if location is None:
+            return None, None, None
+        # BVH 中的是三角面
+        return location, int(obj_data["tri_poly"][index]), distance
+    location, _, index, _ = bvh.ray_cast(
+            local @ origin, (local.to_3x3() @ direction).normalized())
+    if location is None:
+        return None, None, None
+    location = obj_data["matrix_w"] @ location
+    if "edit" not in obj_data:
+        index = int(obj_data["tri_poly"][index])
+    return location, index, (location - origin).length
+
+def mesh_fingerprint(obj, depsgraph):
+    '''应用修改器后的网格数据的指纹 (与 matrix_world 无关)，用于判断几何缓存是否有效'''
+    obj_eval = obj.evaluated_get(depsgraph)
+    mesh = obj_eval.data
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    return (
+        obj.data.name,
+        len(mesh.vertices),
+        len(mesh.edges),
+        len(mesh.polygons),
+        zlib.crc32(co),
+    )
+
+def __get_visible_data(obj_data, direction):
+    bvh = obj_data["bvh"]
+    # 在 BVHTree 的局部空间中计算
+    size = obj_data["size"]
+    distance = size * 2
+    local = obj_data.get("bvh_local")
+    if local is not None:
+        direction = local.to_3x3() @ direction
+    direction = direction.normalized()
+    direction *= -1
+    return bvh, distance, direction, size
+
+def get_visible_idx_from_direction(obj_data, kind, direction, idxs=None):
+    '''返回物体上从方向向量看去的未被遮挡的 顶点/边/面 索引'''
+    '''忽略物体间的遮挡，仅计算自身'''
+    # kind:      "VERTS"、"EDGES" 或 "FACES"
+    # direction: 方向向量，指向物体
+    co = obj_data[{"VERTS": "co", "EDGES": "mids", "FACES": "centers"}[kind]]
+    if idxs is None:
+        idxs = range(len(co))
+
+    bvh, distance, direction, size = __get_visible_data(obj_data, direction)
+    rs = []
+    if kind == "FACES":
+        # 从物体外朝面中心发射，最先碰到的是该面才可见
+        # 编辑模式的 BVHTree 返回的已是面下标
+        tri_poly = obj_data["tri_poly"] if "edit" not in obj_data else np.arange(len(co))
+        direction *= -1
+        offset = direction * size * 1.5
+        for i in idxs:
+            start_point = Vector(co[i]) - offset
+            # location, normal, index, distance
+            _, _, index, _ = bvh.ray_cast(start_point, direction, distance)
+            # BVH 中的是三角面
+            if index is not None and tri_poly[index] == i:
+                rs.append(i)
+        return rs
 
-def ignore_high_density_mesh(verts, region, rv3d):
-    '''忽略高密度网格'''
-    # 计算射线投射到的面在屏幕上投影的大小
-    # 尺寸小于屏幕像素 60 * 60，忽略
-    
-    axis_x = []
-    axis_y = []
-    
-    for vert in verts:
-        p = world_to_screen(region, rv3d, vert.co)
-        axis_x.append(p[0])
-        axis_y.append(p[1])
-    
-    x0 = min(axis_x)   
-    y0 = min(axis_y)
-    x1 = max(axis_x)   
-    y1 = max(axis_y)
-    w = x1 - x0
-    h = y1 - y0
-    if w * h > 3600:
-        return False
-    return True
\ No newline at end of file
+    # 从点朝视点发射，没有碰到任何面才可见
+    offset = direction * 0.001
+    for i in idxs:
+        start_point = Vector(co[i]) + offset
+        # location, normal, index, distance
+        _, _, index, _ = bvh.ray_cast(start_point, direction, distance)
+        if index is None:
+            rs.append(i)
+    return rs
@@ -0,0 +1,107 @@
+import threading
+import numpy as np
+
+# 吸附候选点的多级细节 (LOD)
+# 第 0 级为全部元素；第 k 级把第 k-1 级的点按边长 spacing * 2^k 的网格聚类，
+# 每个格子只保留离格子内点的平均值最近的一个，所以各级都是真实的元素
+# 查询时按元素在屏幕上的间距选择级别，网格太密时仍然可以吸附，候选点数量有上限
+# 聚类在网格的局部空间中进行，保存在共用的网格数据中 (obj_data["mesh"])，同一网格的实例只计算一次
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 候选点在屏幕上的最小间距 (像素)
+LOD_PIXELS = 8
+# 最多的级数
+MAX_LEVEL = 12
+
+_lock = threading.Lock()
+
+
+def _geometry(obj_data):
+    '''实例共用的网格数据，不是实例时为 obj_data 本身'''
+    return obj_data.get("mesh", obj_data)
+
+def base_spacing(obj_data):
+    '''第 0 级的点间距 (局部空间): 边长的中位数'''
+    obj_data = _geometry(obj_data)
+    spacing = obj_data.get("spacing")
+    if spacing is None:
+        co = obj_data["co"]
+        edges = obj_data["edges"]
+        if len(edges):
+            # 按分量计算，避免在小维度上 reduce
+            a = co[edges[:, 0]]
+            b = co[edges[:, 1]]
+            d2 = (a[:, 0] - b[:, 0]) ** 2 + (a[:, 1] - b[:, 1]) ** 2 + (a[:, 2] - b[:, 2]) ** 2
+            spacing = float(np.sqrt(np.median(d2)))
+        if not spacing:
+            spacing = max(obj_data["size"], 1e-6) / 100
+        obj_data["spacing"] = spacing
+    return spacing
+
+def choose_level(obj_data, pixels_per_unit):
+    '''按屏幕上的点间距选择级别，使间距不小于 LOD_PIXELS'''
+    # pixels_per_unit 为世界空间的单位长度，按实例的缩放换算
+    spacing_px = base_spacing(obj_data) * obj_data.get("scale", 1.0) * pixels_per_unit
+    if not np.isfinite(spacing_px) or spacing_px >= LOD_PIXELS:
+        return 0
+    if spacing_px <= 0:
+        return MAX_LEVEL
+    return min(int(np.ceil(np.log2(LOD_PIXELS / spacing_px))), MAX_LEVEL)
+
+def get_level(obj_data, co_key, level):
+    '''第 level 级保留的元素，返回 (下标, 是否保留的 bool 数组)，第 0 级返回 None'''
+    # co_key: obj_data 中元素世界座标的键 ("co", "mids", "centers")
+    if level <= 0:
+        return None
+    obj_data = _geometry(obj_data)
+    with _lock:
+        lod = obj_data.get("lod")
+        if lod is None:
+            lod = obj_data["lod"] = {}
+        levels = lod.get(co_key)
+        if levels is None:
+            levels = lod[co_key] = []
+        spacing = base_spacing(obj_data)
+        co = obj_data[co_key]
+        while len(levels) < level:
+            k = len(levels) + 1
+            prev = levels[-1][0] if levels else np.arange(len(co))
+            if len(prev) <= 1:
+                # 已经无法再合并
+                levels.append(levels[-1] if levels else (prev, _mask(prev, len(co))))
+                continue
+            idx = _cluster(co, prev, spacing * (1 << k))
+            levels.append((idx, _mask(idx, len(co))))
+        return levels[level - 1]
+
+def _mask(idx, size):
+    mask = np.zeros(size, dtype=bool)
+    mask[idx] = True
+    return mask
+
+def _cluster(co, idx, cell):
+    '''按网格聚类，每个格子保留离平均值最近的元素'''
+    p = co[idx]
+    x, y, z = p[:, 0], p[:, 1], p[:, 2]
+    kx = np.floor((x - x.min()) / cell).astype(np.int64)
+    ky = np.floor((y - y.min()) / cell).astype(np.int64)
+    kz = np.floor((z - z.min()) / cell).astype(np.int64)
+    ny = int(ky.max()) + 1
+    nz = int(kz.max()) + 1
+    if (float(kx.max()) + 1) * ny * nz < 2.0 ** 62:
+        # 三维格子编号合并为一个整数，比按行 unique 快得多
+        _, inverse, counts = np.unique((kx * ny + ky) * nz + kz,
+                return_inverse=True, return_counts=True)
+    else:
+        _, inverse, counts = np.unique(np.column_stack((kx, ky, kz)), axis=0,
+                return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    dist = np.zeros(len(p))
+    for c in (x, y, z):
+        mean = np.bincount(inverse, weights=c) / counts
+        dist += (c - mean[inverse]) ** 2
+    # 每个格子取距离最小的: 先按距离排序，再按格子稳定排序，取每个格子的第一个
+    order = np.argsort(dist, kind="stable")
+    order = order[np.argsort(inverse[order], kind="stable")]
+    first = np.r_[True, np.diff(inverse[order]) != 0]
+    return np.sort(idx[order[first]])
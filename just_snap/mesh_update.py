@@ -0,0 +1,55 @@
+import numpy as np
+
+# 编辑模式下的增量更新
+# 比较缓存的顶点座标，只重新计算移动过的顶点所影响的边中点与面中心
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 与视图或座标相关的缓存，座标改变后失效
+VIEW_CACHE_KEYS = ("proj", "clip", "depth", "raster", "lod", "spacing")
+
+
+def changed_verts(old, new):
+    '''座标改变的顶点下标'''
+    # 按分量比较，避免在小维度上 reduce
+    return np.flatnonzero((old[:, 0] != new[:, 0]) | (old[:, 1] != new[:, 1])
+            | (old[:, 2] != new[:, 2]))
+
+def update_co(obj_data, co):
+    '''用新的顶点座标 (拓扑不变) 更新几何数据'''
+    # return {"VERTS": 下标, "EDGES": 下标, "FACES": 下标} 受影响的元素，没有改变时返回 None
+    # 不修改原有的数组，而是替换为新数组，后台线程可能正在使用旧的数组
+    co = np.asarray(co, dtype=np.float64)
+    verts = changed_verts(obj_data["co"], co)
+    if len(verts) == 0:
+        return None
+    moved = np.zeros(len(co), dtype=bool)
+    moved[verts] = True
+
+    edges = obj_data["edges"]
+    e = np.flatnonzero(moved[edges[:, 0]] | moved[edges[:, 1]])
+    mids = obj_data["mids"].copy()
+    mids[e] = (co[edges[e, 0]] + co[edges[e, 1]]) / 2
+
+    loop_start = obj_data["loop_start"]
+    loop_total = obj_data["loop_total"]
+    loop_verts = obj_data["loop_verts"]
+    centers = obj_data["centers"]
+    f = np.empty(0, dtype=np.int64)
+    if len(loop_start):
+        f = np.flatnonzero(np.add.reduceat(moved[loop_verts], loop_start))
+    if len(f):
+        # 只重新计算受影响的面: 展开这些面的 loop
+        total = loop_total[f].astype(np.int64)
+        starts = np.cumsum(total) - total
+        loops = np.repeat(loop_start[f] - starts, total) + np.arange(int(total.sum()))
+        centers = centers.copy()
+        centers[f] = np.add.reduceat(co[loop_verts[loops]], starts) / total[:, None]
+
+    obj_data["co"] = co
+    obj_data["mids"] = mids
+    obj_data["centers"] = centers
+    for key in VIEW_CACHE_KEYS:
+        obj_data.pop(key, None)
+    # BVHTree 无法局部更新，下次拾取时重建
+    obj_data["bvh"] = None
+    return {"VERTS": verts, "EDGES": e, "FACES": f}
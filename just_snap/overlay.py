@@ -0,0 +1,79 @@
+import numpy as np
+
+# 缓存的点绘制批次
+# 点没有改变时重复使用同一个 batch，不在每次重绘时重新分配
+# shader 与 batch 的创建可以替换，没有 gpu 模块时 (blender 之外、--background) 也可以使用
+
+
+def _batch_for_shader(shader, prim_type, content):
+    from gpu_extras.batch import batch_for_shader
+    return batch_for_shader(shader, prim_type, content)
+
+
+class OverlayBatch:
+    def __init__(self, shader_name, dim=3, prim_type='POINTS', shader=None, batch_factory=None):
+        # shader_name:   gpu.shader.from_builtin 的名称，未指定 shader 时用到才创建
+        # dim:           座标维数，2D shader 为 2
+        # batch_factory: batch_factory(shader, prim_type, {"pos": ...})，默认为 batch_for_shader
+        self.shader_name = shader_name
+        self.dim = dim
+        self.prim_type = prim_type
+        self.__shader = shader
+        self.__batch_factory = batch_factory or _batch_for_shader
+        self.__batch = None
+        self.__pos = np.empty((0, dim), dtype=np.float32)
+        self.__key = None
+        # 点改变后为 True，下次绘制时重建 batch
+        self.dirty = True
+        self.builds = 0
+
+    def __len__(self):
+        return len(self.__pos)
+
+    @property
+    def shader(self):
+        if self.__shader is None:
+            import gpu
+            self.__shader = gpu.shader.from_builtin(self.shader_name)
+        return self.__shader
+
+    @property
+    def pos(self):
+        return self.__pos
+
+    def set_points(self, coords, key=None):
+        '''更新要绘制的点，返回是否有改变'''
+        # key: 点集的标识 (例如候选点表的版本号)，与上次相同时不读取 coords
+        #      未指定时比较座标本身
+        if key is not None and key == self.__key:
+            return False
+        pos = np.array(coords, dtype=np.float32).reshape(-1, self.dim)
+        if key is None and self.__key is None and np.array_equal(pos, self.__pos):
+            return False
+        self.__pos = pos
+        self.__key = key
+        self.dirty = True
+        return True
+
+    def clear(self):
+        self.set_points(np.empty((0, self.dim), dtype=np.float32))
+
+    def batch(self):
+        '''返回缓存的 batch，点改变后才重建'''
+        if self.dirty:
+            self.__batch = None
+            if len(self.__pos):
+                self.__batch = self.__batch_factory(
+                        self.shader, self.prim_type, {"pos": self.__pos})
+                self.builds += 1
+            self.dirty = False
+        return self.__batch
+
+    def draw(self, color):
+        batch = self.batch()
+        if batch is None:
+            return
+        shader = self.shader
+        shader.bind()
+        shader.uniform_float("color", color)
+        batch.draw(shader)
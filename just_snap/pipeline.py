@@ -0,0 +1,101 @@
+import threading
+import traceback
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# 后台提取候选点
+#   主线程: 截取视图矩阵、鼠标位置等，生成不可变的 SnapRequest
+#   工作线程: 只使用缓存的 numpy 几何数据计算候选点，不访问 bpy
+#   主线程: 通过 poll 取回结果，按 generation 丢弃过期的结果
+#   大物体分块提取，每块完成后立即发布，不必等整个请求完成
+
+# generation: 请求序号，越大越新
+# mouse:      鼠标屏幕座标 (x, y)
+# view:       视图快照 projection.View
+# snap_type:  发出请求时的吸附类型，提取的是全部类型
+# xray:       是否为透视模式
+# jobs:       需要提取的物体 ((obj_name, obj_data, kinds, ignore_back, margin, vis, tiles, part, lod), ...)
+# prof:       SnapProfiler
+SnapRequest = namedtuple("SnapRequest",
+        ("generation", "mouse", "view", "snap_type", "xray", "jobs", "prof"))
+
+
+class SnapPipeline:
+    def __init__(self, compute, workers=2):
+        # compute(request, emit)，在工作线程中执行
+        #   emit(result): 发布部分结果，返回 False 表示请求已过期，应停止计算
+        #   返回值作为最后的结果发布，可以为 None
+        self.__compute = compute
+        self.__executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="just_snap")
+        self.__lock = threading.Lock()
+        self.__generation = 0
+        # 小于此序号的请求已过期
+        self.__valid_from = 0
+        self.__done = []
+        self.__pending = 0
+        self.dropped = 0
+        # 计算时出错的请求数
+        self.errors = 0
+
+    @property
+    def busy(self):
+        return self.__pending > 0
+
+    def next_generation(self):
+        self.__generation += 1
+        return self.__generation
+
+    def invalidate(self):
+        '''视图改变时调用，之前提交的请求全部过期'''
+        self.__valid_from = self.__generation + 1
+
+    def submit(self, request):
+        with self.__lock:
+            self.__pending += 1
+        future = self.__executor.submit(
+                self.__compute, request, lambda result: self.__emit(request, result))
+        future.add_done_callback(
+                lambda future: self.__publish(request, future))
+
+    def __emit(self, request, result):
+        if request.generation < self.__valid_from:
+            return False
+        with self.__lock:
+            self.__done.append((request, result))
+        return True
+
+    def __publish(self, request, future):
+        result = None
+        failed = False
+        if not future.cancelled():
+            try:
+                result = future.result()
+            except Exception:
+                traceback.print_exc()
+                failed = True
+        with self.__lock:
+            self.__pending -= 1
+            if failed:
+                # 发布空结果，该请求同样视为已完成
+                self.errors += 1
+                self.__done.append((request, []))
+            elif result:
+                self.__done.append((request, result))
+
+    def poll(self):
+        '''取回已完成的结果，按 generation 排序，丢弃过期的结果'''
+        with self.__lock:
+            done = self.__done
+            self.__done = []
+        done.sort(key=lambda item: item[0].generation)
+        rs = []
+        for request, result in done:
+            if request.generation < self.__valid_from:
+                self.dropped += 1
+                continue
+            rs.append((request, result))
+        return rs
+
+    def shutdown(self):
+        self.__executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,129 @@
+import time
+from collections import deque
+import numpy as np
+
+# 按鼠标的移动方向预先提取候选点
+# 由最近的鼠标位置估计速度，预测之后 LOOKAHEAD 秒内经过的线段，
+# 找出线段将要进入的物体 (屏幕上的包围矩形，见 projection.project_boxes)，在空闲时预先提取，
+# 鼠标到达时这些物体已有候选点，不需要等待第一次提取
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 保留的鼠标位置个数
+MAX_SAMPLES = 8
+# 只用最近这段时间内的位置估计速度 (秒)
+SAMPLE_WINDOW = 0.15
+# 速度低于此值 (像素/秒) 时不预测
+MIN_SPEED = 50.0
+# 预测的时间长度 (秒)
+LOOKAHEAD = 0.3
+# 每次最多预先提取的物体数
+MAX_TARGETS = 2
+# 每次最多读取的网格数 (没有几何缓存、需要在主线程读取网格的物体)
+MAX_LOADS = 1
+# 顶点数 (应用修改器后) 超过此值的网格读取太慢，不为预先提取而读取
+MAX_LOAD_VERTS = 20000
+
+
+def segment_enter(p0, p1, rects):
+    '''线段 p0 -> p1 进入矩形时的参数 t (0~1)，不相交为 nan'''
+    # 分轴求线段在矩形内的参数区间，取交集
+    p0 = np.asarray(p0, dtype=np.float64)
+    d = np.asarray(p1, dtype=np.float64) - p0
+    t_in = np.zeros(len(rects))
+    t_out = np.ones(len(rects))
+    for k in (0, 1):
+        lo = rects[:, k]
+        hi = rects[:, k + 2]
+        if d[k] == 0:
+            inside = (lo <= p0[k]) & (p0[k] <= hi)
+            t_out = np.where(inside, t_out, -1.0)
+            continue
+        a = (lo - p0[k]) / d[k]
+        b = (hi - p0[k]) / d[k]
+        t_in = np.maximum(t_in, np.minimum(a, b))
+        t_out = np.minimum(t_out, np.maximum(a, b))
+    # nan 的矩形比较结果为 False
+    return np.where(t_in <= t_out, t_in, np.nan)
+
+
+class Prefetcher:
+    def __init__(self, clock=time.perf_counter):
+        self.__clock = clock
+        # (time, x, y)
+        self.__samples = deque(maxlen=MAX_SAMPLES)
+        # 已预先提取、鼠标还没有经过的物体
+        self.__pending = set()
+        self.prefetched = 0
+        self.hits = 0
+        # 视图改变或退出时还没有被用到的物体
+        self.wasted = 0
+
+    def add_sample(self, mouse):
+        self.__samples.append((self.__clock(), float(mouse[0]), float(mouse[1])))
+
+    def velocity(self):
+        '''鼠标的速度 (像素/秒)，最小二乘拟合最近 SAMPLE_WINDOW 秒内的位置，样本不足时为 0'''
+        # 时间窗口从现在算起，鼠标停下后没有新的样本，速度归零
+        now = self.__clock()
+        while self.__samples and self.__samples[0][0] < now - SAMPLE_WINDOW:
+            self.__samples.popleft()
+        if len(self.__samples) < 2:
+            return np.zeros(2)
+        samples = np.array(self.__samples)
+        t = samples[:, 0] - samples[:, 0].mean()
+        var = float(t @ t)
+        if var <= 0:
+            return np.zeros(2)
+        return (t @ samples[:, 1:]) / var
+
+    def predict(self):
+        '''预测的鼠标路径 (起点, 终点)，鼠标没有移动时返回 None'''
+        v = self.velocity()
+        if np.hypot(*v) < MIN_SPEED:
+            return None
+        p0 = np.array(self.__samples[-1][1:])
+        return p0, p0 + v * LOOKAHEAD
+
+    def targets(self, segment, rects, mask=None):
+        '''路径将要进入的物体，返回 (下标 按进入的先后排序, 各物体进入时的参数 t)'''
+        # 起点已在矩形内的物体由鼠标下的拾取处理，不预先提取
+        p0, p1 = segment
+        t = segment_enter(p0, p1, rects)
+        ok = t > 0
+        if mask is not None:
+            ok &= mask
+        idxs = np.flatnonzero(ok)
+        return idxs[np.argsort(t[idxs], kind="stable")], t
+
+    def started(self, names):
+        self.__pending.update(names)
+        self.prefetched += len(names)
+
+    def is_pending(self, name):
+        return name in self.__pending
+
+    def used(self, name):
+        '''鼠标下拾取到的物体，是预先提取的物体时记为命中'''
+        if name in self.__pending:
+            self.__pending.discard(name)
+            self.hits += 1
+
+    def cancel(self):
+        '''视图改变时调用，还没有用到的预先提取作废'''
+        self.wasted += len(self.__pending)
+        self.__pending.clear()
+
+    def stats(self):
+        return {
+            "prefetched": self.prefetched,
+            "hits": self.hits,
+            "wasted": self.wasted,
+            "pending": len(self.__pending),
+            "hit_rate": self.hits / self.prefetched if self.prefetched else 0.0,
+        }
+
+    def summary(self):
+        '''一行文字，显示在耗时统计中'''
+        stats = self.stats()
+        return "prefetch %d  hits %d (%.0f%%)  wasted %d" % (
+                stats["prefetched"], stats["hits"], stats["hit_rate"] * 100, stats["wasted"])
@@ -0,0 +1,98 @@
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+# 吸附查询的耗时统计
+# 每个阶段的耗时与计数储存在环形缓冲中，可以输出 p50/p95/p99
+# 关闭时 stage() 返回共享的空上下文，几乎没有开销
+
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class SnapProfiler:
+    def __init__(self, enabled=False, size=512):
+        self.enabled = enabled
+        self.size = size
+        # 阶段名称: deque([秒, ...])
+        self.__times = {}
+        # 计数名称: deque([个数, ...])
+        self.__counts = {}
+
+    def stage(self, name):
+        '''with profiler.stage("name"): ...'''
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name)
+
+    def record(self, name, seconds):
+        buf = self.__times.get(name)
+        if buf is None:
+            buf = self.__times[name] = deque(maxlen=self.size)
+        buf.append(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        buf = self.__counts.get(name)
+        if buf is None:
+            buf = self.__counts[name] = deque(maxlen=self.size)
+        buf.append(n)
+
+    def clear(self):
+        self.__times.clear()
+        self.__counts.clear()
+
+    def report(self):
+        '''return {"times": {阶段: {"n", "p50", "p95", "p99"}}, "counts": {...}}，耗时单位毫秒'''
+        rs = {"times": {}, "counts": {}}
+        for name, buf in list(self.__times.items()):
+            rs["times"][name] = _percentiles(np.array(buf) * 1000.0)
+        for name, buf in list(self.__counts.items()):
+            rs["counts"][name] = _percentiles(np.array(buf, dtype=np.float64))
+        return rs
+
+    def lines(self):
+        '''用于屏幕显示的文字'''
+        report = self.report()
+        rs = []
+        for name, p in sorted(report["times"].items()):
+            rs.append("%-14s p50 %7.2f  p95 %7.2f  p99 %7.2f ms  (%d)" % (
+                name, p["p50"], p["p95"], p["p99"], p["n"]))
+        for name, p in sorted(report["counts"].items()):
+            rs.append("%-14s p50 %7.0f  p95 %7.0f  p99 %7.0f" % (
+                name, p["p50"], p["p95"], p["p99"]))
+        return rs
+
+    def dump(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return {"n": 0, "p50": 0.0, "p95": 0.0, "p99": 0.0}
+    p50, p95, p99 = np.percentile(values, (50, 95, 99))
+    return {"n": len(values), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+# 未指定 profiler 时使用
+NULL_PROFILER = SnapProfiler()
@@ -0,0 +1,163 @@
+import numpy as np
+from collections import namedtuple
+
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 视图快照
+#   persp:  rv3d.perspective_matrix (4, 4)
+#   view:   rv3d.view_matrix (4, 4)
+#   width, height: region 尺寸
+#   is_persp: 是否为透视视图
+View = namedtuple("View", ("persp", "view", "width", "height", "is_persp"))
+
+KINDS = ("VERTS", "EDGES", "FACES")
+
+
+def view_from_rv3d(region, rv3d):
+    return View(
+        np.array(rv3d.perspective_matrix, dtype=np.float64),
+        np.array(rv3d.view_matrix, dtype=np.float64),
+        region.width,
+        region.height,
+        bool(rv3d.is_perspective),
+    )
+
+def view_key(view):
+    '''视图的唯一标识，用于判断投影缓存是否有效'''
+    return (view.persp.tobytes(), view.width, view.height)
+
+def view_direction(view):
+    '''视线方向 (世界空间，单位向量)'''
+    d = -view.view[2, :3]
+    return d / np.linalg.norm(d)
+
+def transform_points(co, matrix):
+    '''批量 matrix @ co，co: (N, 3)'''
+    M = np.asarray(matrix, dtype=np.float64)
+    return co @ M[:3, :3].T + M[:3, 3]
+
+def object_view(view, matrix):
+    '''物体局部空间的视图，局部座标直接投影到屏幕，深度仍为世界空间的视图深度'''
+    # 实例只保存变换矩阵，投影时与视图矩阵合并，不需要把全部座标先变换到世界空间
+    M = np.asarray(matrix, dtype=np.float64)
+    return view._replace(persp=view.persp @ M, view=view.view @ M)
+
+def box_corners(lo, hi):
+    '''AABB 的 8 个角 (N, 8, 3)，lo 与 hi 为 (N, 3) 或 (3,)'''
+    lo = np.asarray(lo, dtype=np.float64).reshape(-1, 3)
+    hi = np.asarray(hi, dtype=np.float64).reshape(-1, 3)
+    corners = np.empty((len(lo), 8, 3), dtype=np.float64)
+    for i in range(8):
+        corners[:, i, 0] = hi[:, 0] if i & 1 else lo[:, 0]
+        corners[:, i, 1] = hi[:, 1] if i & 2 else lo[:, 1]
+        corners[:, i, 2] = hi[:, 2] if i & 4 else lo[:, 2]
+    return corners
+
+def transform_bounds(lo, hi, matrix):
+    '''局部空间的 AABB 变换后的世界空间 AABB，返回 (lo, hi)'''
+    corners = transform_points(box_corners(lo, hi)[0], matrix)
+    return corners.min(axis=0), corners.max(axis=0)
+
+def matrix_scale(matrix):
+    '''变换矩阵的平均缩放 (体积缩放的立方根)'''
+    M = np.asarray(matrix, dtype=np.float64)
+    return float(abs(np.linalg.det(M[:3, :3])) ** (1 / 3))
+
+def project_points(co, view, margin=0):
+    '''批量投影世界座标到屏幕'''
+    # 与 view3d_utils.location_3d_to_region_2d 相同的计算
+    # return (
+    #   s2d,    屏幕座标 (N, 2) float
+    #   depth,  视图空间深度 (N,)，越小越靠前
+    #   mask,   是否在视图内 (N,) bool
+    # )
+    co = np.asarray(co, dtype=np.float64).reshape(-1, 3)
+    P = view.persp
+    prj = co @ P[:, :3].T + P[:, 3]
+    w = prj[:, 3]
+    front = w > 0.0
+    w = np.where(front, w, 1.0)
+
+    half_w = view.width / 2
+    half_h = view.height / 2
+    s2d = np.empty((len(co), 2), dtype=np.float64)
+    s2d[:, 0] = half_w + half_w * (prj[:, 0] / w)
+    s2d[:, 1] = half_h + half_h * (prj[:, 1] / w)
+
+    V = view.view
+    depth = -(co @ V[2, :3] + V[2, 3])
+
+    x = s2d[:, 0]
+    y = s2d[:, 1]
+    mask = front \
+        & (x >= margin) & (x <= view.width - margin) \
+        & (y >= margin) & (y <= view.height - margin)
+    return s2d, depth, mask
+
+def project_kinds(kind_co, view, margin=0):
+    '''一次投影顶点、边中点、面中心'''
+    # kind_co: {"VERTS": (N, 3), "EDGES": (E, 3), "FACES": (F, 3)}
+    # return {"VERTS": (s2d, depth, mask), ...}
+    sizes = [len(kind_co[k]) for k in KINDS]
+    co = np.concatenate([kind_co[k] for k in KINDS])
+    s2d, depth, mask = project_points(co, view, margin)
+    rs = {}
+    start = 0
+    for kind, size in zip(KINDS, sizes):
+        end = start + size
+        rs[kind] = (s2d[start:end], depth[start:end], mask[start:end])
+        start = end
+    return rs
+
+def project_boxes(box_co, view):
+    '''批量投影物体包围盒，返回屏幕上的矩形'''
+    # box_co: 包围盒的 8 个角的世界座标 (N, 8, 3)
+    # return (
+    #   rects, 屏幕矩形 (N, 4) (x0, y0, x1, y1)
+    #   mask,  是否有角在相机前面 (N,) bool
+    # )
+    box_co = np.asarray(box_co, dtype=np.float64).reshape(-1, 8, 3)
+    n = len(box_co)
+    P = view.persp
+    prj = box_co @ P[:, :3].T + P[:, 3]
+    w = prj[:, :, 3]
+    front = w > 0.0
+    w = np.where(front, w, 1.0)
+    half_w = view.width / 2
+    half_h = view.height / 2
+    x = half_w + half_w * (prj[:, :, 0] / w)
+    y = half_h + half_h * (prj[:, :, 1] / w)
+    # 只计算相机前面的角
+    rects = np.empty((n, 4), dtype=np.float64)
+    rects[:, 0] = np.where(front, x, np.inf).min(axis=1)
+    rects[:, 1] = np.where(front, y, np.inf).min(axis=1)
+    rects[:, 2] = np.where(front, x, -np.inf).max(axis=1)
+    rects[:, 3] = np.where(front, y, -np.inf).max(axis=1)
+    # 包围盒跨过相机平面时，投影没有边界，视为占满整个屏幕
+    cross = front.any(axis=1) & ~front.all(axis=1)
+    rects[cross] = (0.0, 0.0, view.width, view.height)
+    return rects, front.any(axis=1)
+
+def pixels_per_unit(view, co):
+    '''世界座标 co 处，与屏幕平行的单位长度在屏幕上的像素数'''
+    right = view.view[0, :3] / np.linalg.norm(view.view[0, :3])
+    co = np.asarray(co, dtype=np.float64)
+    s2d, depth, _ = project_points(np.array((co, co + right)), view)
+    if view.is_persp and depth[0] <= 0:
+        return float("inf")
+    return float(np.hypot(*(s2d[1] - s2d[0])))
+
+def point_on_segment(a, b, t, view):
+    '''屏幕上线段 ab 参数 t 处的点对应的世界座标'''
+    # t 为屏幕空间的参数，透视下需要按深度校正
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if view.is_persp:
+        V = view.view
+        da = -(a @ V[2, :3] + V[2, 3])
+        db = -(b @ V[2, :3] + V[2, 3])
+        # 1/深度 在屏幕空间线性
+        den = (1.0 - t) * db + t * da
+        if den > 0:
+            t = t * da / den
+    return a + (b - a) * t
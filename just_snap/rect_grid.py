@@ -0,0 +1,74 @@
+import numpy as np
+
+# 屏幕空间矩形的均匀网格索引
+# 每个矩形登记到它覆盖的所有格子中，查询时只检查所在格子的矩形
+# 用于预先提取时查找鼠标路径经过的物体 (见 prefetch.py)
+
+
+class RectGrid:
+    def __init__(self, width, height, cell=64):
+        self.cell = cell
+        self.cols = max(1, int(np.ceil(width / cell)))
+        self.rows = max(1, int(np.ceil(height / cell)))
+        self.names = []
+        self.rects = np.empty((0, 4), dtype=np.float64)
+        # 格子 i 中的矩形为 self.__items[self.__starts[i]:self.__starts[i + 1]]
+        self.__starts = np.zeros(self.cols * self.rows + 1, dtype=np.int64)
+        self.__items = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.names)
+
+    def build(self, names, rects):
+        '''rects: (N, 4) (x0, y0, x1, y1)，覆盖屏幕外的部分会被截掉'''
+        self.names = list(names)
+        self.rects = np.asarray(rects, dtype=np.float64).reshape(-1, 4)
+        cell = self.cell
+        cx0 = np.clip(np.floor(self.rects[:, 0] / cell), 0, self.cols - 1).astype(np.int64)
+        cy0 = np.clip(np.floor(self.rects[:, 1] / cell), 0, self.rows - 1).astype(np.int64)
+        cx1 = np.clip(np.floor(self.rects[:, 2] / cell), 0, self.cols - 1).astype(np.int64)
+        cy1 = np.clip(np.floor(self.rects[:, 3] / cell), 0, self.rows - 1).astype(np.int64)
+        nx = cx1 - cx0 + 1
+        ny = cy1 - cy0 + 1
+        # 完全在屏幕外的矩形不登记
+        outside = (self.rects[:, 2] < 0) | (self.rects[:, 3] < 0) \
+            | (self.rects[:, 0] > self.cols * cell) | (self.rects[:, 1] > self.rows * cell)
+        counts = np.where(outside, 0, nx * ny)
+
+        # 展开为 (格子, 矩形) 对，按格子排序
+        rect = np.repeat(np.arange(len(counts)), counts)
+        local = np.arange(len(rect)) - np.repeat(np.cumsum(counts) - counts, counts)
+        dy, dx = np.divmod(local, nx[rect])
+        cells = (cy0[rect] + dy) * self.cols + cx0[rect] + dx
+        order = np.argsort(cells, kind="stable")
+        self.__items = rect[order]
+        self.__starts = np.searchsorted(cells[order], np.arange(self.cols * self.rows + 1))
+
+    def query(self, x, y):
+        '''返回包含点 (x, y) 的矩形下标，按加入顺序'''
+        cx = int(x // self.cell)
+        cy = int(y // self.cell)
+        if cx < 0 or cy < 0 or cx >= self.cols or cy >= self.rows:
+            return []
+        i = cy * self.cols + cx
+        items = self.__items[self.__starts[i]:self.__starts[i + 1]]
+        r = self.rects[items]
+        inside = (x > r[:, 0]) & (x < r[:, 2]) & (y > r[:, 1]) & (y < r[:, 3])
+        return items[inside].tolist()
+
+    def query_names(self, x, y):
+        return [self.names[i] for i in self.query(x, y)]
+
+    def query_rect(self, x0, y0, x1, y1):
+        '''返回与矩形 (x0, y0, x1, y1) 相交的矩形下标，按加入顺序'''
+        cell = self.cell
+        cx = np.arange(max(0, int(x0 // cell)), min(self.cols - 1, int(x1 // cell)) + 1)
+        cy = np.arange(max(0, int(y0 // cell)), min(self.rows - 1, int(y1 // cell)) + 1)
+        if len(cx) == 0 or len(cy) == 0:
+            return np.empty(0, dtype=np.int64)
+        cells = (cy[:, None] * self.cols + cx[None, :]).ravel()
+        items = np.unique(np.concatenate(
+                [self.__items[self.__starts[i]:self.__starts[i + 1]] for i in cells]))
+        r = self.rects[items]
+        overlap = (r[:, 0] <= x1) & (r[:, 2] >= x0) & (r[:, 1] <= y1) & (r[:, 3] >= y0)
+        return items[overlap]
@@ -0,0 +1,154 @@
+import numpy as np
+
+# 场景级的物体包围盒 BVH (两层加速结构的上层)
+# 只储存物体的世界空间 AABB，射线先在这里筛选可能相交的物体，
+# 再由各物体自身的 BVHTree 求精确的交点
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 叶节点最多包含的物体数
+LEAF_SIZE = 4
+# 建树后加入的物体不在树中，逐个检查，超过此数量时应重建
+MAX_EXTRA = 256
+
+
+class SceneBVH:
+    def __init__(self, names, boxes):
+        # names: 物体名称
+        # boxes: 包围盒的角的世界座标 (N, K, 3)，或 AABB (N, 2, 3)
+        self.names = list(names)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(len(self.names), -1, 3)
+        self.lo = boxes.min(axis=1) if len(boxes) else np.empty((0, 3))
+        self.hi = boxes.max(axis=1) if len(boxes) else np.empty((0, 3))
+        # 节点: (lo, hi, left, right, start, end)，叶节点 left = right = -1
+        # 叶节点的物体为 self.__order[start:end]
+        # 子节点的编号总是大于父节点
+        self.__nodes = []
+        self.__parent = []
+        self.__order = np.arange(len(self.names))
+        if len(self.names):
+            self.__build(0, len(self.names), -1)
+        # 建树后加入的物体
+        self.extra = []
+        # 物体所在的叶节点
+        self.__leaf = np.zeros(len(self.names), dtype=np.int64)
+        for i, (_, _, left, _, start, end) in enumerate(self.__nodes):
+            if left < 0:
+                self.__leaf[self.__order[start:end]] = i
+
+    def __len__(self):
+        return len(self.names)
+
+    def __build(self, start, end, parent):
+        items = self.__order[start:end]
+        lo = self.lo[items].min(axis=0)
+        hi = self.hi[items].max(axis=0)
+        i = len(self.__nodes)
+        self.__nodes.append(None)
+        self.__parent.append(parent)
+        if end - start <= LEAF_SIZE:
+            self.__nodes[i] = (tuple(lo), tuple(hi), -1, -1, start, end)
+            return i
+        # 按包围盒中心在最长轴上的中位数分为两半
+        centers = (self.lo[items] + self.hi[items]) / 2
+        axis = int(np.argmax(centers.max(axis=0) - centers.min(axis=0)))
+        mid = (end - start) // 2
+        part = np.argpartition(centers[:, axis], mid)
+        self.__order[start:end] = items[part]
+        left = self.__build(start, start + mid, i)
+        right = self.__build(start + mid, end, i)
+        self.__nodes[i] = (tuple(lo), tuple(hi), left, right, start, end)
+        return i
+
+    def append(self, names, boxes):
+        '''加入物体，不改变树的结构，射线逐个检查这些物体'''
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(len(names), -1, 3)
+        if len(boxes) == 0:
+            return
+        start = len(self.names)
+        self.names.extend(names)
+        self.lo = np.concatenate((self.lo, boxes.min(axis=1)))
+        self.hi = np.concatenate((self.hi, boxes.max(axis=1)))
+        self.__leaf = np.concatenate((self.__leaf, np.full(len(boxes), -1, dtype=np.int64)))
+        self.extra.extend(range(start, len(self.names)))
+
+    def refit(self, items, lo, hi):
+        '''更新部分物体的包围盒，只重新计算它们的上层节点，不改变树的结构'''
+        items = np.asarray(items, dtype=np.int64)
+        if len(items) == 0:
+            return
+        self.lo[items] = lo
+        self.hi[items] = hi
+        nodes = set()
+        for i in set(self.__leaf[items].tolist()):
+            # 不在树中的物体 (leaf = -1) 不需要更新节点
+            while i >= 0 and i not in nodes:
+                nodes.add(i)
+                i = self.__parent[i]
+        # 子节点的编号大于父节点，从大到小即自下而上
+        for i in sorted(nodes, reverse=True):
+            _, _, left, right, start, end = self.__nodes[i]
+            if left < 0:
+                leaf = self.__order[start:end]
+                lo, hi = self.lo[leaf].min(axis=0), self.hi[leaf].max(axis=0)
+            else:
+                a, b = self.__nodes[left], self.__nodes[right]
+                lo = np.minimum(a[0], b[0])
+                hi = np.maximum(a[1], b[1])
+            self.__nodes[i] = (tuple(lo), tuple(hi), left, right, start, end)
+
+    def ray_candidates(self, origin, direction, distance=np.inf, mask=None):
+        '''返回射线穿过的包围盒 [(物体下标, 进入距离), ...]，按进入距离排序'''
+        # mask: 只返回 mask 为 True 的物体 (例如可见的网格物体)
+        if not self.__nodes and not self.extra:
+            return []
+        ox, oy, oz = (float(v) for v in origin)
+        inv = tuple(1.0 / float(v) if v != 0 else np.inf for v in direction)
+        o = (ox, oy, oz)
+        rs = []
+        for item in self.extra:
+            # mask 可能是加入这些物体之前取得的
+            if mask is not None and (item >= len(mask) or not mask[item]):
+                continue
+            t = _slab(o, inv, self.lo[item], self.hi[item], distance)
+            if t is not None:
+                rs.append((item, t))
+        stack = [0] if self.__nodes else []
+        while stack:
+            lo, hi, left, right, start, end = self.__nodes[stack.pop()]
+            if _slab(o, inv, lo, hi, distance) is None:
+                continue
+            if left < 0:
+                for item in self.__order[start:end]:
+                    if mask is not None and not mask[item]:
+                        continue
+                    t = _slab(o, inv, self.lo[item], self.hi[item], distance)
+                    if t is not None:
+                        rs.append((int(item), t))
+                continue
+            stack.append(left)
+            stack.append(right)
+        rs.sort(key=lambda item: item[1])
+        return rs
+
+
+def _slab(o, inv, lo, hi, distance):
+    '''射线与 AABB 相交时返回进入距离 (起点在盒内为 0)，否则返回 None'''
+    t0 = 0.0
+    t1 = distance
+    for k in range(3):
+        if inv[k] == np.inf:
+            # 射线与该轴平行
+            if o[k] < lo[k] or o[k] > hi[k]:
+                return None
+            continue
+        ta = (lo[k] - o[k]) * inv[k]
+        tb = (hi[k] - o[k]) * inv[k]
+        if ta > tb:
+            ta, tb = tb, ta
+        if ta > t0:
+            t0 = ta
+        if tb < t1:
+            t1 = tb
+        if t0 > t1:
+            return None
+    return t0
@@ -0,0 +1,246 @@
+import threading
+import numpy as np
+from .scene_bvh import SceneBVH, MAX_EXTRA
+
+# 常驻的场景物体索引
+# 以数组储存物体的可见性、是否为网格与世界空间包围盒，在多次启动 JustSnap 之间保留
+# depsgraph_update_post 只记录改变了的物体 (mark_updates)，下次启动时只重新读取这些物体，
+# 打开文件后丢弃全部索引 (clear)，撤销、重做后全部重新读取 (invalidate)，
+# 启动的耗时与改变的物体数有关，而与场景大小无关
+# 删除的物体只标记，超过四分之一时才压缩；新增的物体先加在 BVH 之外，
+# 所以物体的 slot (与 SceneBVH 的物体下标相同) 在压缩前不变
+# 集合实例、粒子实例等 depsgraph 中的物体实例也作为可拾取的物体加入，
+# 名称为 (实例化物体名称, persistent_id)，随实例化物体一起读取与删除
+# 不依赖 bpy，读取物体的部分见 just_utils.sync_scene_index
+
+# 按场景名称保存
+indexes = {}
+_lock = threading.Lock()
+# 是否已注册 depsgraph_update_post，没有注册时每次都要重新读取全部物体
+live = False
+
+
+def get(scene_name):
+    '''取得场景的索引，不存在时新建'''
+    with _lock:
+        index = indexes.get(scene_name)
+        if index is None:
+            index = indexes[scene_name] = SceneIndex()
+        if not live:
+            # 不知道哪些物体改变了
+            index.mark_all()
+            index.mark([name for name in index.names if name is not None])
+        return index
+
+def clear():
+    '''丢弃全部场景的索引，打开文件后调用'''
+    with _lock:
+        indexes.clear()
+
+def invalidate():
+    '''全部物体都需要重新读取，撤销、重做后调用'''
+    # 撤销后物体恢复到之前的状态，depsgraph_update_post 不一定报告了全部改变的物体
+    with _lock:
+        for index in indexes.values():
+            index.mark_all()
+            index.mark([name for name in index.names if name is not None])
+
+
+class SceneIndex:
+    def __init__(self):
+        # 删除的物体名称为 None
+        self.names = []
+        self.__slots = {}
+        self.__dead = 0
+        self.visible = np.zeros(0, dtype=bool)
+        self.is_mesh = np.zeros(0, dtype=bool)
+        self.lo = np.empty((0, 3), dtype=np.float64)
+        self.hi = np.empty((0, 3), dtype=np.float64)
+        self.__lock = threading.Lock()
+        # 需要重新读取的物体名称
+        self.__dirty = set()
+        # 物体可能增删、可见性可能改变，需要检查全部物体
+        self.__rescan = True
+        # 上次场景更新时的物体数，见 mark_updates
+        self.__counts = None
+        self.__bvh = None
+        # 包围盒改变、还没有更新到 BVH 的物体
+        self.__refit = set()
+        # 实例 {名称: (被实例化的物体名称, matrix_world (4, 4))}
+        self.instances = {}
+        # {实例化物体名称: [实例名称, ...]}
+        self.__instancers = {}
+
+    def __len__(self):
+        return len(self.__slots)
+
+    def __contains__(self, name):
+        return name in self.__slots
+
+    def slot(self, name):
+        return self.__slots.get(name)
+
+    def mark(self, names):
+        '''记录改变了的物体，可以在 depsgraph_update_post 中调用'''
+        with self.__lock:
+            self.__dirty.update(names)
+
+    def mark_updates(self, names, collections=False, counts=None):
+        '''记录 depsgraph_update_post 报告的改变，只在物体可能增删或可见性改变时检查全部物体'''
+        # names:       更新了的物体名称
+        # collections: 是否有集合的更新 (集合的内容或可见性改变)
+        # counts:      有场景的更新时为 (场景中的物体数, 视图层中的物体数)，否则为 None
+        # 选择物体、移动 3D 游标等也会更新场景，物体数没有改变时只读取更新了的物体
+        with self.__lock:
+            rescan = collections
+            if counts is not None:
+                rescan = rescan or counts != self.__counts
+                self.__counts = counts
+            # 新增或重命名的物体
+            rescan = rescan or any(name not in self.__slots for name in names)
+            if rescan:
+                self.__rescan = True
+            self.__dirty.update(names)
+
+    def mark_all(self):
+        '''物体增删或可见性改变，下次同步时检查全部物体'''
+        with self.__lock:
+            self.__rescan = True
+
+    def take_dirty(self):
+        '''取出需要同步的内容，返回 (是否检查全部, 改变了的物体名称)'''
+        with self.__lock:
+            rescan, dirty = self.__rescan, self.__dirty
+            self.__rescan = False
+            self.__dirty = set()
+        return rescan, dirty
+
+    def retain(self, names):
+        '''只保留 names 中的物体，返回新增的名称'''
+        names = list(names)
+        keep = set(names)
+        # 实例不在场景的物体中，随实例化物体删除
+        removed = [name for name in self.__slots
+                if name not in keep and name not in self.instances]
+        if removed:
+            self.remove(removed)
+        return [name for name in names if name not in self.__slots]
+
+    def remove(self, names):
+        names = [name for name in names if name in self.__slots]
+        for name in list(names):
+            names.extend(self.__instancers.pop(name, ()))
+        if not names:
+            return
+        for name in names:
+            self.instances.pop(name, None)
+            i = self.__slots.pop(name)
+            self.names[i] = None
+            # 不可见、不是网格，不会被拾取
+            self.visible[i] = False
+            self.is_mesh[i] = False
+        self.__dead += len(names)
+        if self.__dead * 4 > len(self.names):
+            self.__compact()
+
+    def __compact(self):
+        keep = np.array([name is not None for name in self.names], dtype=bool)
+        self.names = [name for name in self.names if name is not None]
+        self.__slots = {name: i for i, name in enumerate(self.names)}
+        self.__dead = 0
+        self.visible = self.visible[keep]
+        self.is_mesh = self.is_mesh[keep]
+        self.lo = self.lo[keep]
+        self.hi = self.hi[keep]
+        # slot 改变，重建 BVH
+        self.__bvh = None
+        self.__refit.clear()
+
+    def update(self, names, visible, is_mesh, lo, hi):
+        '''加入或更新物体'''
+        # visible, is_mesh: (N,) bool
+        # lo, hi:           世界空间 AABB (N, 3)
+        if len(names) == 0:
+            return
+        slots = np.array([self.__slots.get(name, -1) for name in names], dtype=np.int64)
+        old = slots >= 0
+        if old.any():
+            i = slots[old]
+            self.visible[i] = np.asarray(visible)[old]
+            self.is_mesh[i] = np.asarray(is_mesh)[old]
+            moved = (self.lo[i] != lo[old]).any(axis=1) | (self.hi[i] != hi[old]).any(axis=1)
+            self.lo[i] = lo[old]
+            self.hi[i] = hi[old]
+            self.__refit.update(i[moved].tolist())
+        new = ~old
+        if new.any():
+            added = [name for name, n in zip(names, new) if n]
+            for name in added:
+                self.__slots[name] = len(self.names)
+                self.names.append(name)
+            self.visible = np.concatenate((self.visible, np.asarray(visible)[new]))
+            self.is_mesh = np.concatenate((self.is_mesh, np.asarray(is_mesh)[new]))
+            self.lo = np.concatenate((self.lo, lo[new]))
+            self.hi = np.concatenate((self.hi, hi[new]))
+            if self.__bvh is not None:
+                if len(self.__bvh.extra) + len(added) > MAX_EXTRA:
+                    self.__bvh = None
+                else:
+                    self.__bvh.append(added, np.stack((lo[new], hi[new]), axis=1))
+
+    def set_visible(self, names, visible):
+        '''更新已有物体的可见性，实例与实例化物体相同'''
+        slots = np.array([self.__slots.get(name, -1) for name in names], dtype=np.int64)
+        old = slots >= 0
+        visible = np.asarray(visible, dtype=bool)
+        self.visible[slots[old]] = visible[old]
+        for name, v in zip(names, visible.tolist()):
+            keys = self.__instancers.get(name)
+            if keys:
+                self.visible[[self.__slots[key] for key in keys]] = v
+
+    def instancers(self):
+        '''已读取实例的实例化物体名称'''
+        return list(self.__instancers)
+
+    def set_instances(self, instancer, names, objects, matrices, visible, lo, hi):
+        '''替换实例化物体的全部实例'''
+        # names:    实例名称 (实例化物体名称, persistent_id)
+        # objects:  被实例化的物体名称
+        # matrices: 实例的 matrix_world (N, 4, 4)
+        # visible:  实例化物体的可见性
+        # lo, hi:   实例的世界空间 AABB (N, 3)
+        keep = set(names)
+        self.remove([name for name in self.__instancers.get(instancer, ()) if name not in keep])
+        self.__instancers[instancer] = list(names)
+        for name, obj_name, matrix in zip(names, objects, matrices):
+            self.instances[name] = (obj_name, np.asarray(matrix, dtype=np.float64))
+        n = len(names)
+        self.update(names, np.full(n, visible, dtype=bool), np.ones(n, dtype=bool),
+                np.asarray(lo, dtype=np.float64).reshape(-1, 3),
+                np.asarray(hi, dtype=np.float64).reshape(-1, 3))
+
+    def drop_instances(self, instancer):
+        '''物体不再实例化其他物体'''
+        self.remove(self.__instancers.pop(instancer, ()))
+
+    def set_bounds(self, name, lo, hi):
+        '''只更新一个物体的包围盒，例如编辑模式下移动了顶点'''
+        i = self.__slots.get(name)
+        if i is None:
+            return
+        self.lo[i] = lo
+        self.hi[i] = hi
+        self.__refit.add(i)
+
+    def bvh(self):
+        '''全部物体包围盒的 SceneBVH，物体下标与 slot 相同'''
+        # 压缩或新增的物体过多时重建，包围盒改变时只更新上层节点
+        if self.__bvh is None:
+            self.__bvh = SceneBVH(self.names, np.stack((self.lo, self.hi), axis=1))
+            self.__refit.clear()
+        elif self.__refit:
+            items = np.array(sorted(self.__refit), dtype=np.int64)
+            self.__bvh.refit(items, self.lo[items], self.hi[items])
+            self.__refit.clear()
+        return self.__bvh
@@ -0,0 +1,203 @@
+import time
+from collections import namedtuple
+
+# 鼠标事件的调度
+# 在主线程的定时器 (bpy.app.timers) 中执行吸附查询:
+#   同一时间只有一个查询，等待期间的鼠标事件合并为最新的一个
+#   按最近的查询耗时与视图重绘间隔调整延迟，查询占用的时间不超过主线程的一半
+#   鼠标移动不到 pixels 像素时不查询
+# 查询只使用已有的候选点，总是在最新的鼠标位置执行；
+# 提交后台提取 (submit) 在上一次提取未完成时推迟，等待期间只保留最新的事件
+# 定时器可以替换，没有 bpy 时 (blender 之外) 也可以使用
+
+# 查询耗时与重绘间隔的平滑系数
+EMA_ALPHA = 0.2
+# 两次查询的开始时间至少相隔查询耗时的倍数
+COST_FACTOR = 2.0
+# 后台提取未完成时，再次检查能否提交的间隔 (秒)
+BUSY_INTERVAL = 0.005
+
+# 鼠标事件的快照，与 bpy 的 event 有相同的属性，事件处理结束后仍然有效
+MouseEvent = namedtuple("MouseEvent", ("mouse_region_x", "mouse_region_y"))
+
+
+def _timers():
+    import bpy
+    return bpy.app.timers
+
+
+class SnapScheduler:
+    def __init__(self, query, submit=None, busy=None, pixels=1.0, min_delay=0.0, max_delay=0.1,
+            timers=None, clock=time.perf_counter):
+        # query(event):  用已有的候选点执行一次查询，event 为 MouseEvent
+        # submit(event): 提交后台提取，在 query 之后调用
+        # busy():        返回 True 时上一次提交的提取还没有完成，推迟 submit (不推迟 query)
+        # pixels:       鼠标移动少于此距离 (像素) 时不查询
+        # timers:       有 register(fn, first_interval=)、unregister(fn)、is_registered(fn)，
+        #               默认为 bpy.app.timers
+        self.__query = query
+        self.__submit = submit
+        self.__busy = busy
+        self.pixels = pixels
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.__timers = timers
+        self.__clock = clock
+        # 定时器注册与注销需要同一个函数对象
+        self.__tick_fn = self.__tick
+        self.__scheduled = False
+        self.__running = False
+        # 等待查询的最新事件
+        self.__pending = None
+        # 等待提交的最新事件
+        self.__pending_submit = None
+        # 上一次查询的鼠标位置与开始时间
+        self.__last_mouse = None
+        self.__last_start = None
+        self.__last_frame = None
+        # 下一次查询的时间
+        self.__due = 0.0
+        # 查询耗时与重绘间隔 (秒)，指数平滑
+        self.cost = 0.0
+        self.frame_interval = 0.0
+        self.delay = 0.0
+        self.issued = 0
+        self.coalesced = 0
+        self.skipped = 0
+        self.deferred = 0
+
+    @property
+    def timers(self):
+        if self.__timers is None:
+            self.__timers = _timers()
+        return self.__timers
+
+    @property
+    def pending(self):
+        '''有等待查询或等待提交的事件'''
+        return self.__pending is not None or self.__pending_submit is not None
+
+    def push(self, event, force=False):
+        '''记录鼠标事件，由定时器执行查询，返回是否会执行查询'''
+        # force: 鼠标没有移动也要查询，例如切换吸附类型后
+        event = MouseEvent(event.mouse_region_x, event.mouse_region_y)
+        if self.__pending is not None:
+            # 还没有执行的事件被新的事件取代
+            self.__pending = event
+            self.coalesced += 1
+            return True
+        if not force and self.__last_mouse is not None:
+            dx = event.mouse_region_x - self.__last_mouse[0]
+            dy = event.mouse_region_y - self.__last_mouse[1]
+            if dx * dx + dy * dy < self.pixels * self.pixels:
+                self.skipped += 1
+                return False
+        self.__pending = event
+        if not self.__scheduled:
+            self.__scheduled = True
+            self.timers.register(self.__tick_fn, first_interval=self.__next_delay())
+        else:
+            # 定时器在等待提交，查询仍按间隔执行
+            self.__next_delay()
+        return True
+
+    def frame(self):
+        '''视图重绘时调用，记录重绘间隔'''
+        now = self.__clock()
+        if self.__last_frame is not None:
+            interval = now - self.__last_frame
+            # 停止重绘后的空闲时间不计入
+            if interval <= self.max_delay:
+                self.frame_interval += (interval - self.frame_interval) * EMA_ALPHA
+        self.__last_frame = now
+
+    def __next_delay(self):
+        '''离下一次可以查询的时间'''
+        # 两次查询至少相隔 查询耗时 * COST_FACTOR 与 重绘间隔 中较大的一个，
+        # 短于重绘间隔的查询结果不会被看到
+        if self.__last_start is None:
+            delay = self.min_delay
+        else:
+            interval = max(self.cost * COST_FACTOR, self.frame_interval)
+            delay = interval - (self.__clock() - self.__last_start)
+        self.delay = min(max(delay, self.min_delay), self.max_delay)
+        self.__due = self.__clock() + self.delay
+        return self.delay
+
+    def __tick(self):
+        '''定时器回调，返回下一次回调的间隔，None 为停止'''
+        if self.__pending is None and self.__pending_submit is None:
+            self.__scheduled = False
+            return None
+        if self.__running:
+            # 不同时执行两次查询
+            return BUSY_INTERVAL
+        try:
+            # 等待提交时也按查询的间隔执行查询，定时器的误差不超过 BUSY_INTERVAL
+            if self.__pending is not None and self.__clock() >= self.__due - BUSY_INTERVAL:
+                self.__run(self.__pending)
+            if self.__pending_submit is not None:
+                if self.__busy is not None and self.__busy():
+                    # 上一次的提取还没有完成，之后提交最新的事件
+                    self.deferred += 1
+                else:
+                    event = self.__pending_submit
+                    self.__pending_submit = None
+                    self.__submit(event)
+        except Exception:
+            # 回调出错后 bpy.app.timers 会注销定时器
+            self.__scheduled = False
+            raise
+        if self.__pending_submit is not None:
+            if self.__pending is not None:
+                return min(max(self.__due - self.__clock(), 0.0), BUSY_INTERVAL)
+            return BUSY_INTERVAL
+        if self.__pending is not None:
+            return self.__next_delay()
+        self.__scheduled = False
+        return None
+
+    def __run(self, event):
+        self.__pending = None
+        if self.__submit is not None:
+            self.__pending_submit = event
+        self.__running = True
+        start = self.__clock()
+        try:
+            self.__query(event)
+        finally:
+            self.__running = False
+            cost = self.__clock() - start
+            # 第一次直接使用测得的耗时
+            self.cost += (cost - self.cost) * (EMA_ALPHA if self.issued else 1.0)
+            self.__last_start = start
+            self.__last_mouse = (event.mouse_region_x, event.mouse_region_y)
+            self.issued += 1
+
+    def cancel(self):
+        '''丢弃等待中的事件并注销定时器，退出时调用'''
+        self.__pending = None
+        self.__pending_submit = None
+        self.__cancel_timer()
+        self.__scheduled = False
+
+    def __cancel_timer(self):
+        if self.__scheduled and self.timers.is_registered(self.__tick_fn):
+            self.timers.unregister(self.__tick_fn)
+
+    def stats(self):
+        return {
+            "issued": self.issued,
+            "coalesced": self.coalesced,
+            "skipped": self.skipped,
+            "deferred": self.deferred,
+            "cost_ms": self.cost * 1000.0,
+            "frame_ms": self.frame_interval * 1000.0,
+            "delay_ms": self.delay * 1000.0,
+        }
+
+    def summary(self):
+        '''一行文字，显示在耗时统计中'''
+        return "queries %d  coalesced %d  skipped %d  deferred %d  cost %.1fms  delay %.1fms" % (
+                self.issued, self.coalesced, self.skipped, self.deferred,
+                self.cost * 1000.0, self.delay * 1000.0)
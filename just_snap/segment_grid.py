@@ -0,0 +1,149 @@
+import numpy as np
+
+# 屏幕空间的线段索引 (均匀网格)
+# 与 SnapIndex 相同，每次加入一批线段只为它单独建表，查询时合并各批的结果
+# 每批把线段按包围盒覆盖的格子展开，按格子编号排序，查询时只检查圆覆盖到的格子
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 格子边长 (像素)
+CELL_SIZE = 32
+
+
+class SegmentGrid:
+    def __init__(self, width, height, cell=CELL_SIZE):
+        # width, height: 屏幕尺寸，超出屏幕的部分截到边缘的格子
+        self.cell = cell
+        self.cols = max(1, int(np.ceil(width / cell)))
+        self.rows = max(1, int(np.ceil(height / cell)))
+        # key: (a, b, ids, cells, segs, (x0, y0, x1, y1))
+        #   cells: 排序后的格子编号，segs: 对应的线段
+        self.__blocks = {}
+
+    def __len__(self):
+        return sum(len(block[2]) for block in self.__blocks.values())
+
+    def __contains__(self, key):
+        return key in self.__blocks
+
+    def keys(self):
+        return self.__blocks.keys()
+
+    def insert(self, key, a, b, ids):
+        '''加入一批线段，key 已存在时替换'''
+        # a, b: 线段两端的屏幕座标 (N, 2)，含 nan 的线段不加入
+        # ids:  与线段对应的编号
+        a = np.asarray(a, dtype=np.float64).reshape(-1, 2)
+        b = np.asarray(b, dtype=np.float64).reshape(-1, 2)
+        ids = np.asarray(ids, dtype=np.int64)
+        ok = np.isfinite(a[:, 0]) & np.isfinite(a[:, 1]) & np.isfinite(b[:, 0]) & np.isfinite(b[:, 1])
+        if not ok.all():
+            a = a[ok]
+            b = b[ok]
+            ids = ids[ok]
+        if len(ids) == 0:
+            self.remove(key)
+            return
+
+        # 线段包围盒覆盖的格子
+        ax, ay, bx, by = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+        cx0 = self.__clip(np.minimum(ax, bx), self.cols)
+        cx1 = self.__clip(np.maximum(ax, bx), self.cols)
+        cy0 = self.__clip(np.minimum(ay, by), self.rows)
+        cy1 = self.__clip(np.maximum(ay, by), self.rows)
+        nx = cx1 - cx0 + 1
+        counts = nx * (cy1 - cy0 + 1)
+        if (counts == 1).all():
+            # 大部分线段只在一个格子内
+            segs = np.arange(len(ids))
+            cells = cy0 * self.cols + cx0
+        else:
+            segs = np.repeat(np.arange(len(ids)), counts)
+            off = np.arange(len(segs)) - np.repeat(np.cumsum(counts) - counts, counts)
+            w = nx[segs]
+            cells = (cy0[segs] + off // w) * self.cols + cx0[segs] + off % w
+        order = np.argsort(cells, kind="stable")
+        bounds = (
+            float(np.minimum(ax, bx).min()),
+            float(np.minimum(ay, by).min()),
+            float(np.maximum(ax, bx).max()),
+            float(np.maximum(ay, by).max()),
+        )
+        self.__blocks[key] = (a, b, ids, cells[order], segs[order], bounds)
+
+    def __clip(self, v, size):
+        return np.clip(np.floor(v / self.cell), 0, size - 1).astype(np.int64)
+
+    def remove(self, key):
+        self.__blocks.pop(key, None)
+
+    def discard(self, key, ids):
+        '''从一批线段中删除编号为 ids 的线段'''
+        block = self.__blocks.get(key)
+        if block is None:
+            return
+        a, b, block_ids = block[:3]
+        keep = ~np.isin(block_ids, ids)
+        if not keep.all():
+            self.insert(key, a[keep], b[keep], block_ids[keep])
+
+    def clear(self):
+        self.__blocks.clear()
+
+    def nearest(self, co, radius, k=1):
+        '''离 co 最近的 k 条线段，返回 [(dist, key, id, t), ...] 按距离排序'''
+        # t: 最近点在线段上的参数，0 为 a 端，1 为 b 端 (屏幕空间)
+        # 从一个格子的半径开始，找不到 k 条时加倍，密集的网格只需要检查鼠标附近的格子
+        r = min(self.cell, radius)
+        while True:
+            rs = self.__nearest(float(co[0]), float(co[1]), r, k)
+            if len(rs) >= k or r >= radius:
+                return rs
+            r = min(r * 2, radius)
+
+    def __nearest(self, x, y, radius, k):
+        qx = np.arange(max(0, int((x - radius) // self.cell)),
+                min(self.cols - 1, int((x + radius) // self.cell)) + 1)
+        qy = np.arange(max(0, int((y - radius) // self.cell)),
+                min(self.rows - 1, int((y + radius) // self.cell)) + 1)
+        if len(qx) == 0 or len(qy) == 0:
+            return []
+        query = (qy[:, None] * self.cols + qx[None, :]).ravel()
+        rs = []
+        for key, (a, b, ids, cells, segs, (x0, y0, x1, y1)) in self.__blocks.items():
+            # 这批线段的边界离查询点太远则跳过
+            dx = max(x0 - x, 0, x - x1)
+            dy = max(y0 - y, 0, y - y1)
+            if dx * dx + dy * dy > radius * radius:
+                continue
+            lo = np.searchsorted(cells, query, side="left")
+            hi = np.searchsorted(cells, query, side="right")
+            keep = hi > lo
+            if not keep.any():
+                continue
+            found = np.concatenate([segs[s:e] for s, e in zip(lo[keep], hi[keep])])
+            found = np.unique(found)
+            dist, t = _point_segment(x, y, a[found], b[found])
+            near = dist <= radius
+            if not near.any():
+                continue
+            found, dist, t = found[near], dist[near], t[near]
+            if len(found) > k:
+                part = np.argpartition(dist, k - 1)[:k]
+                found, dist, t = found[part], dist[part], t[part]
+            for i, d, u in zip(ids[found].tolist(), dist.tolist(), t.tolist()):
+                rs.append((d, key, i, u))
+        rs.sort(key=lambda item: item[0])
+        return rs[:k]
+
+
+def _point_segment(x, y, a, b):
+    '''点到线段的距离与最近点的参数'''
+    ax, ay = a[:, 0], a[:, 1]
+    dx = b[:, 0] - ax
+    dy = b[:, 1] - ay
+    length2 = dx * dx + dy * dy
+    t = ((x - ax) * dx + (y - ay) * dy) / np.where(length2 > 0, length2, 1.0)
+    t = np.clip(t, 0.0, 1.0)
+    px = ax + t * dx - x
+    py = ay + t * dy - y
+    return np.sqrt(px * px + py * py), t
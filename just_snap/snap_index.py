@@ -0,0 +1,85 @@
+from mathutils import kdtree
+
+# 屏幕空间的吸附点索引
+# 每次加入物体只为它单独建一棵子树，查询时合并各子树的结果，
+# 避免每加入一个物体就重建整棵 kdtree
+# 子树可以带标签 (例如吸附类型)，各类型共用一个索引，
+# 既可以只查询某些标签，也可以一次查询全部
+
+
+class SnapIndex:
+    def __init__(self):
+        # key: (kd, (x0, y0, x1, y1), size, tag)
+        self.__trees = {}
+
+    def __len__(self):
+        return sum(item[2] for item in self.__trees.values())
+
+    def size(self, tags=None):
+        '''带有 tags 中标签的点数，tags 为 None 时为全部'''
+        if tags is None:
+            return len(self)
+        return sum(item[2] for item in self.__trees.values() if item[3] in tags)
+
+    def __contains__(self, key):
+        return key in self.__trees
+
+    def keys(self):
+        return self.__trees.keys()
+
+    def insert(self, key, coords, ids=None, tag=None):
+        '''加入一棵子树，key 已存在时替换'''
+        # coords: [(x, y), ...] 屏幕座标
+        # ids:    与 coords 对应的下标，默认为 0..n-1
+        # tag:    子树的标签，查询时用于筛选
+        size = len(coords)
+        if size == 0:
+            self.remove(key)
+            return
+        if ids is None:
+            ids = range(size)
+        kd = kdtree.KDTree(size)
+        insert = kd.insert
+        x0 = y0 = float("inf")
+        x1 = y1 = float("-inf")
+        for (x, y), i in zip(coords, ids):
+            insert((x, y, 0), int(i))
+            if x < x0: x0 = x
+            if x > x1: x1 = x
+            if y < y0: y0 = y
+            if y > y1: y1 = y
+        kd.balance()
+        self.__trees[key] = (kd, (x0, y0, x1, y1), size, tag)
+
+    def remove(self, key):
+        self.__trees.pop(key, None)
+
+    def clear(self, tags=None):
+        '''删除带有 tags 中标签的子树，tags 为 None 时全部删除'''
+        if tags is None:
+            self.__trees.clear()
+            return
+        for key in [key for key, item in self.__trees.items() if item[3] in tags]:
+            del self.__trees[key]
+
+    def find_range(self, co, radius, tags=None):
+        '''与 KDTree.find_range 相同，返回 [(co, index, dist), ...]'''
+        # tags: 只查询带有这些标签的子树，None 为全部
+        return [item[:3] for item in self.find_range_tagged(co, radius, tags)]
+
+    def find_range_tagged(self, co, radius, tags=None):
+        '''同 find_range，返回 [(co, index, dist, tag), ...]'''
+        x, y = co[0], co[1]
+        rs = []
+        for kd, (x0, y0, x1, y1), _, tag in self.__trees.values():
+            if tags is not None and tag not in tags:
+                continue
+            # 子树的边界离查询点太远则跳过
+            dx = max(x0 - x, 0, x - x1)
+            dy = max(y0 - y, 0, y - y1)
+            if dx * dx + dy * dy > radius * radius:
+                continue
+            for co, index, dist in kd.find_range((x, y, 0), radius):
+                rs.append((co, index, dist, tag))
+        return rs
+
@@ -0,0 +1,115 @@
+import json
+import time
+from collections import namedtuple
+import numpy as np
+
+# 记录吸附查询的输入，用于在 blender 后台重放 (benchmarks/replay_trace.py)
+# 同一视图的多个事件共用一份视图数据，以 numpy 的压缩格式 (.npz) 保存
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 格式版本，读取时检查
+VERSION = 1
+
+# 一次查询的输入
+#   time:      离开始记录的时间 (秒)
+#   width, height: region 尺寸
+#   view_matrix, perspective_matrix: (4, 4)
+#   view_distance, is_persp
+#   mouse:     鼠标屏幕座标 (x, y)
+#   snap_type: 吸附类型
+#   xray:      是否为透视模式
+TraceEvent = namedtuple("TraceEvent", ("time", "width", "height", "view_matrix",
+        "perspective_matrix", "view_distance", "is_persp", "mouse", "snap_type", "xray"))
+
+
+class TraceRecorder:
+    def __init__(self, clock=time.perf_counter):
+        self.__clock = clock
+        self.__start = None
+        # 不同的视图 (width, height, view_matrix, perspective_matrix, view_distance, is_persp)
+        self.__views = []
+        self.__view_ids = {}
+        self.__snap_types = []
+        # 每个事件: (time, 视图编号, x, y, 吸附类型编号, xray)
+        self.__events = []
+
+    def __len__(self):
+        return len(self.__events)
+
+    def record(self, width, height, view_matrix, perspective_matrix, view_distance,
+            is_persp, mouse, snap_type, xray):
+        now = self.__clock()
+        if self.__start is None:
+            self.__start = now
+        view_matrix = np.asarray(view_matrix, dtype=np.float64).reshape(4, 4)
+        perspective_matrix = np.asarray(perspective_matrix, dtype=np.float64).reshape(4, 4)
+        key = (int(width), int(height), view_matrix.tobytes(), perspective_matrix.tobytes(),
+                float(view_distance), bool(is_persp))
+        view = self.__view_ids.get(key)
+        if view is None:
+            view = self.__view_ids[key] = len(self.__views)
+            self.__views.append((key[0], key[1], view_matrix, perspective_matrix, key[4], key[5]))
+        if snap_type not in self.__snap_types:
+            self.__snap_types.append(snap_type)
+        self.__events.append((now - self.__start, view, int(mouse[0]), int(mouse[1]),
+                self.__snap_types.index(snap_type), bool(xray)))
+
+    def clear(self):
+        self.__start = None
+        self.__views = []
+        self.__view_ids = {}
+        self.__snap_types = []
+        self.__events = []
+
+    def save(self, path, meta=None):
+        '''保存为 .npz，meta 为附加信息 (例如 .blend 文件路径)，需要能转为 json'''
+        events = self.__events
+        views = self.__views
+        with open(path, "wb") as f:
+            np.savez_compressed(
+                f,
+                version=np.array(VERSION),
+                meta=np.array(json.dumps(meta or {})),
+                time=np.array([e[0] for e in events], dtype=np.float64),
+                view=np.array([e[1] for e in events], dtype=np.int32),
+                mouse=np.array([e[2:4] for e in events], dtype=np.int32).reshape(-1, 2),
+                snap_type=np.array([e[4] for e in events], dtype=np.int8),
+                xray=np.array([e[5] for e in events], dtype=bool),
+                snap_types=np.array(self.__snap_types, dtype=str),
+                region=np.array([v[:2] for v in views], dtype=np.int32).reshape(-1, 2),
+                view_matrix=np.array([v[2] for v in views], dtype=np.float64).reshape(-1, 4, 4),
+                perspective_matrix=np.array([v[3] for v in views], dtype=np.float64).reshape(-1, 4, 4),
+                view_distance=np.array([v[4] for v in views], dtype=np.float64),
+                is_persp=np.array([v[5] for v in views], dtype=bool),
+            )
+
+
+def load(path):
+    '''读取 TraceRecorder.save 保存的文件，返回 (meta, [TraceEvent, ...])'''
+    with np.load(path) as data:
+        version = int(data["version"])
+        if version != VERSION:
+            raise ValueError("unsupported trace version %d" % version)
+        meta = json.loads(str(data["meta"]))
+        region = data["region"]
+        view_matrix = data["view_matrix"]
+        perspective_matrix = data["perspective_matrix"]
+        view_distance = data["view_distance"]
+        is_persp = data["is_persp"]
+        snap_types = [str(s) for s in data["snap_types"]]
+        events = []
+        for t, v, mouse, s, xray in zip(data["time"].tolist(), data["view"].tolist(),
+                data["mouse"].tolist(), data["snap_type"].tolist(), data["xray"].tolist()):
+            events.append(TraceEvent(
+                t,
+                int(region[v, 0]),
+                int(region[v, 1]),
+                view_matrix[v],
+                perspective_matrix[v],
+                float(view_distance[v]),
+                bool(is_persp[v]),
+                (mouse[0], mouse[1]),
+                snap_types[s],
+                xray,
+            ))
+    return meta, events
@@ -0,0 +1,269 @@
+import numpy as np
+
+# 软件深度缓冲，一次性判断所有候选点的遮挡
+# 不依赖 bpy，可以在 blender 之外运行
+
+# 每批光栅化的最大采样数，避免大三角形占用过多内存
+MAX_SAMPLES = 1 << 21
+# 包围盒像素数不超过此值的三角形逐像素判断，否则按行求区间
+SMALL_TRI = 16
+# 判断遮挡时按表面深度梯度的容差 (缓冲像素数)，见 DepthBuffer.test
+SLOPE_BIAS = 0.25
+# 周围的 8 个像素
+NEIGHBORS = ((-1, -1), (0, -1), (1, -1), (-1, 0), (1, 0), (-1, 1), (0, 1), (1, 1))
+
+
+class DepthBuffer:
+    '''屏幕空间的最小深度缓冲'''
+    # scale: 缓冲分辨率相对 region 的比例，0.5 即半分辨率
+    # 每个像素除了像素中心的深度，还保存最前面的三角形的深度平面在屏幕上的梯度，
+    # 判断遮挡时按梯度求出候选点所在位置 (而不是像素中心) 的表面深度
+    # rect:  只覆盖 region 中的矩形 (x0, y0, x1, y1)，通常为物体在屏幕上的包围矩形，
+    #        矩形外的点视为没有被遮挡；None 为整个 region
+    def __init__(self, width, height, scale=0.5, is_persp=True, rect=None):
+        self.scale = scale
+        self.is_persp = is_persp
+        full_w = max(1, int(np.ceil(width * scale)))
+        full_h = max(1, int(np.ceil(height * scale)))
+        if rect is None:
+            rect = (0, 0, width, height)
+        x0 = min(max(int(np.floor(rect[0] * scale)), 0), full_w - 1)
+        y0 = min(max(int(np.floor(rect[1] * scale)), 0), full_h - 1)
+        # 缓冲左下角在整个 region 缓冲中的像素座标
+        self.origin = np.array((x0, y0), dtype=np.float64)
+        self.width = max(1, min(int(np.ceil(rect[2] * scale)), full_w) - x0)
+        self.height = max(1, min(int(np.ceil(rect[3] * scale)), full_h) - y0)
+        self.buffer = np.full(self.width * self.height, np.inf, dtype=np.float64)
+        # 深度平面 f 对缓冲像素座标的偏导，透视下 f 为 1/深度
+        self.grad_x = np.zeros(self.width * self.height, dtype=np.float32)
+        self.grad_y = np.zeros(self.width * self.height, dtype=np.float32)
+
+    def rasterize(self, s2d, depth, tris, valid=None):
+        '''光栅化三角形'''
+        # s2d:   顶点屏幕座标 (N, 2)
+        # depth: 顶点深度 (N,)
+        # tris:  三角形顶点下标 (T, 3)
+        # valid: 顶点是否可用 (N,)，在相机后面的顶点不可用
+        if len(tris) == 0:
+            return
+        if valid is None:
+            valid = depth > 0 if self.is_persp else np.ones(len(depth), dtype=bool)
+        t0 = tris[:, 0]
+        t1 = tris[:, 1]
+        t2 = tris[:, 2]
+        keep = valid[t0] & valid[t1] & valid[t2]
+        if not keep.all():
+            t0 = t0[keep]
+            t1 = t1[keep]
+            t2 = t2[keep]
+        if len(t0) == 0:
+            return
+
+        # 三角形的三个顶点，按分量分开储存，避免在小维度上 reduce
+        p = self.to_buffer(s2d)
+        ax, ay = p[t0, 0], p[t0, 1]
+        bx, by = p[t1, 0], p[t1, 1]
+        cx, cy = p[t2, 0], p[t2, 1]
+
+        # 以像素中心采样
+        x0 = np.ceil(np.minimum(np.minimum(ax, bx), cx) - 0.5).astype(np.int64)
+        x1 = np.floor(np.maximum(np.maximum(ax, bx), cx) - 0.5).astype(np.int64)
+        y0 = np.ceil(np.minimum(np.minimum(ay, by), cy) - 0.5).astype(np.int64)
+        y1 = np.floor(np.maximum(np.maximum(ay, by), cy) - 0.5).astype(np.int64)
+        np.maximum(x0, 0, out=x0)
+        np.maximum(y0, 0, out=y0)
+        np.minimum(x1, self.width - 1, out=x1)
+        np.minimum(y1, self.height - 1, out=y1)
+        nx = x1 - x0 + 1
+        ny = y1 - y0 + 1
+
+        area = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+        keep = (nx > 0) & (ny > 0) & (np.abs(area) > 1e-12)
+        if not keep.any():
+            return
+
+        # 深度在屏幕空间的平面方程 f = A * x + B * y + C
+        # 透视下 1/z 在屏幕空间线性
+        za, zb, zc = depth[t0], depth[t1], depth[t2]
+        if self.is_persp:
+            za, zb, zc = 1.0 / za, 1.0 / zb, 1.0 / zc
+        inv_area = 1.0 / np.where(keep, area, 1.0)
+        dzb = zb - za
+        dzc = zc - za
+        A = (dzb * (cy - ay) - dzc * (by - ay)) * inv_area
+        B = (dzc * (bx - ax) - dzb * (cx - ax)) * inv_area
+        C = za - A * ax - B * ay
+        edges = (
+            (ax, ay, bx, by),
+            (bx, by, cx, cy),
+            (cx, cy, ax, ay),
+        )
+        plane = (A, B, C)
+
+        # 小三角形直接在包围盒内逐像素判断，大三角形按行求区间
+        counts = nx * ny
+        small = keep & (counts <= SMALL_TRI)
+        for idx, batch in (
+                (np.flatnonzero(small), self.__rasterize_small),
+                (np.flatnonzero(keep & ~small), self.__rasterize_rows)):
+            # 分批，每批采样数不超过 MAX_SAMPLES
+            ends = np.cumsum(counts[idx])
+            start = 0
+            while start < len(idx):
+                base = ends[start - 1] if start > 0 else 0
+                end = int(np.searchsorted(ends, base + MAX_SAMPLES, side="right"))
+                end = max(end, start + 1)
+                batch(idx[start:end], x0, y0, nx, ny, edges, plane)
+                start = end
+
+    def __rasterize_small(self, idx, x0, y0, nx, ny, edges, plane):
+        # 按包围盒尺寸分组，每组用固定的像素偏移广播，避免逐像素展开
+        shape = nx[idx] * (SMALL_TRI + 1) + ny[idx]
+        order = np.argsort(shape, kind="stable")
+        idx = idx[order]
+        shape = shape[order]
+        bounds = np.flatnonzero(np.diff(shape)) + 1
+        funcs = self.__edge_functions(edges, idx)
+        for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(idx)]):
+            w, h = divmod(int(shape[start]), SMALL_TRI + 1)
+            dy, dx = np.divmod(np.arange(w * h), w)
+            tri = idx[start:end, None]
+            px = x0[tri] + dx
+            py = y0[tri] + dy
+            sx = px + 0.5
+            sy = py + 0.5
+            # 边函数 e = a * x + b * y + c，按三角形朝向统一符号后三条边都 >= 0 即在三角形内
+            inside = np.ones(px.shape, dtype=bool)
+            for ea, eb, ec in funcs:
+                ea, eb, ec = ea[start:end, None], eb[start:end, None], ec[start:end, None]
+                inside &= ea * sx + eb * sy + ec >= 0
+            if inside.any():
+                tri = np.broadcast_to(tri, px.shape)
+                self.__write(px[inside], py[inside], tri[inside], plane)
+
+    def __rasterize_rows(self, idx, x0, y0, nx, ny, edges, plane):
+        # 按行展开，求每行在三角形内的像素区间
+        rows = ny[idx]
+        tri = np.repeat(idx, rows)
+        py = y0[tri] + np.arange(len(tri)) - np.repeat(np.cumsum(rows) - rows, rows)
+        sy = py + 0.5
+        xl = np.full(len(tri), np.inf)
+        xr = np.full(len(tri), -np.inf)
+        for px, pyy, qx, qy in edges:
+            p0x, p0y, p1x, p1y = px[tri], pyy[tri], qx[tri], qy[tri]
+            dy = p1y - p0y
+            flat = dy == 0
+            t = (sy - p0y) / np.where(flat, 1.0, dy)
+            ok = ~flat & (t >= 0.0) & (t <= 1.0)
+            x = p0x + t * (p1x - p0x)
+            xl = np.where(ok, np.minimum(xl, x), xl)
+            xr = np.where(ok, np.maximum(xr, x), xr)
+        x0 = np.maximum(np.ceil(xl - 0.5), 0)
+        x1 = np.minimum(np.floor(xr - 0.5), self.width - 1)
+        keep = x1 >= x0
+        if not keep.any():
+            return
+        tri = tri[keep]
+        py = py[keep]
+        x0 = x0[keep].astype(np.int64)
+        counts = x1[keep].astype(np.int64) - x0 + 1
+
+        # 按像素展开
+        row = np.repeat(np.arange(len(tri)), counts)
+        px = x0[row] + np.arange(len(row)) - np.repeat(np.cumsum(counts) - counts, counts)
+        py = py[row]
+        tri = tri[row]
+        self.__write(px, py, tri, plane)
+
+    @staticmethod
+    def __edge_functions(edges, idx):
+        (ax, ay, bx, by), (_, _, cx, cy), _ = edges
+        ax, ay, bx, by, cx, cy = ax[idx], ay[idx], bx[idx], by[idx], cx[idx], cy[idx]
+        sign = np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+        rs = []
+        for p0x, p0y, p1x, p1y in ((ax, ay, bx, by), (bx, by, cx, cy), (cx, cy, ax, ay)):
+            ea = (p0y - p1y) * sign
+            eb = (p1x - p0x) * sign
+            rs.append((ea, eb, -(ea * p0x + eb * p0y)))
+        return rs
+
+    def __write(self, px, py, tri, plane):
+        A, B, C = plane
+        d = A[tri] * (px + 0.5) + B[tri] * (py + 0.5) + C[tri]
+        if self.is_persp:
+            d = 1.0 / d
+        pix = py * self.width + px
+        np.minimum.at(self.buffer, pix, d)
+        # 写入了最小深度的三角形，同时记录它的深度梯度
+        win = d == self.buffer[pix]
+        pix = pix[win]
+        tri = tri[win]
+        self.grad_x[pix] = A[tri]
+        self.grad_y[pix] = B[tri]
+
+    def to_buffer(self, s2d):
+        '''屏幕座标转换为缓冲的像素座标'''
+        return np.asarray(s2d, dtype=np.float64) * self.scale - self.origin
+
+    def sample(self, s2d):
+        '''取得屏幕座标处的缓冲深度，缓冲外为 inf'''
+        p = np.floor(self.to_buffer(s2d)).astype(np.int64)
+        x = p[:, 0]
+        y = p[:, 1]
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        rs = np.full(len(p), np.inf, dtype=np.float64)
+        rs[inside] = self.buffer[y[inside] * self.width + x[inside]]
+        return rs
+
+    def surface_depth(self, s2d, x, y):
+        '''缓冲像素 (x, y) 中最前面的表面的平面外推到屏幕座标 s2d 处的深度'''
+        # return (深度, 深度每缓冲像素的变化量)，像素在缓冲外或没有表面时深度为 inf
+        p = self.to_buffer(s2d)
+        rs = np.full(len(p), np.inf, dtype=np.float64)
+        slope = np.zeros(len(p), dtype=np.float64)
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        idx = np.flatnonzero(inside)
+        pix = y[idx] * self.width + x[idx]
+        d = self.buffer[pix]
+        covered = np.isfinite(d)
+        idx = idx[covered]
+        pix = pix[covered]
+        d = d[covered]
+        # 离像素中心的偏移
+        dx = p[idx, 0] - (x[idx] + 0.5)
+        dy = p[idx, 1] - (y[idx] + 0.5)
+        gx = self.grad_x[pix]
+        gy = self.grad_y[pix]
+        g = np.abs(gx) + np.abs(gy)
+        if self.is_persp:
+            # d(深度) = -深度^2 * d(1/深度)
+            g = g * d * d
+            f = 1.0 / d + gx * dx + gy * dy
+            d = np.where(f > 0, 1.0 / np.where(f > 0, f, 1.0), np.inf)
+        else:
+            d = d + gx * dx + gy * dy
+        rs[idx] = d
+        slope[idx] = g
+        return rs, slope
+
+    def test(self, s2d, depth, bias=0.0, slope_bias=SLOPE_BIAS):
+        '''候选点是否未被遮挡'''
+        # 候选点本身就在表面上，与外推的表面深度只有很小的误差:
+        #   bias:       固定的容差 (世界空间长度)
+        #   slope_bias: 按表面深度梯度的容差 (缓冲像素数)，
+        #               像素中记录的可能是相邻的三角形，外推的误差与梯度成正比
+        # 候选点所在像素的中心没有被覆盖时 (靠近轮廓)，改用周围 8 个像素
+        p = self.to_buffer(s2d)
+        x = np.floor(p[:, 0]).astype(np.int64)
+        y = np.floor(p[:, 1]).astype(np.int64)
+        surface, slope = self.surface_depth(s2d, x, y)
+        limit = surface + bias + slope_bias * slope
+        edge = np.flatnonzero(np.isinf(surface))
+        if len(edge):
+            s2d = np.asarray(s2d)[edge]
+            x = x[edge]
+            y = y[edge]
+            for dx, dy in NEIGHBORS:
+                surface, slope = self.surface_depth(s2d, x + dx, y + dy)
+                limit[edge] = np.minimum(limit[edge], surface + bias + slope_bias * slope)
+        return depth <= limit
@@ -0,0 +1,25 @@
+import importlib
+import os
+import sys
+import types
+
+# 只测试不依赖 bpy 的部分
+# blender 之外不执行 just_snap 包的 __init__ (依赖 bpy)，与 benchmarks/bench_snap.py 相同
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 合成网格与视图 (benchmarks/synthetic.py)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+if bpy is None and "just_snap" not in sys.modules:
+    pkg = types.ModuleType("just_snap")
+    pkg.__path__ = [os.path.join(ROOT, "just_snap")]
+    sys.modules["just_snap"] = pkg
+elif ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+importlib.import_module("just_snap")
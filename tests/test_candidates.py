@@ -0,0 +1,51 @@
+import numpy as np
+
+from just_snap.candidates import CandidateTable
+
+
+def _points(n, x=0.0):
+    s2d = np.column_stack((np.arange(n) + x, np.zeros(n)))
+    w3d = np.column_stack((s2d, np.zeros(n)))
+    return s2d, np.ones(n), w3d, np.arange(n)
+
+def test_append_object_name():
+    table = CandidateTable()
+    rows = table.append("Cube", *_points(3))
+    assert rows.tolist() == [0, 1, 2]
+    assert table.names == ["Cube"]
+    assert table.obj.tolist() == [0, 0, 0]
+
+def test_append_instance_name():
+    # 集合实例、粒子实例的名称为 (实例化物体名称, persistent_id)
+    table = CandidateTable()
+    table.append("Cube", *_points(2))
+    name = ("Empty", (3, 0, 0))
+    rows = table.append(name, *_points(3, x=10.0))
+    assert rows.tolist() == [2, 3, 4]
+    assert table.names == ["Cube", name]
+    assert [table.names[i] for i in table.obj[rows]] == [name] * 3
+    # 同一实例再次加入时使用同一编号
+    rows = table.append(("Empty", (3, 0, 0)), *_points(1, x=20.0))
+    assert table.obj[rows].tolist() == [1]
+    assert len(table.names) == 2
+
+def test_append_object_ids():
+    table = CandidateTable()
+    ids = np.array([table.name_id("A"), table.name_id(("B", (0,)))], dtype=np.int32)
+    table.append(ids, *_points(2))
+    assert table.obj.tolist() == [0, 1]
+
+def test_grow_keeps_rows():
+    table = CandidateTable(capacity=2)
+    table.append("A", *_points(2))
+    table.append("B", *_points(5, x=2.0))
+    assert len(table) == 7
+    assert table.s2d[:, 0].tolist() == list(range(7))
+    assert table.obj.tolist() == [0, 0, 1, 1, 1, 1, 1]
+
+def test_resolve_keeps_front_point_per_pixel():
+    table = CandidateTable()
+    s2d = np.array([[1.2, 1.2], [1.7, 1.4], [5.0, 5.0]])
+    depth = np.array([3.0, 2.0, 1.0])
+    table.append("A", s2d, depth, np.zeros((3, 3)), np.arange(3))
+    assert table.resolve([0, 1, 2]).tolist() == [1, 2]
@@ -0,0 +1,88 @@
+import numpy as np
+
+from just_snap.overlay import OverlayBatch
+
+
+class StubShader:
+    def __init__(self):
+        self.calls = []
+
+    def bind(self):
+        self.calls.append(("bind",))
+
+    def uniform_float(self, name, value):
+        self.calls.append(("uniform_float", name, value))
+
+
+class StubBatch:
+    def __init__(self, shader, prim_type, content):
+        self.shader = shader
+        self.prim_type = prim_type
+        self.content = content
+        self.draws = 0
+
+    def draw(self, shader):
+        assert shader is self.shader
+        self.draws += 1
+
+
+def make_overlay(dim=2):
+    shader = StubShader()
+    batches = []
+
+    def factory(shader, prim_type, content):
+        batches.append(StubBatch(shader, prim_type, content))
+        return batches[-1]
+    return OverlayBatch('2D_UNIFORM_COLOR', dim=dim, shader=shader, batch_factory=factory), shader, batches
+
+def test_batch_contents():
+    overlay, shader, batches = make_overlay()
+    overlay.set_points([[1, 2], [3, 4]])
+    overlay.draw((0.0, 1.0, 0.0, 1.0))
+    assert len(batches) == 1
+    batch = batches[0]
+    assert batch.shader is shader
+    assert batch.prim_type == 'POINTS'
+    pos = batch.content["pos"]
+    assert pos.dtype == np.float32
+    assert pos.tolist() == [[1, 2], [3, 4]]
+    assert batch.draws == 1
+    assert shader.calls == [("bind",), ("uniform_float", "color", (0.0, 1.0, 0.0, 1.0))]
+
+def test_rebuild_only_on_change():
+    overlay, _, batches = make_overlay(dim=3)
+    co = np.arange(12, dtype=np.float64).reshape(4, 3)
+    assert overlay.set_points(co)
+    overlay.draw((1, 0, 0, 1))
+    # 同样的座标不重建
+    assert not overlay.set_points(co.copy())
+    overlay.draw((1, 0, 0, 1))
+    assert overlay.builds == 1
+    assert batches[0].draws == 2
+    co[0, 0] = -1
+    assert overlay.set_points(co)
+    overlay.draw((1, 0, 0, 1))
+    assert overlay.builds == 2
+    assert batches[1].content["pos"][0, 0] == -1
+
+def test_rebuild_by_key():
+    # 指定 key 时只比较 key，不读取座标
+    overlay, _, batches = make_overlay()
+    overlay.set_points([[0, 0]], key=(1, 0))
+    overlay.batch()
+    assert not overlay.set_points([[5, 5]], key=(1, 0))
+    overlay.batch()
+    assert overlay.builds == 1
+    assert overlay.set_points([[5, 5]], key=(1, 1))
+    assert overlay.batch() is batches[1]
+    assert batches[1].content["pos"].tolist() == [[5, 5]]
+
+def test_empty_draws_nothing():
+    overlay, shader, batches = make_overlay()
+    overlay.set_points([[1, 1]])
+    overlay.batch()
+    overlay.clear()
+    overlay.draw((1, 1, 1, 1))
+    assert overlay.batch() is None
+    assert len(batches) == 1
+    assert shader.calls == []
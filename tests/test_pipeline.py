@@ -0,0 +1,43 @@
+import time
+
+from just_snap.pipeline import SnapPipeline, SnapRequest
+
+
+def make_request(pipeline):
+    return SnapRequest(pipeline.next_generation(), (0, 0), None, "POINTS", False, (), None)
+
+def wait(pipeline, timeout=5.0):
+    deadline = time.perf_counter() + timeout
+    while pipeline.busy and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    return pipeline.poll()
+
+def test_failed_request_completes(capsys):
+    def compute(request, emit):
+        raise ValueError("broken mesh")
+    pipeline = SnapPipeline(compute, workers=1)
+    try:
+        request = make_request(pipeline)
+        pipeline.submit(request)
+        rs = wait(pipeline)
+    finally:
+        pipeline.shutdown()
+    # 出错的请求发布空结果，不会一直等待
+    assert rs == [(request, [])]
+    assert pipeline.errors == 1
+    assert not pipeline.busy
+    assert "ValueError: broken mesh" in capsys.readouterr().err
+
+def test_result_published():
+    def compute(request, emit):
+        emit(["chunk"])
+        return ["last"]
+    pipeline = SnapPipeline(compute, workers=1)
+    try:
+        request = make_request(pipeline)
+        pipeline.submit(request)
+        rs = wait(pipeline)
+    finally:
+        pipeline.shutdown()
+    assert rs == [(request, ["chunk"]), (request, ["last"])]
+    assert pipeline.errors == 0
@@ -0,0 +1,74 @@
+import numpy as np
+
+import synthetic
+from just_snap import projection
+from just_snap.prefetch import Prefetcher, SAMPLE_WINDOW
+from just_snap.rect_grid import RectGrid
+
+WIDTH = 1920
+HEIGHT = 1080
+
+
+def make_view(eye):
+    view_matrix, _, persp = synthetic.view(eye, width=WIDTH, height=HEIGHT)
+    return projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_prediction_stops_with_mouse():
+    # 鼠标停下后没有新的样本，空闲时的定时器不应继续沿原来的方向预先提取
+    clock = Clock()
+    prefetcher = Prefetcher(clock)
+    for i in range(5):
+        prefetcher.add_sample((100.0 + i * 10, 200.0))
+        clock.now += 0.01
+    assert np.allclose(prefetcher.velocity(), (1000.0, 0.0))
+    assert prefetcher.predict() is not None
+    clock.now += SAMPLE_WINDOW
+    for _ in range(3):
+        assert prefetcher.velocity().tolist() == [0.0, 0.0]
+        assert prefetcher.predict() is None
+        clock.now += 0.02
+
+def test_box_corners():
+    corners = projection.box_corners((0, 0, 0), (1, 2, 3))
+    assert corners.shape == (1, 8, 3)
+    assert {tuple(c) for c in corners[0]} == {
+        (x, y, z) for x in (0, 1) for y in (0, 2) for z in (0, 3)}
+
+def test_project_boxes():
+    view = make_view((0.0, -10.0, 0.0))
+    lo = np.array(((-1.0, -1.0, -1.0), (-1.0, -20.0, -1.0), (-1.0, -12.0, -1.0)))
+    hi = np.array(((1.0, 1.0, 1.0), (1.0, -11.0, 1.0), (1.0, -8.0, 1.0)))
+    rects, front = projection.project_boxes(projection.box_corners(lo, hi), view)
+    assert front.tolist() == [True, False, True]
+    # 相机前面的包围盒投影在屏幕中央
+    x0, y0, x1, y1 = rects[0]
+    assert x0 < WIDTH / 2 < x1 and y0 < HEIGHT / 2 < y1
+    s2d, _, _ = projection.project_points(projection.box_corners(lo[0], hi[0])[0], view)
+    assert np.allclose(rects[0], (*s2d.min(axis=0), *s2d.max(axis=0)))
+    # 跨过相机平面的包围盒占满整个屏幕
+    assert rects[2].tolist() == [0.0, 0.0, WIDTH, HEIGHT]
+
+def test_targets_skip_boxes_behind_camera():
+    view = make_view((0.0, -10.0, 0.0))
+    lo = np.array(((2.0, -1.0, -0.5), (2.0, -20.0, -0.5)))
+    hi = np.array(((3.0, 0.0, 0.5), (3.0, -19.0, 0.5)))
+    rects, front = projection.project_boxes(projection.box_corners(lo, hi), view)
+    segment = (np.array((WIDTH / 2, HEIGHT / 2)), np.array((WIDTH, HEIGHT / 2)))
+    idxs, t = Prefetcher().targets(segment, rects, front)
+    assert idxs.tolist() == [0]
+    assert 0 < t[0] < 1
+
+def test_rect_grid_query_rect():
+    grid = RectGrid(WIDTH, HEIGHT)
+    rects = np.array(((10, 10, 50, 50), (100, 10, 400, 300), (1000, 500, 1100, 600)), dtype=np.float64)
+    grid.build([0, 1, 2], rects)
+    assert grid.query_rect(40, 20, 120, 30).tolist() == [0, 1]
+    assert grid.query_rect(500, 400, 900, 450).tolist() == []
+    assert grid.query_rect(-100, -100, 5000, 5000).tolist() == [0, 1, 2]
@@ -0,0 +1,58 @@
+import numpy as np
+
+from just_snap import scene_index
+
+
+def make_index(names):
+    index = scene_index.get("Scene")
+    index.take_dirty()
+    n = len(names)
+    lo = np.arange(n * 3, dtype=np.float64).reshape(n, 3)
+    index.update(names, np.ones(n, dtype=bool), np.ones(n, dtype=bool), lo, lo + 1)
+    return index
+
+def setup_function():
+    scene_index.live = True
+    scene_index.clear()
+
+def teardown_function():
+    scene_index.live = False
+    scene_index.clear()
+
+def test_invalidate_marks_all_objects():
+    # 撤销、重做后全部物体都需要重新读取
+    index = make_index(["A", "B", ("C", (1,))])
+    index.take_dirty()
+    scene_index.invalidate()
+    rescan, dirty = index.take_dirty()
+    assert rescan
+    assert dirty == {"A", "B", ("C", (1,))}
+
+def test_clear_drops_indexes():
+    # 打开文件后重新建立索引
+    index = make_index(["A"])
+    scene_index.clear()
+    assert scene_index.get("Scene") is not index
+    assert len(scene_index.get("Scene")) == 0
+
+def test_scene_update_without_new_objects():
+    # 选择物体、移动 3D 游标也会更新场景，不需要检查全部物体
+    index = make_index(["A", "B"])
+    index.mark_updates([], counts=(2, 2))
+    index.take_dirty()
+    index.mark_updates(["A"], counts=(2, 2))
+    assert index.take_dirty() == (False, {"A"})
+
+def test_rescan_on_object_changes():
+    index = make_index(["A", "B"])
+    index.mark_updates([], counts=(2, 2))
+    index.take_dirty()
+    # 删除物体或排除集合
+    index.mark_updates([], counts=(1, 1))
+    assert index.take_dirty() == (True, set())
+    # 新增或重命名的物体
+    index.mark_updates(["C"])
+    assert index.take_dirty() == (True, {"C"})
+    # 集合的内容或可见性改变
+    index.mark_updates([], collections=True)
+    assert index.take_dirty()[0]
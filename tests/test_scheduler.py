@@ -0,0 +1,80 @@
+from just_snap.scheduler import SnapScheduler, MouseEvent
+
+
+class FakeTimers:
+    '''代替 bpy.app.timers，由测试手动触发'''
+    def __init__(self):
+        self.fn = None
+        self.interval = None
+
+    def register(self, fn, first_interval=0.0):
+        self.fn = fn
+        self.interval = first_interval
+
+    def unregister(self, fn):
+        self.fn = None
+
+    def is_registered(self, fn):
+        return self.fn is fn
+
+    def fire(self):
+        self.interval = self.fn()
+        if self.interval is None:
+            self.fn = None
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make(busy):
+    calls = []
+    timers = FakeTimers()
+    clock = Clock()
+    scheduler = SnapScheduler(
+        lambda event: calls.append(("query", tuple(event))),
+        submit=lambda event: calls.append(("submit", tuple(event))),
+        busy=lambda: busy[0], timers=timers, clock=clock)
+    return scheduler, timers, clock, calls
+
+def test_query_and_submit():
+    scheduler, timers, _, calls = make([False])
+    scheduler.push(MouseEvent(10, 10))
+    timers.fire()
+    assert calls == [("query", (10, 10)), ("submit", (10, 10))]
+    assert timers.fn is None
+
+def test_busy_defers_only_submit():
+    # 后台提取未完成时仍然在最新的鼠标位置查询
+    busy = [True]
+    scheduler, timers, clock, calls = make(busy)
+    scheduler.push(MouseEvent(10, 10))
+    timers.fire()
+    assert calls == [("query", (10, 10))]
+    assert scheduler.deferred == 1
+    for x in (20, 30):
+        clock.now += 0.05
+        scheduler.push(MouseEvent(x, 10))
+        timers.fire()
+    assert [c for c in calls if c[0] == "query"] == [
+        ("query", (10, 10)), ("query", (20, 10)), ("query", (30, 10))]
+    assert not any(c[0] == "submit" for c in calls)
+    # 提取完成后只提交最新的事件
+    busy[0] = False
+    clock.now += 0.05
+    timers.fire()
+    assert calls[-1] == ("submit", (30, 10))
+    assert [c for c in calls if c[0] == "submit"] == [("submit", (30, 10))]
+    assert timers.fn is None
+
+def test_cancel():
+    scheduler, timers, _, calls = make([True])
+    scheduler.push(MouseEvent(10, 10))
+    timers.fire()
+    scheduler.cancel()
+    assert not scheduler.pending
+    assert timers.fn is None
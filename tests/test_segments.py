@@ -0,0 +1,55 @@
+import numpy as np
+
+import synthetic
+from just_snap import extract, projection
+
+WIDTH = 1920
+HEIGHT = 1080
+
+
+def make_view(eye, target=(0.0, 0.0, 0.0)):
+    view_matrix, _, persp = synthetic.view(eye, target, width=WIDTH, height=HEIGHT)
+    return projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+
+def test_edge_through_screen():
+    # 边中点在屏幕外，边穿过屏幕
+    obj_data = synthetic.obj_data(synthetic.grid(1, 20.0))
+    view = make_view((9.0, 8.0, 3.0), (9.0, 8.0, 0.0))
+    co = obj_data["co"]
+    edge = np.flatnonzero((co[obj_data["edges"]][:, :, 0] == 10.0).all(axis=1))[0]
+    assert edge not in extract.get_idx_in_screen(obj_data, "EDGES", view)
+    data = extract.get_segment_data(obj_data, view, ignore_back=False)
+    assert data is not None and edge in data["idx"]
+
+def test_back_edges_hidden():
+    obj_data = synthetic.obj_data(synthetic.sphere(12))
+    eye = np.array((3.0, 2.0, 1.5))
+    view = make_view(eye)
+    data = extract.get_segment_data(obj_data, view)
+    found = np.zeros(len(obj_data["edges"]), dtype=bool)
+    found[data["idx"]] = True
+    # 两端都明显朝向/背向相机的边
+    cos = obj_data["co"][obj_data["edges"]] @ (eye / np.linalg.norm(eye))
+    back = cos.max(axis=1) < -0.2
+    front = cos.min(axis=1) > 0.5
+    assert back.any() and front.any()
+    assert not found[back].any()
+    assert found[front].all()
+
+def test_segments_keep_all_levels():
+    # LOD 只减少候选点，不减少线段
+    obj_data = synthetic.obj_data(synthetic.grid(60))
+    view = make_view((1.0, -2.0, 2.0))
+    mouse = (WIDTH / 2, HEIGHT / 2)
+    full = extract.get_segment_data(obj_data, view)["idx"]
+    mids = []
+    segs = []
+    for data in extract.iter_obj_data(obj_data, view, mouse, lod=2):
+        if data is None:
+            continue
+        if data["EDGES"] is not None:
+            mids.append(data["EDGES"]["idx"])
+        if data[extract.SEGMENTS] is not None:
+            segs.append(data[extract.SEGMENTS]["idx"])
+    assert len(np.concatenate(mids)) < len(full)
+    assert np.array_equal(np.sort(np.concatenate(segs)), np.sort(full))
@@ -0,0 +1,51 @@
+import types
+
+import pytest
+
+import synthetic
+
+# 只能在 blender 中运行: blender --background --python-expr "import pytest; pytest.main(['tests'])"
+bpy = pytest.importorskip("bpy")
+
+from bench_snap import FakeRV3D, fake_context, new_object, clear_scene
+from just_snap import trace
+
+
+def make_jsnap(tmp_path):
+    from just_snap import JustSnap
+    clear_scene()
+    new_object("grid", synthetic.grid(10))
+    bpy.context.view_layer.update()
+    view_matrix, _, persp = synthetic.view((0.0, -2.5, 2.0))
+    ctx = fake_context(FakeRV3D(view_matrix, persp))
+    jsnap = JustSnap(ctx)
+    jsnap.trace_path = str(tmp_path / "trace.npz")
+    jsnap.start_trace()
+    return ctx, jsnap
+
+def test_operator_queries_recorded(tmp_path):
+    # 测试操作的查询: update_mouse + query_snap_point，后台提取另外提交
+    ctx, jsnap = make_jsnap(tmp_path)
+    try:
+        for x in range(5):
+            event = types.SimpleNamespace(mouse_region_x=900 + x * 10, mouse_region_y=500)
+            jsnap.update_mouse(event)
+            jsnap.query_snap_point()
+        jsnap.submit_request(event)
+        assert len(jsnap.trace) == 5
+    finally:
+        jsnap.exit()
+    clear_scene()
+
+def test_get_snap_point_recorded_once(tmp_path):
+    ctx, jsnap = make_jsnap(tmp_path)
+    try:
+        event = types.SimpleNamespace(mouse_region_x=960, mouse_region_y=540)
+        jsnap.get_snap_point(ctx, event)
+        jsnap.get_snap_point(ctx, event)
+        assert len(jsnap.trace) == 2
+        _, events = trace.load(jsnap.stop_trace())
+        assert [e.mouse for e in events] == [(960, 540)] * 2
+    finally:
+        jsnap.exit()
+    clear_scene()
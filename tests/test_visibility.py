@@ -0,0 +1,148 @@
+import numpy as np
+import pytest
+
+import synthetic
+from just_snap import extract, mesh_update, projection
+from just_snap.visibility import DepthBuffer
+
+# 深度缓冲的遮挡结果与逐点射线求交 (numpy) 的结果比较
+# 不一致只允许出现在轮廓附近 (像素精度)
+
+AGREEMENT_MIN = 0.95
+WIDTH = 1920
+HEIGHT = 1080
+
+
+def ray_visible(obj_data, pts, eye, own=None, eps=1e-4):
+    '''从各点向视点发射线，与物体的三角形都不相交时可见'''
+    # own: 各点所属的面，FACES 的中心不与自身的三角形求交
+    co = obj_data["co"]
+    tris = obj_data["tris"]
+    a = co[tris[:, 0]]
+    e1 = co[tris[:, 1]] - a
+    e2 = co[tris[:, 2]] - a
+    rs = np.ones(len(pts), dtype=bool)
+    for s in range(0, len(pts), 256):
+        p = pts[s:s + 256]
+        d = eye - p
+        length = np.linalg.norm(d, axis=1)[:, None]
+        d = d / length
+        # Möller–Trumbore
+        h = np.cross(d[:, None, :], e2[None])
+        det = np.einsum("ptk,tk->pt", h, e1)
+        ok = np.abs(det) > 1e-12
+        inv = 1 / np.where(ok, det, 1)
+        sv = p[:, None, :] - a[None]
+        u = np.einsum("ptk,ptk->pt", sv, h) * inv
+        q = np.cross(sv, e1[None])
+        v = np.einsum("pk,ptk->pt", d, q) * inv
+        t = np.einsum("tk,ptk->pt", e2, q) * inv
+        hit = ok & (u >= -1e-9) & (v >= -1e-9) & (u + v <= 1 + 1e-9) & (t > eps * length) & (t < length)
+        if own is not None:
+            hit &= obj_data["tri_poly"][None, :] != own[s:s + 256, None]
+        rs[s:s + 256] = ~hit.any(axis=1)
+    return rs
+
+def plates(n=20, gap=0.05):
+    '''两块上下重叠、间隔 gap 的平面，下面一块完全被遮挡'''
+    top = synthetic.grid(n, 2.0)
+    offset = len(top["co"])
+    co = top["co"].copy()
+    co[:, 2] -= gap
+    return {
+        "co": np.concatenate((top["co"], co)),
+        "loop_verts": np.concatenate((top["loop_verts"], top["loop_verts"] + offset)),
+        "loop_start": np.concatenate((top["loop_start"], top["loop_start"] + len(top["loop_verts"]))),
+        "loop_total": np.concatenate((top["loop_total"], top["loop_total"])),
+    }
+
+def compare(mesh, eye, kind):
+    '''返回 (一致的比例, 深度缓冲可见而实际被遮挡的个数)'''
+    obj_data = synthetic.obj_data(mesh)
+    view_matrix, _, persp = synthetic.view(eye, width=WIDTH, height=HEIGHT)
+    view = projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+    idxs = extract.get_idx_in_screen(obj_data, kind, view)
+    pts = obj_data[extract.KIND_KEYS[kind]][idxs]
+    ref = ray_visible(obj_data, pts, np.asarray(eye, dtype=np.float64),
+                      own=idxs if kind == "FACES" else None)
+    depth = np.zeros(len(obj_data[extract.KIND_KEYS[kind]]), dtype=bool)
+    depth[extract.get_visible_idx(obj_data, kind, idxs, view, "DEPTH")] = True
+    depth = depth[idxs]
+    return float((depth == ref).mean()), int((depth & ~ref).sum())
+
+
+@pytest.mark.parametrize("kind", list(extract.KIND_KEYS))
+def test_hidden_plate(kind):
+    # 相对深度的偏移会让间隔小于深度 2% 的整块平面都可见
+    agreement, leaked = compare(plates(), (0.5, 0.7, 6.0), kind)
+    assert leaked == 0
+    assert agreement >= AGREEMENT_MIN
+
+@pytest.mark.parametrize("kind", list(extract.KIND_KEYS))
+@pytest.mark.parametrize("mesh, eye", [
+    (synthetic.sphere(12), (3.0, 2.0, 1.5)),
+    (synthetic.sphere(12), (8.0, 5.0, 4.0)),
+    (synthetic.scan(40), (1.0, -2.0, 2.0)),
+    (synthetic.grid(30), (1.0, -2.0, 2.0)),
+], ids=["sphere", "sphere_far", "scan", "grid"])
+def test_agreement(mesh, eye, kind):
+    agreement, _ = compare(mesh, eye, kind)
+    assert agreement >= AGREEMENT_MIN
+
+def test_buffer_covers_screen_rect():
+    # 只覆盖物体包围矩形的缓冲与整个 region 的缓冲结果相同
+    obj_data = synthetic.obj_data(synthetic.sphere(12))
+    view_matrix, _, persp = synthetic.view((8.0, 5.0, 4.0), width=WIDTH, height=HEIGHT)
+    view = projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+    s2d, depth, _ = extract.project_obj_data(obj_data, view)["VERTS"]
+    full = DepthBuffer(WIDTH, HEIGHT)
+    full.rasterize(s2d, depth, obj_data["tris"])
+    part = extract.get_depth_buffer(obj_data, view)
+    assert part.width * part.height * 4 < full.width * full.height
+    for kind in extract.KIND_KEYS:
+        s2d, depth, mask = extract.project_obj_data(obj_data, view)[kind]
+        assert (part.test(s2d[mask], depth[mask]) == full.test(s2d[mask], depth[mask])).all()
+
+@pytest.mark.parametrize("tiles", [False, True])
+def test_release_after_extraction(tiles):
+    obj_data = synthetic.obj_data(synthetic.sphere(12))
+    view_matrix, _, persp = synthetic.view((3.0, 2.0, 1.5), width=WIDTH, height=HEIGHT)
+    view = projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+    vis = {kind: {"tested": None, "visible": None} for kind in (*extract.KIND_KEYS, extract.SEGMENTS)}
+    mouse = (WIDTH / 2, HEIGHT / 2)
+    if tiles:
+        cols, rows = extract.tile_grid(view)
+        # 先提取鼠标附近的格子，之后还会用到深度缓冲
+        near = extract.tiles_near(mouse, 20, view)
+        for _ in extract.iter_obj_data(obj_data, view, mouse, vis=vis, tiles=near):
+            pass
+        assert "raster" in obj_data
+        rest = np.setdiff1d(np.arange(cols * rows), near)
+        for _ in extract.iter_obj_data(obj_data, view, mouse, vis=vis, tiles=rest):
+            pass
+    else:
+        for _ in extract.iter_obj_data(obj_data, view, mouse, vis=vis):
+            pass
+    assert "depth" not in obj_data
+    assert "raster" not in obj_data
+
+def test_retest_moved_elements():
+    # 编辑模式下下面一块平面移到上面: 之前被遮挡的点可见，上面一块的点被遮挡
+    obj_data = synthetic.obj_data(plates())
+    view_matrix, _, persp = synthetic.view((0.5, 0.7, 6.0), width=WIDTH, height=HEIGHT)
+    view = projection.View(persp, view_matrix, WIDTH, HEIGHT, True)
+    vis = {"tested": None, "visible": None}
+    before = extract.get_kind_data(obj_data, "VERTS", view, vis=vis)["idx"]
+    half = len(obj_data["co"]) // 2
+    top = np.arange(half)
+    bottom = np.arange(half, 2 * half)
+    assert np.isin(before, top).all()
+    co = obj_data["co"].copy()
+    co[bottom, 2] += 0.1
+    moved = mesh_update.update_co(obj_data, co)["VERTS"]
+    assert moved.tolist() == bottom.tolist()
+    visible = extract.retest_idx(obj_data, "VERTS", bottom, view, vis=vis)
+    assert len(visible) >= len(before) * AGREEMENT_MIN
+    assert vis["visible"][bottom].sum() == len(visible)
+    # 重新判断后上面一块的点被遮挡
+    assert len(extract.retest_idx(obj_data, "VERTS", top, view, vis=vis)) == 0